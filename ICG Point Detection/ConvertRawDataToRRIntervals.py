@@ -1,13 +1,19 @@
 import os
 import numpy as np
 from run_qrsdet_by_seg import run_qrsdet_by_seg
-from run_sqrs import run_sqrs
-from wqrsm_fast import wqrsm_fast
+from jqrs import jqrs, jqrs_fir_template, jqrs_merge_kernel
+from chunked_filtfilt import _chunked, chunked_filtfilt
+from compute_backend import backend_from_params
+from run_sqrs import run_sqrs, sqrs_kernel
+from wqrsm_fast import _ltsamp, wqrsm_fast, wqrsm_kernel
 from bsqi import bsqi
-from write_hea import write_hea
-from write_ann import write_ann
+from run_sqi import run_sqi
+from create_window_rr_intervals import create_window_rr_intervals
+from annotation_writer import AnnotationWriter
+from stage_cache import code_version, run_stage
+from instrumentation import span
 
-def ConvertRawDataToRRIntervals(ECG_RawData, HRVparams, subjectID):
+def ConvertRawDataToRRIntervals(ECG_RawData, HRVparams, subjectID, writer=None, cache=None):
     """
     Convert raw ECG data to RR intervals and perform QRS detection and SQI.
 
@@ -15,6 +21,10 @@ def ConvertRawDataToRRIntervals(ECG_RawData, HRVparams, subjectID):
         ECG_RawData: np.ndarray - raw ECG signal in mV (1D array or Nx1 array)
         HRVparams: dict or object - HRV analysis settings
         subjectID: str - identifier for the record
+        writer: AnnotationWriter - optional output sink for the .hea/annotation
+            files; when omitted a private one is used and flushed before returning
+        cache: StageCache - optional; QRS detections and SQI are reused when the
+            ECG, the Fs/PeakDetect/sqi settings and the detector code are unchanged
 
     Returns:
         t: np.ndarray - RR interval time points (s)
@@ -30,33 +40,49 @@ def ConvertRawDataToRRIntervals(ECG_RawData, HRVparams, subjectID):
     GainQrsDetect = 2000
 
     # QRS detection
-    jqrs_ann = run_qrsdet_by_seg(ECG_RawData, HRVparams)
-    sqrs_ann = run_sqrs(ECG_RawData * GainQrsDetect, HRVparams, 0)
-    wqrs_ann = wqrsm_fast(ECG_RawData * GainQrsDetect, HRVparams['Fs'])
-
-    # SQI comparison
-    SQIjs, StartSQIwindows_js = bsqi(jqrs_ann, sqrs_ann, HRVparams)
-    SQIjw, StartSQIwindows_jw = bsqi(jqrs_ann, wqrs_ann, HRVparams)
-
-    # RR interval and timing
-    rr = np.diff(jqrs_ann) / HRVparams['Fs']
-    t = np.array(jqrs_ann[1:]) / HRVparams['Fs']
+    def detect():
+        with span('jqrs'):
+            jqrs_ann = run_qrsdet_by_seg(ECG_RawData, HRVparams)
+        with span('sqrs'):
+            sqrs_ann = run_sqrs(ECG_RawData * GainQrsDetect, HRVparams, 0)
+        with span('wqrs'):
+            wqrs_ann = wqrsm_fast(ECG_RawData * GainQrsDetect, HRVparams['Fs'], backend=backend_from_params(HRVparams))
+        return jqrs_ann, sqrs_ann, wqrs_ann
+
+    qrs_params = {'Fs': HRVparams['Fs'], 'PeakDetect': HRVparams['PeakDetect']}
+    (jqrs_ann, sqrs_ann, wqrs_ann), qrs_key = run_stage(
+        cache, 'qrs', detect, ECG_RawData, params=qrs_params,
+        version=lambda: code_version(run_qrsdet_by_seg, jqrs, jqrs_fir_template, jqrs_merge_kernel,
+                                     chunked_filtfilt, _chunked, run_sqrs, sqrs_kernel,
+                                     wqrsm_fast, wqrsm_kernel, _ltsamp))
 
     # Create Annotation Folder
+    own_writer = writer is None
+    if own_writer:
+        writer = AnnotationWriter()
     WriteAnnotationFolder = os.path.join(HRVparams['writedata'], 'Annotation')
-    os.makedirs(WriteAnnotationFolder, exist_ok=True)
-    print(f'Creating a new folder: "Annotation", folder is located in {WriteAnnotationFolder}')
+    if not writer.in_memory:
+        print(f'Creating a new folder: "Annotation", folder is located in {WriteAnnotationFolder}')
 
+    # Save annotations (written in the background while SQI is computed)
     AnnFile = os.path.join(WriteAnnotationFolder, subjectID)
-    write_hea(AnnFile, HRVparams['Fs'], len(ECG_RawData), 'jqrs', 1, 0, 'mV')
+    writer.write_hea(AnnFile, HRVparams['Fs'], len(ECG_RawData), 'jqrs', 1, 0, 'mV')
+    writer.write_ann(AnnFile, HRVparams, 'jqrs', jqrs_ann)
+    writer.write_ann(AnnFile, HRVparams, 'sqrs', sqrs_ann)
+    writer.write_ann(AnnFile, HRVparams, 'wqrs', wqrs_ann)
 
-    # Save annotations
-    write_ann(AnnFile, HRVparams, 'jqrs', jqrs_ann)
-    write_ann(AnnFile, HRVparams, 'sqrs', sqrs_ann)
-    write_ann(AnnFile, HRVparams, 'wqrs', wqrs_ann)
+    # SQI comparison
+    def sqi():
+        with span('bsqi'):
+            return bsqi(jqrs_ann, sqrs_ann, HRVparams), bsqi(jqrs_ann, wqrs_ann, HRVparams)
 
-    fakeAnnType = ['S'] * len(SQIjs)
-    SQIjw_array = np.array(SQIjw)
+    ((SQIjs, StartSQIwindows_js), (SQIjw, StartSQIwindows_jw)), _ = run_stage(
+        cache, 'sqi', sqi, qrs_key,
+        params={'Fs': HRVparams['Fs'], 'sqi': HRVparams['sqi']}, version=lambda: code_version(bsqi, run_sqi, create_window_rr_intervals))
+
+    # RR interval and timing
+    rr = np.diff(jqrs_ann) / HRVparams['Fs']
+    t = np.array(jqrs_ann[1:]) / HRVparams['Fs']
 
     # 将 list 转换为 numpy array
     SQIjw_array = np.array(SQIjw)
@@ -67,51 +93,12 @@ def ConvertRawDataToRRIntervals(ECG_RawData, HRVparams, subjectID):
         print("Warning: SQIjw contains NaN. Replacing with 0.")
         SQIjw_array = np.nan_to_num(SQIjw_array)
 
-    # 修正类型不匹配
-    if not isinstance(fakeAnnType, list):
-        fakeAnnType = ['S'] * len(SQIjw_array)
-    elif len(fakeAnnType) != len(SQIjw_array):
-        print("Warning: fakeAnnType length mismatch. Regenerating...")
-        fakeAnnType = ['S'] * len(SQIjw_array)
+    fakeAnnType = ['S'] * len(SQIjw_array)
 
     # 输出长度确认
     print("Lengths:", len(StartSQIwindows_array), len(fakeAnnType), len(SQIjw_array))
 
-    # ✅ 正确调用 write_ann：一定要用转换后的 numpy array
-    write_ann(
-        AnnFile,
-        HRVparams,
-        'sqijs',
-        (StartSQIwindows_array * HRVparams['Fs']).astype(int),
-        fakeAnnType,
-        (SQIjw_array * 100).round().astype(int)
-    )
-
-
-    
-    fakeAnnType = ['S'] * len(SQIjw)
-
-    # 转成 numpy array（确保在 write_ann 前执行）
-    StartSQIwindows_array = np.array(StartSQIwindows_jw)
-    SQIjw_array = np.array(SQIjw)
-
-    # 替换 NaN 为 0
-    if np.isnan(SQIjw_array).any():
-        print("Warning: SQIjw contains NaN. Replacing with 0.")
-        SQIjw_array = np.nan_to_num(SQIjw_array)
-
-    # 检查类型匹配
-    if not isinstance(fakeAnnType, list):
-        fakeAnnType = ['S'] * len(SQIjw_array)
-    elif len(fakeAnnType) != len(SQIjw_array):
-        print("Warning: fakeAnnType length mismatch. Regenerating...")
-        fakeAnnType = ['S'] * len(SQIjw_array)
-
-    # 检查长度
-    print("Lengths:", len(StartSQIwindows_array), len(fakeAnnType), len(SQIjw_array))
-
-    # ✅ 正确调用
-    write_ann(
+    writer.write_ann(
         AnnFile,
         HRVparams,
         'sqijs',
@@ -120,5 +107,7 @@ def ConvertRawDataToRRIntervals(ECG_RawData, HRVparams, subjectID):
         (SQIjw_array * 100).round().astype(int)
     )
 
+    if own_writer:
+        writer.close()
 
     return t, rr, jqrs_ann, SQIjw, StartSQIwindows_jw
@@ -1,7 +1,7 @@
 import os
 from datetime import datetime
 
-def InitializeHRVparams(project_name='none'):
+def InitializeHRVparams(project_name='none', makedirs=True):
     HRVparams = {}
 
     # 1. Project settings
@@ -26,7 +26,8 @@ def InitializeHRVparams(project_name='none'):
         HRVparams['writedata'] = f'{project_name}_Results'
         HRVparams['ext'] = ''
 
-    os.makedirs(HRVparams['writedata'], exist_ok=True)
+    if makedirs:
+        os.makedirs(HRVparams['writedata'], exist_ok=True)
 
     # 2. Confidence level
     HRVparams['data_confidence_level'] = 1
@@ -191,4 +192,83 @@ def InitializeHRVparams(project_name='none'):
     HRVparams['time'] = datetime.now().strftime('%Y%m%d')
     HRVparams['filename'] = f"{HRVparams['time']}_{project_name}"
 
+    # 20. ICG denoising / BCX
+    HRVparams['ICG'] = {
+        'bandpass': [0.5, 40],
+        'filter_order': 4,
+        'filter_chunk': 262144,   # band-pass in chunks of this many samples (plus halo)
+        'filter_workers': None,   # threads for the chunks, None = os.cpu_count()
+        'beat_pre': 0.15,
+        'dtype': 'float64',     # working sample type, 'float32' halves memory
+        'wavelets': ['db4', 'sym8'],   # [] skips the wavelet stage
+        'wavelet_level': 3,
+        'eemd': 1,              # 0 skips EEMD
+        'eemd_trials': 100,     # EEMD ensemble size
+        'eemd_parallel': 1,     # 1: trials in a PyEMD process pool per beat, 0: in-process
+        'eemd_processes': None, # size of that pool, None = os.cpu_count()
+        'eemd_max_imfs': 10,
+        'lms': 1,               # 0 skips the LMS stage
+        'lms_mu': 0.01,
+        'lms_order': 5,
+        'gating': 0,            # 1: skip denoising of beats with low bSQI / ICG quality
+        # thresholds calibrated on synthetic recordings with motion artifacts:
+        # no clean beat rejected, about half of the artifact beats
+        'min_beat_sqi': 0.8,    # None: sqi['LowQualityThreshold']
+        'min_icg_quality': 0.8,
+        'max_amp_ratio': 3.0,
+        # ensemble mode (ICGPipeline.process_ensemble): groups of N beats or T seconds
+        'ensemble': {
+            'group_beats': 30,
+            'group_seconds': None,
+            'step': None,       # group shift (beats / s), None: non-overlapping groups
+            'trim': 0.1         # trimmed-mean proportion cut at each end
+        },
+        # multi-rate mode (ICGPipeline.process_multirate): denoise at fs / decimate,
+        # refine B/C/X at fs on the band-passed signal within +-half_width decimated samples
+        'multirate': {
+            'decimate': 4,
+            'half_width': 2
+        },
+        # EEMD time budget (s), beats over budget fall back to wavelet-only denoising
+        'budget': {
+            'beat_seconds': None,
+            'recording_seconds': None
+        }
+    }
+
+    # 21. Stage cache (content-addressed, LRU evicted beyond max_bytes)
+    HRVparams['cache'] = {
+        'on': 0,
+        'folder': os.path.join(HRVparams['writedata'], 'cache'),
+        'max_bytes': 2 * 1024**3
+    }
+
+    # 22. Sample-loop kernels (LMS, SQRS, wqrsm, jqrs peak merge)
+    # 'auto' = numba when installed, else the pure Python reference; 'python' / 'numba' to force
+    HRVparams['compute'] = {
+        'backend': 'auto'
+    }
+
+    # 23. Stage timing / memory instrumentation (instrumentation.py)
+    # report: JSON per run, trace: optional Chrome trace file
+    # memory: peak allocation per stage via tracemalloc (slows EEMD ~10x, profile time separately)
+    HRVparams['instrumentation'] = {
+        'on': 0,
+        'memory': 0,
+        'report': None,
+        'trace': None
+    }
+
+    # 24. Memory budget (memory_budget.py)
+    # budget_bytes: peak memory of one run (process RSS), None = unlimited; memory_budget.plan()
+    # fits a run into it by shrinking the band-pass chunks/threads, dropping the outputs below
+    # and, if allow_float32, switching to float32
+    HRVparams['memory'] = {
+        'budget_bytes': None,
+        'allow_float32': 1,
+        'keep_filtered': 1,      # 0: process() returns None for filtered_icg
+        'keep_beats_clean': 1,   # 0: ... for beats_clean
+        'keep_full_signal': 1    # 0: ... for denoised_icg_full (no overlap-add)
+    }
+
     return HRVparams
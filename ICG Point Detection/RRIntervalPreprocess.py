@@ -0,0 +1,166 @@
+import numpy as np
+
+# Reason codes of the flags returned by RRIntervalPreprocess
+RR_OK = 0
+RR_UNPHYSIOLOGICAL = 1
+RR_OUTLIER = 2
+RR_ECTOPIC = 3
+RR_GAP = 4
+
+
+def _running_median(x, half_width):
+    """Centred running median with reflected edges."""
+    if len(x) == 0:
+        return x.copy()
+    padded = np.pad(x, half_width, mode='reflect' if len(x) > half_width else 'edge')
+    return np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * half_width + 1), axis=1)
+
+
+def _interpolate(t, x, good, method):
+    from scipy.interpolate import PchipInterpolator, CubicSpline
+    if good.sum() < 2:
+        return x
+    if method in ('pchip', 'cub'):
+        f = PchipInterpolator(t[good], x[good], extrapolate=True)
+    elif method == 'spline':
+        f = CubicSpline(t[good], x[good])
+    else:
+        return np.interp(t, t[good], x[good])
+    return f(t)
+
+
+def RRIntervalPreprocess(rr, t, HRVparams, annotations=None):
+    """
+    Clean an RR interval series once, for every downstream window and metric.
+
+    All steps run as array operations over the full series:
+      1. intervals outside preprocess['lowerphysiolim'/'upperphysiolim'] are
+         flagged as unphysiological;
+      2. intervals longer than preprocess['gaplimit'] are flagged as gaps
+         (never interpolated across);
+      3. intervals deviating from the running median of the surrounding
+         2 * preprocess['forward_gap'] + 1 intervals by more than
+         preprocess['per_limit'] are flagged as outliers;
+      4. if beat annotations are given, the intervals around non-'N' beats
+         (ectopic/PVC) are flagged.
+    Flagged intervals are removed ('rem') or interpolated ('pchip', 'spline',
+    'lin') according to method_unphysio / method_outliers; gaps are always
+    removed.
+
+    Parameters:
+        rr (np.ndarray): RR intervals (s)
+        t (np.ndarray): Time of each interval (s)
+        HRVparams (dict): Uses the 'preprocess' section
+        annotations (list of str): Optional beat type per interval
+
+    Returns:
+        NN (np.ndarray): Cleaned NN intervals (s)
+        tNN (np.ndarray): Time of each NN interval (s)
+        flags (np.ndarray): Reason code per input interval (RR_OK, ...)
+        keep (np.ndarray): Boolean mask of the input intervals kept in NN
+    """
+    p = HRVparams['preprocess']
+    rr = np.asarray(rr, dtype=float)
+    t = np.asarray(t, dtype=float)
+    flags = np.full(len(rr), RR_OK, dtype=np.int8)
+
+    unphysio = (rr < p['lowerphysiolim']) | (rr > p['upperphysiolim']) | np.isnan(rr)
+    flags[unphysio] = RR_UNPHYSIOLOGICAL
+    gap = rr > p['gaplimit']
+    flags[gap] = RR_GAP
+
+    # Reference for the percent-change test built from physiological beats only
+    physio = ~unphysio
+    ref = np.full(len(rr), np.nan)
+    if physio.any():
+        med = _running_median(rr[physio], max(int(p['forward_gap']), 1))
+        ref = np.interp(np.arange(len(rr)), np.flatnonzero(physio), med)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outlier = physio & (np.abs(rr - ref) / ref > p['per_limit'])
+    flags[outlier] = RR_OUTLIER
+
+    if annotations is not None:
+        ectopic = np.array([a != 'N' for a in annotations], dtype=bool)[:len(rr)]
+        # An ectopic beat corrupts the interval ending at it and the one after it
+        ectopic = ectopic | np.concatenate(([False], ectopic[:-1]))
+        flags[ectopic & (flags == RR_OK)] = RR_ECTOPIC
+
+    NN = rr.copy()
+    remove = gap.copy()
+    for mask, method in ((unphysio & ~gap, p['method_unphysio']),
+                         ((flags == RR_OUTLIER) | (flags == RR_ECTOPIC), p['method_outliers'])):
+        if not mask.any():
+            continue
+        if method == 'rem':
+            remove |= mask
+        else:
+            NN[mask] = _interpolate(t, rr, flags == RR_OK, method)[mask]
+
+    keep = ~remove
+    return NN[keep], t[keep], flags, keep
+
+
+def reject_windows(windows, t, flags, HRVparams, SQI=None, StartSQIwindows=None, windowlength=None):
+    """
+    Reject analysis windows with too much low-quality data.
+
+    An input interval is low quality when RRIntervalPreprocess flagged it
+    or, with SQI windows given, when the bSQI of its beat
+    (beat_quality.beat_sqi) is below sqi['LowQualityThreshold']. A window
+    is rejected (NaN) when more than RejectionThreshold of its intervals
+    are low quality. Counts come from one cumulative sum over the series.
+
+    Parameters:
+        windows (list): Window start times (s), NaN for rejected windows
+        t (np.ndarray): Time of each input interval (s), increasing
+        flags (np.ndarray): Reason codes from RRIntervalPreprocess
+        HRVparams (dict): Uses RejectionThreshold, Fs, sqi and 'windowlength'
+            (when windowlength is None)
+        SQI, StartSQIwindows (np.ndarray): Optional bSQI windows, e.g. SQIjw
+            from ConvertRawDataToRRIntervals
+
+    Returns:
+        list: Window start times, NaN for rejected windows
+    """
+    if windowlength is None:
+        windowlength = HRVparams['windowlength']
+    t = np.asarray(t, dtype=float)
+    bad = np.asarray(flags) != RR_OK
+    if SQI is not None and StartSQIwindows is not None and len(SQI):
+        from beat_quality import beat_sqi
+        sqi = beat_sqi(t * HRVparams['Fs'], SQI, StartSQIwindows, HRVparams)
+        bad |= sqi < HRVparams['sqi']['LowQualityThreshold']
+
+    starts = np.asarray(windows, dtype=float)
+    valid = ~np.isnan(starts)
+    s = np.where(valid, starts, 0.0)
+    i0 = np.searchsorted(t, s, side='left')
+    i1 = np.searchsorted(t, s + windowlength, side='left')
+    cs = np.concatenate(([0], np.cumsum(bad)))
+    n = i1 - i0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(n > 0, (cs[i1] - cs[i0]) / n, 1.0)
+    keep = valid & (frac <= HRVparams['RejectionThreshold'])
+    return [float(w) if k else np.nan for w, k in zip(starts, keep)]
+
+
+def preprocess_rr(rr, t, HRVparams, annotations=None, SQI=None, StartSQIwindows=None):
+    """
+    Clean an RR series once and derive the analysis windows from the result.
+
+    Runs RRIntervalPreprocess, creates the windows on the cleaned NN series
+    (create_window_rr_intervals measures coverage on NN, so removed
+    intervals count as missing data) and rejects windows with reject_windows().
+    The HRV engines (hrv_metrics.compute_hrv_metrics,
+    nonlinear_metrics.compute_nonlinear_metrics) take tNN, NN and windows
+    from here as they are.
+
+    Returns:
+        dict: NN, tNN, flags, keep (see RRIntervalPreprocess) and windows
+    """
+    from create_window_rr_intervals import create_window_rr_intervals
+
+    NN, tNN, flags, keep = RRIntervalPreprocess(rr, t, HRVparams, annotations)
+    windows = create_window_rr_intervals(tNN, NN, HRVparams) if len(tNN) else []
+    windows = reject_windows(windows, t, flags, HRVparams, SQI, StartSQIwindows)
+    return {'NN': NN, 'tNN': tNN, 'flags': flags, 'keep': keep, 'windows': windows}
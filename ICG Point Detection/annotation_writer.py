@@ -0,0 +1,130 @@
+import os
+import queue
+import threading
+
+import numpy as np
+
+from instrumentation import span
+from write_ann import write_ann
+from write_hea import write_hea
+
+
+class AnnotationWriter:
+    """
+    Output sink for the WFDB header and annotation files of a record.
+
+    Writes are queued and performed by a background thread, so detection and
+    SQI computation do not wait on disk I/O. Every (record, annotator)
+    artifact has one entry in `records`; resubmitting it (e.g. a subject
+    processed again with the same writer) replaces the earlier data and
+    rewrites the file, and since jobs run in submission order the last
+    submission is what ends up on disk. With in_memory=True nothing is
+    written to disk and the submitted data is only kept in `records`.
+
+    Usage:
+        with AnnotationWriter() as writer:
+            writer.write_ann(AnnFile, HRVparams, 'jqrs', jqrs_ann)
+        # all files are on disk here
+    """
+
+    def __init__(self, in_memory=False):
+        self.in_memory = in_memory
+        self.records = {}
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = None
+        if not in_memory:
+            self._thread = threading.Thread(target=self._run, name='AnnotationWriter', daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                folder = os.path.dirname(args[0])
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                with span(func.__name__):
+                    func(*args, **kwargs)
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _submit(self, key, data, func, args, kwargs):
+        if self._closed:
+            raise RuntimeError("AnnotationWriter is closed")
+        new = key not in self.records
+        self.records[key] = data
+        if not self.in_memory:
+            self._queue.put((func, args, kwargs))
+        return new
+
+    def write_hea(self, record_name, fs, datapoints, annotator, gain, offset, unit='mV'):
+        """
+        Queue a .hea header, same arguments as write_hea().
+
+        Returns:
+            bool: False if it replaced an earlier header of this record
+        """
+        args = (record_name, fs, datapoints, annotator, gain, offset, unit)
+        data = {'fs': fs, 'datapoints': datapoints, 'annotator': annotator,
+                'gain': gain, 'offset': offset, 'unit': unit}
+        return self._submit((record_name, 'hea'), data, write_hea, args, {})
+
+    def write_ann(self, record_name, HRVparams, annotator, ann, ann_type='N', sub_type=0,
+                  chan=0, num=0, comments=''):
+        """
+        Queue an annotation file, same arguments as write_ann().
+
+        The annotation arrays are copied on submission, so the caller may
+        reuse its buffers before the file is written.
+
+        Returns:
+            bool: False if it replaced an earlier submission of this annotator
+                for the record
+        """
+        if isinstance(ann, tuple):
+            ann = tuple(np.array(a) for a in ann)
+        else:
+            ann = np.array(ann)
+        if not isinstance(ann_type, str):
+            ann_type = list(ann_type)
+        if not isinstance(sub_type, int):
+            sub_type = np.array(sub_type)
+
+        args = (record_name, {'output': dict(HRVparams['output'])}, annotator, ann,
+                ann_type, sub_type, chan, num, comments)
+        data = {'ann': ann, 'ann_type': ann_type, 'sub_type': sub_type}
+        return self._submit((record_name, annotator), data, write_ann, args, {})
+
+    def flush(self):
+        """Block until every queued write is on disk; re-raise the first write error."""
+        if self._thread is not None:
+            self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        """Flush pending writes and stop the background thread."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
@@ -0,0 +1,400 @@
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+
+from load_ecg_icg import CSV_EXTS
+from signal_archive import ARCHIVE_EXT
+
+RECORDING_EXTS = ('.xlsx', '.xls', ARCHIVE_EXT, '.hea') + CSV_EXTS
+MANIFEST_NAME = 'manifest.json'
+
+# Per-process pipeline, built once by the pool initializer and reused for every subject
+_pipeline = None
+# Queue on which workers announce the subject they start (see _run_pool())
+_started = None
+
+# process() outputs the batch saves; the others may be dropped under a memory budget
+BATCH_OUTPUTS = ('denoised_icg_full',)
+
+
+def discover_recordings(source):
+    """
+    List the recordings of a batch.
+
+    Parameters:
+        source (str): A directory (searched recursively for RECORDING_EXTS),
+            a .json manifest ({"recordings": {subject: {"path": ...}}} or a
+            list of paths) or a text file with one path per line
+
+    Returns:
+        dict: subject -> absolute path; the subject is the file name without
+            extension (e.g. RawData_Subject_1_task_BL)
+    """
+    paths = []
+    if os.path.isdir(source):
+        for folder, _, files in os.walk(source):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in RECORDING_EXTS and not name.startswith('~$'):
+                    paths.append(os.path.join(folder, name))
+    elif source.lower().endswith('.json'):
+        with open(source) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return {s: os.path.abspath(e['path']) for s, e in data.get('recordings', data).items()}
+        paths = list(data)
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            paths = [os.path.join(base, line.strip()) for line in f if line.strip() and not line.startswith('#')]
+
+    recordings = {}
+    for path in paths:
+        subject = os.path.splitext(os.path.basename(path))[0]
+        if subject.endswith('_converted'):
+            subject = subject[:-len('_converted')]
+        if subject in recordings:
+            raise ValueError(f"Duplicate subject {subject!r}: {recordings[subject]} and {path}")
+        recordings[subject] = os.path.abspath(path)
+    return recordings
+
+
+def _recording_size(path):
+    """Bytes on disk; WFDB records count their .dat file."""
+    if path.lower().endswith('.hea'):
+        dat = os.path.splitext(path)[0] + '.dat'
+        if os.path.exists(dat):
+            return os.path.getsize(dat)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'recordings': {}}
+
+
+def save_manifest(manifest, path):
+    """Write the manifest atomically, so an interrupted run never leaves it truncated."""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _init_worker(fs, HRVparams, started=None):
+    global _pipeline, _started
+    _started = started
+    # PyEMD imports matplotlib when it is loaded; keep that import off the GUI toolkits
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from InitializeHRVparams import InitializeHRVparams
+    from icg_pipeline import ICGPipeline
+    HRVparams = copy.deepcopy(HRVparams) if HRVparams is not None else InitializeHRVparams('Excel_ECG_ICG',
+                                                                                          makedirs=False)
+    # 每个工作进程已占一个核, EEMD 试验不再各自开进程池 (否则约 cpu_count**2 个进程)
+    HRVparams['ICG']['eemd_parallel'] = 0
+    _pipeline = ICGPipeline(fs, HRVparams)
+
+
+def process_recording(subject, path, output_dir, fs=1000, memory_budget=None):
+    """
+    Run the pipeline on one recording and save its outputs.
+
+    Writes <output_dir>/<subject>/<subject>.npz (beats, denoised signal,
+    R peaks, B/C/X, beats rejected by quality gating, beats denoised
+    wavelet-only after a missed EEMD deadline) and appends the beat table to <output_dir>/beats.
+    With HRVparams['instrumentation']['on'] the stage timings go to
+    <output_dir>/<subject>/<subject>.profile.json.
+
+    With a memory_budget (bytes or e.g. '2G', this process) the recording
+    is checked with memory_budget.check() from its header before loading,
+    or right after loading when it has none, and MemoryBudgetError is
+    raised instead of processing it.
+
+    Returns:
+        dict: Output paths and the number of beats ('memory': estimated
+            and actual peak under a budget)
+    """
+    import contextlib
+
+    from beat_store import BeatStore, build_beat_table
+    from instrumentation import instrumentation_from_params
+    from load_ecg_icg import load_ecg_icg, recording_length
+    from memory_budget import PeakMemory, check, usage_report
+    from time_budget import RunStats
+
+    if _pipeline is None:
+        _init_worker(fs, None)
+    budget = memory_budget or _pipeline.HRVparams.get('memory', {}).get('budget_bytes')
+    estimate = None
+    if budget:
+        info = recording_length(path)
+        if info is not None:
+            estimate = check(info[0], _pipeline.fs, _pipeline.HRVparams, budget)
+    subject_dir = os.path.join(output_dir, subject)
+    os.makedirs(subject_dir, exist_ok=True)
+    profile = os.path.join(subject_dir, f'{subject}.profile.json')
+    peak = None
+    with instrumentation_from_params(_pipeline.HRVparams, profile):
+        ecg, icg = load_ecg_icg(path, dtype=_pipeline.dtype)
+        if budget and estimate is None:
+            estimate = check(len(ecg), _pipeline.fs, _pipeline.HRVparams, budget, loaded_dtype=ecg.dtype)
+        stats = RunStats()
+        with PeakMemory() if budget else contextlib.nullcontext() as peak:
+            beats_clean, beats_denoised, beat_len, filtered_icg, denoised_icg_full, valid_R_peaks, rejected, sqi = \
+                _pipeline.process(ecg, icg, subjectID=subject, return_rejected=True, stats=stats, return_sqi=True)
+            b_rel, c_rel, x_rel = _pipeline.extract_bcx(beats_denoised)
+
+    npz = os.path.join(subject_dir, f'{subject}.npz')
+    np.savez_compressed(npz, beats_denoised=beats_denoised, denoised_icg_full=denoised_icg_full,
+                        valid_R_peaks=np.asarray(valid_R_peaks), b_rel=b_rel, c_rel=c_rel, x_rel=x_rel,
+                        beat_len=beat_len, fs=_pipeline.fs, rejected_R_peaks=rejected['R_peaks'],
+                        rejected_reason=rejected['reason'], fallback_R_peaks=np.asarray(stats.fallback_R_peaks, dtype=int))
+
+    table = build_beat_table(subject, valid_R_peaks, b_rel, c_rel, x_rel, fs=_pipeline.fs,
+                             session_start=datetime.fromtimestamp(os.path.getmtime(path)),
+                             llim_beat=_pipeline.llim_beat, **sqi)
+    beats = os.path.join(output_dir, 'beats')
+    BeatStore(beats).append(table)
+    outputs = {'npz': npz, 'beats': beats, 'num_beats': len(valid_R_peaks), 'num_rejected': len(rejected['R_peaks']),
+               'eemd': stats.as_dict()}
+    if budget:
+        outputs['memory'] = usage_report(estimate, peak)
+    return outputs
+
+
+def _run_one(subject, path, output_dir, fs, memory_budget=None):
+    """Worker entry point: never raises, so one bad subject cannot abort the batch."""
+    if _started is not None:
+        _started.put(subject)
+    t0 = time.time()
+    try:
+        outputs = process_recording(subject, path, output_dir, fs, memory_budget)
+        return {'status': 'done', 'elapsed': time.time() - t0, 'outputs': outputs, 'error': None}
+    except Exception as e:
+        return {'status': 'failed', 'elapsed': time.time() - t0, 'outputs': {},
+                'error': f'{type(e).__name__}: {e}', 'traceback': traceback.format_exc()}
+
+
+def _plan_memory(todo, entries, budget, workers, fs, HRVparams):
+    """
+    Fit the batch into a total memory budget: recordings whose header shows
+    they cannot fit even alone are failed up front, the worker count and
+    settings are planned for the longest of the others
+    (memory_budget.plan_workers()).
+
+    Returns:
+        (int, dict, int, dict): workers, HRVparams, budget per worker,
+            subject -> error of the recordings that cannot fit
+    """
+    from load_ecg_icg import recording_length
+    from memory_budget import PROCESS_OVERHEAD, MemoryBudgetError, describe, plan, plan_workers
+
+    if HRVparams is None:
+        from InitializeHRVparams import InitializeHRVparams
+        HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+    lengths, too_long = {}, {}
+    for subject in todo:
+        info = recording_length(entries[subject]['path'])
+        if info is None:
+            continue
+        try:
+            plan(info[0], fs, HRVparams, budget, BATCH_OUTPUTS, overhead_bytes=PROCESS_OVERHEAD)
+            lengths[subject] = info[0]
+        except MemoryBudgetError as e:
+            too_long[subject] = f'MemoryBudgetError: {e}'
+    # 长度未知的记录 (CSV/Excel) 按 1 小时规划, 由工作进程在读取后检查
+    longest = max(lengths.values(), default=3600 * fs)
+    workers, HRVparams, worker_budget, estimate = plan_workers(longest, fs, HRVparams, budget, workers,
+                                                               BATCH_OUTPUTS)
+    print(f"{describe(estimate)} per worker (longest recording), {workers} workers")
+    return workers, HRVparams, worker_budget, too_long
+
+
+def _finish(manifest, manifest_path, subject, result):
+    entry = manifest['recordings'][subject]
+    entry.pop('traceback', None)  # 重试成功后不保留上次失败的堆栈
+    result['finished'] = datetime.now().isoformat(timespec='seconds')
+    entry.update(result)
+    save_manifest(manifest, manifest_path)
+    print(f"[{result['status']}] {subject}" + (f" ({result['elapsed']:.1f} s)" if result['elapsed'] else '')
+          + (f": {result['error']}" if result['error'] else ''))
+
+
+def _run_pool(subjects, manifest, manifest_path, workers, fs, HRVparams, output_dir, worker_budget):
+    """
+    Run subjects in one process pool until they finish or the pool breaks.
+
+    Workers announce each subject on a queue when they start it, which is
+    when its manifest status becomes 'running'. When a worker dies (e.g. out
+    of memory) the pool is broken and every unfinished future fails; the
+    subjects that were running at that moment are the suspects.
+
+    Returns:
+        (list, list): subjects never started and suspects, both empty when
+            the pool finished normally
+    """
+    entries = manifest['recordings']
+    started = multiprocessing.SimpleQueue()
+    running, finished = set(), set()
+
+    def drain():
+        changed = False
+        while not started.empty():
+            subject = started.get()
+            if subject not in finished:
+                running.add(subject)
+                entries[subject].update({'status': 'running',
+                                         'started': datetime.now().isoformat(timespec='seconds')})
+                changed = True
+        if changed:
+            save_manifest(manifest, manifest_path)
+
+    broken = False
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(fs, HRVparams, started)) as pool:
+        futures = {pool.submit(_run_one, subject, entries[subject]['path'], output_dir, fs, worker_budget): subject
+                   for subject in subjects}
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, timeout=1.0, return_when=FIRST_COMPLETED)
+            drain()
+            for future in done:
+                subject = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    continue
+                running.discard(subject)
+                finished.add(subject)
+                _finish(manifest, manifest_path, subject, result)
+    drain()
+    if not broken:
+        return [], []
+    unfinished = [s for s in subjects if s not in finished]
+    suspects = [s for s in unfinished if s in running] or unfinished
+    for subject in unfinished:
+        entries[subject]['status'] = 'pending'
+    save_manifest(manifest, manifest_path)
+    return [s for s in unfinished if s not in suspects], suspects
+
+
+def run_batch(source, output_dir, workers=None, fs=1000, HRVparams=None, resume=True, retry_failed=False,
+              memory_budget=None):
+    """
+    Process many recordings in parallel with a resumable manifest.
+
+    Subjects are submitted largest file first, so long recordings do not
+    end up alone at the tail of the run. <output_dir>/manifest.json holds
+    the status ('pending', 'running', 'done', 'failed'), timing, outputs and
+    error of every subject and is rewritten when each one starts and
+    finishes. With resume=True subjects already 'done' (and failed ones
+    unless retry_failed) are skipped.
+
+    A worker that dies takes the whole process pool down. The pool is then
+    rebuilt and the unfinished subjects resubmitted; the ones that were
+    running when it broke are rerun one at a time in a single-worker pool,
+    and only a subject that crashes there is marked failed.
+
+    Parameters:
+        source (str): Directory or list of recordings, see discover_recordings()
+        output_dir (str): Output folder
+        workers (int): Number of processes (os.cpu_count() when None)
+        fs (int): Sampling frequency (Hz)
+        HRVparams (dict): Pipeline settings; InitializeHRVparams defaults when None
+        memory_budget (int or str): Total peak memory of the workers, e.g.
+            '8G' (HRVparams['memory']['budget_bytes'] when None); sets the
+            number of workers and the settings, see _plan_memory()
+
+    Returns:
+        dict: The manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if resume else {'recordings': {}}
+    entries = manifest['recordings']
+
+    todo = []
+    for subject, path in discover_recordings(source).items():
+        entry = entries.setdefault(subject, {'path': path, 'status': 'pending'})
+        entry['path'] = path
+        entry['size'] = _recording_size(path)
+        if entry['status'] == 'done' and all(os.path.exists(p) for p in entry.get('outputs', {}).values()
+                                             if isinstance(p, str)):
+            continue
+        if entry['status'] == 'failed' and resume and not retry_failed:
+            continue
+        entry['status'] = 'pending'
+        todo.append(subject)
+    todo.sort(key=lambda s: entries[s]['size'], reverse=True)
+    manifest.update({'source': os.path.abspath(source), 'started': datetime.now().isoformat(timespec='seconds')})
+
+    budget = memory_budget or (HRVparams or {}).get('memory', {}).get('budget_bytes')
+    worker_budget = None
+    if budget and todo:
+        workers, HRVparams, worker_budget, too_long = _plan_memory(todo, entries, budget, workers, fs, HRVparams)
+        for subject, error in too_long.items():
+            # 放不下的记录直接标记失败, 不再提交
+            entries[subject].update({'status': 'failed', 'elapsed': None, 'outputs': {}, 'error': error,
+                                     'finished': datetime.now().isoformat(timespec='seconds')})
+            print(f"[failed] {subject}: {error}")
+        todo = [s for s in todo if s not in too_long]
+    save_manifest(manifest, manifest_path)
+
+    print(f"{len(todo)} of {len(entries)} recordings to process, {workers or os.cpu_count()} workers")
+    crash = {'status': 'failed', 'elapsed': None, 'outputs': {},
+             'error': 'BrokenProcessPool: the worker process died (e.g. out of memory)'}
+    pending, isolate = todo, []
+    while pending or isolate:
+        if pending:
+            pending, suspects = _run_pool(pending, manifest, manifest_path, workers, fs, HRVparams,
+                                          output_dir, worker_budget)
+            if len(suspects) == 1:
+                _finish(manifest, manifest_path, suspects[0], dict(crash))
+            elif suspects:
+                # 崩溃时同时在运行的记录逐个单独重跑, 只把自己崩溃的记录标记为失败
+                print(f"A worker died while running {', '.join(suspects)}; rerunning them one at a time")
+                isolate += suspects
+        else:
+            subject = isolate.pop(0)
+            _, crashed = _run_pool([subject], manifest, manifest_path, 1, fs, HRVparams, output_dir, worker_budget)
+            if crashed:
+                _finish(manifest, manifest_path, subject, dict(crash))
+
+    manifest['finished'] = datetime.now().isoformat(timespec='seconds')
+    save_manifest(manifest, manifest_path)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the ICG pipeline over many subject/task recordings.')
+    parser.add_argument('source', help='directory of recordings, .json manifest or text file of paths')
+    parser.add_argument('output_dir')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--fs', type=int, default=1000)
+    parser.add_argument('--no-resume', action='store_true', help='ignore the existing manifest')
+    parser.add_argument('--retry-failed', action='store_true', help='rerun subjects that failed before')
+    parser.add_argument('--memory-budget', default=None, metavar='SIZE',
+                        help='total peak memory of all workers, e.g. 8G (sets the worker count and settings)')
+    parser.add_argument('--gating', action='store_true',
+                        help='skip denoising of beats with low bSQI / ICG quality (beat_quality.gate_beats)')
+    args = parser.parse_args()
+
+    HRVparams = None
+    if args.gating:
+        from InitializeHRVparams import InitializeHRVparams
+        HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+        HRVparams['ICG']['gating'] = 1
+    manifest = run_batch(args.source, args.output_dir, args.workers, args.fs, HRVparams,
+                         resume=not args.no_resume, retry_failed=args.retry_failed, memory_budget=args.memory_budget)
+    statuses = [e['status'] for e in manifest['recordings'].values()]
+    print({s: statuses.count(s) for s in sorted(set(statuses))})
@@ -0,0 +1,110 @@
+import numpy as np
+
+# Elements per block of icg_beat_quality(), so its float64 temporaries stay
+# small next to the beat matrix
+QUALITY_BLOCK = 1 << 20
+
+# Reason codes of the beat gating
+BEAT_OK = 0
+BEAT_LOW_SQI = 1
+BEAT_LOW_ICG_QUALITY = 2
+
+
+def beat_sqi(R_peaks, SQI, StartSQIwindows, HRVparams):
+    """
+    ECG signal quality of every beat from the bSQI windows.
+
+    Parameters:
+        R_peaks (array): R peak locations (samples)
+        SQI (array): SQI per window, e.g. SQIjw from ConvertRawDataToRRIntervals
+        StartSQIwindows (array): Start time of each window (s), NaN if rejected
+        HRVparams (dict): Uses Fs and sqi['windowlength']
+
+    Returns:
+        np.ndarray: Mean SQI of the windows covering each beat, NaN when no
+            covering window has an SQI
+    """
+    t = np.asarray(R_peaks, dtype=float) / HRVparams['Fs']
+    starts = np.asarray(StartSQIwindows, dtype=float)
+    sqi = np.asarray(SQI, dtype=float)
+    ok = ~np.isnan(starts) & ~np.isnan(sqi)
+    starts, sqi = starts[ok], sqi[ok]
+    order = np.argsort(starts)
+    starts, sqi = starts[order], sqi[order]
+
+    # Windows [start, start + windowlength) containing t are a contiguous run of starts
+    lo = np.searchsorted(starts, t - HRVparams['sqi']['windowlength'], side='right')
+    hi = np.searchsorted(starts, t, side='right')
+    cs = np.concatenate(([0.0], np.cumsum(sqi)))
+    n = hi - lo
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, (cs[hi] - cs[lo]) / n, np.nan)
+
+
+def icg_beat_quality(beats, max_amp_ratio=3.0):
+    """
+    Cheap ICG quality score of every beat, computed before any denoising.
+
+    The score is the correlation of the beat with the median beat of the
+    record (clipped to [0, 1]), set to 0 when the peak-to-peak amplitude is
+    more than max_amp_ratio times above or below the median amplitude
+    (saturation, electrode loss, motion).
+
+    Parameters:
+        beats (np.ndarray): (n_beats, beat_len) band-passed ICG segments
+
+    Returns:
+        np.ndarray: Score in [0, 1] per beat
+    """
+    beats = np.asarray(beats)
+    if beats.ndim != 2 or len(beats) == 0:
+        return np.zeros(len(beats))
+    # 分块计算, 不复制整个心搏矩阵 (float64 转换, 中位数, 去均值)
+    n_beats, beat_len = beats.shape
+    cols = max(QUALITY_BLOCK // n_beats, 1)
+    rows = max(QUALITY_BLOCK // beat_len, 1)
+    template = np.concatenate([np.median(beats[:, j:j + cols].astype(float), axis=0, overwrite_input=True)
+                               for j in range(0, beat_len, cols)])
+    tc = template - template.mean()
+    corr = np.empty(n_beats)
+    amp = np.empty(n_beats)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(0, n_beats, rows):
+            block = beats[i:i + rows].astype(float)
+            bc = block - block.mean(axis=1, keepdims=True)
+            corr[i:i + rows] = bc @ tc / (np.linalg.norm(bc, axis=1) * np.linalg.norm(tc))
+            amp[i:i + rows] = np.ptp(block, axis=1)
+        ratio = amp / np.median(amp)
+    score = np.clip(np.nan_to_num(corr), 0, 1)
+    score[~((ratio >= 1 / max_amp_ratio) & (ratio <= max_amp_ratio))] = 0
+    return score
+
+
+def gate_beats(R_peaks, beats, SQI, StartSQIwindows, HRVparams):
+    """
+    Mark beats as unusable before the expensive denoising stages.
+
+    A beat is rejected when the mean bSQI of its windows is below
+    ICG['min_beat_sqi'] (sqi['LowQualityThreshold'] when None), or when its
+    icg_beat_quality() is below ICG['min_icg_quality']. Beats without any
+    SQI window are only judged on the ICG score.
+
+    Returns:
+        accept (np.ndarray): Boolean mask of the usable beats
+        reason (np.ndarray): BEAT_OK, BEAT_LOW_SQI or BEAT_LOW_ICG_QUALITY per beat
+        sqi (np.ndarray): Beat SQI
+        quality (np.ndarray): ICG quality score
+    """
+    p = HRVparams['ICG']
+    min_sqi = p.get('min_beat_sqi')
+    if min_sqi is None:
+        min_sqi = HRVparams['sqi']['LowQualityThreshold']
+
+    sqi = beat_sqi(R_peaks, SQI, StartSQIwindows, HRVparams)
+    quality = icg_beat_quality(beats, p.get('max_amp_ratio', 3.0))
+
+    reason = np.full(len(sqi), BEAT_OK, dtype=np.int8)
+    reason[quality < p.get('min_icg_quality', 0.5)] = BEAT_LOW_ICG_QUALITY
+    with np.errstate(invalid='ignore'):
+        reason[sqi < min_sqi] = BEAT_LOW_SQI
+    return reason == BEAT_OK, reason, sqi, quality
@@ -0,0 +1,200 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+BEAT_COLUMNS = ['subject', 'session', 't', 'r_sample', 'b_sample', 'c_sample', 'x_sample',
+                'pep', 'lvet', 'sqi']
+
+
+def build_beat_table(subjectID, valid_R_peaks, b_rel, c_rel, x_rel, fs, session_start,
+                     llim_beat=None, SQI=None, StartSQIwindows=None, sqi_windowlength=10):
+    """
+    Assemble the per-beat results of one recording into a table.
+
+    Parameters:
+        subjectID (str): Identifier of the subject
+        valid_R_peaks (list): R-peak sample of every segmented beat
+        b_rel, c_rel, x_rel (np.ndarray): B/C/X indices relative to the beat
+            start, as returned by extract_bcx_points_from_beats (None if missing)
+        fs (float): Sampling frequency (Hz)
+        session_start (datetime-like): Wall-clock time of sample 0
+        llim_beat (int): Samples between beat start and R peak (default 0.15 s)
+        SQI (np.ndarray): Optional SQI per window, e.g. SQIjw from ConvertRawDataToRRIntervals
+        StartSQIwindows (np.ndarray): Start time (s) of each SQI window
+        sqi_windowlength (float): Length of the SQI windows (s)
+
+    Returns:
+        DataFrame: One row per beat with the columns in BEAT_COLUMNS. Sample
+            columns are absolute indices into the recording (float, NaN when a
+            point was not found); pep = B - R and lvet = X - B are in seconds.
+    """
+    if llim_beat is None:
+        llim_beat = int(0.15 * fs)
+    session_start = pd.Timestamp(session_start)
+
+    r = np.asarray(valid_R_peaks, dtype=float)
+    start = r - llim_beat
+
+    def absolute(rel):
+        rel = np.array([np.nan if v is None else v for v in rel], dtype=float)
+        return start + rel
+
+    b = absolute(b_rel)
+    c = absolute(c_rel)
+    x = absolute(x_rel)
+
+    sqi = np.full(len(r), np.nan)
+    if SQI is not None and StartSQIwindows is not None and len(SQI):
+        win_start = np.asarray(StartSQIwindows, dtype=float)
+        win_sqi = np.asarray(SQI, dtype=float)
+        ok = ~np.isnan(win_start)
+        win_start, win_sqi = win_start[ok], win_sqi[ok]
+        # Last window that starts at or before the beat and still covers it
+        idx = np.searchsorted(win_start, r / fs, side='right') - 1
+        covered = (idx >= 0) & (r / fs < win_start[np.clip(idx, 0, None)] + sqi_windowlength)
+        sqi[covered] = win_sqi[idx[covered]]
+
+    return pd.DataFrame({
+        'subject': str(subjectID),
+        'session': session_start.strftime('%Y%m%dT%H%M%S'),
+        't': session_start + pd.to_timedelta(r / fs, unit='s'),
+        'r_sample': r.astype(np.int64),
+        'b_sample': b,
+        'c_sample': c,
+        'x_sample': x,
+        'pep': (b - r) / fs,
+        'lvet': (x - b) / fs,
+        'sqi': sqi,
+    }, columns=BEAT_COLUMNS)
+
+
+class BeatStore:
+    """
+    Columnar, append-only store of per-beat results for many subjects.
+
+    Two layouts are supported:
+        'parquet': root/subject=<id>/date=<YYYY-MM-DD>/<session>.parquet.
+            Every session is written as new files, existing ones are never
+            rewritten. Queries open only the date partitions that overlap the
+            requested range and push the time filter down to the row groups.
+        'hdf5':    root/beats.h5 with one appendable table per subject and
+            't' indexed as a data column for where-queries.
+
+    Parquet needs pyarrow, HDF5 needs PyTables (both optional pandas backends).
+
+    Usage:
+        store = BeatStore('OutputData/beats')
+        store.append(build_beat_table('S1', R, b, c, x, 1000, '2024-05-01 08:00'))
+        df = store.query('S1', '2024-05-01 09:00', '2024-05-01 10:00')
+    """
+
+    def __init__(self, root, fmt='parquet', row_group_size=4096):
+        if fmt not in ('parquet', 'hdf5'):
+            raise ValueError("fmt must be 'parquet' or 'hdf5'")
+        self.root = root
+        self.fmt = fmt
+        self.row_group_size = row_group_size
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def _hdf_key(subject):
+        return 'subject_' + re.sub(r'\W', '_', str(subject))
+
+    def _subject_dir(self, subject):
+        return os.path.join(self.root, f"subject={subject}")
+
+    def append(self, table):
+        """Add the beats of one or more sessions; earlier data is left untouched."""
+        if len(table) == 0:
+            return
+        table = table.sort_values(['subject', 't'])
+
+        if self.fmt == 'hdf5':
+            with pd.HDFStore(os.path.join(self.root, 'beats.h5'), mode='a') as store:
+                for subject, rows in table.groupby('subject', sort=False):
+                    store.append(self._hdf_key(subject), rows.reset_index(drop=True),
+                                 format='table', data_columns=['t'],
+                                 min_itemsize={'subject': 64, 'session': 32})
+            return
+
+        dates = table['t'].dt.strftime('%Y-%m-%d')
+        for (subject, session, date), rows in table.groupby(['subject', 'session', dates], sort=False):
+            folder = os.path.join(self._subject_dir(subject), f"date={date}")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{session}.parquet")
+            n = 1
+            while os.path.exists(path):
+                path = os.path.join(folder, f"{session}_{n}.parquet")
+                n += 1
+            rows.reset_index(drop=True).to_parquet(path, index=False,
+                                                   row_group_size=self.row_group_size)
+
+    def subjects(self):
+        """List the subjects present in the store."""
+        if self.fmt == 'hdf5':
+            path = os.path.join(self.root, 'beats.h5')
+            if not os.path.exists(path):
+                return []
+            with pd.HDFStore(path, mode='r') as store:
+                return [store.select(k, start=0, stop=1)['subject'].iloc[0] for k in store.keys()]
+        return sorted(d.split('=', 1)[1] for d in os.listdir(self.root) if d.startswith('subject='))
+
+    def query(self, subject, start=None, end=None, columns=None):
+        """
+        Read the beats of one subject with start <= t < end.
+
+        Parameters:
+            subject (str): Subject identifier
+            start, end (datetime-like): Time range, open-ended when None
+            columns (list): Subset of BEAT_COLUMNS to return
+
+        Returns:
+            DataFrame: Matching beats sorted by time
+        """
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+
+        if self.fmt == 'hdf5':
+            path = os.path.join(self.root, 'beats.h5')
+            if not os.path.exists(path):
+                return pd.DataFrame(columns=columns or BEAT_COLUMNS)
+            where = []
+            if start is not None:
+                where.append('t >= start')
+            if end is not None:
+                where.append('t < end')
+            with pd.HDFStore(path, mode='r') as store:
+                key = self._hdf_key(subject)
+                if '/' + key not in store.keys():
+                    return pd.DataFrame(columns=columns or BEAT_COLUMNS)
+                df = store.select(key, where=' & '.join(where) or None, columns=columns)
+            return df.sort_values('t').reset_index(drop=True) if 't' in df else df.reset_index(drop=True)
+
+        subject_dir = self._subject_dir(subject)
+        if not os.path.isdir(subject_dir):
+            return pd.DataFrame(columns=columns or BEAT_COLUMNS)
+
+        filters = []
+        if start is not None:
+            filters.append(('t', '>=', start))
+        if end is not None:
+            filters.append(('t', '<', end))
+
+        frames = []
+        for date_dir in sorted(os.listdir(subject_dir)):
+            day = pd.Timestamp(date_dir.split('=', 1)[1])
+            if (start is not None and day + pd.Timedelta(days=1) <= start) or \
+                    (end is not None and day >= end):
+                continue
+            folder = os.path.join(subject_dir, date_dir)
+            for name in sorted(os.listdir(folder)):
+                if name.endswith('.parquet'):
+                    frames.append(pd.read_parquet(os.path.join(folder, name), columns=columns,
+                                                  filters=filters or None))
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return pd.DataFrame(columns=columns or BEAT_COLUMNS)
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values('t').reset_index(drop=True) if 't' in df else df
@@ -26,16 +26,21 @@ def bsqi(ann1, ann2, HRVparams):
     margin = HRVparams['sqi']['margin']
     fs = HRVparams['Fs']
 
-    
-    ann1 = np.array(ann1[0]).flatten() / fs
-    ann2 = np.array(ann2[0]).flatten() / fs
-
-
-    endtime = max(ann1[-1], ann2[-1])
-    time = np.arange(1/fs, endtime + 1/fs, 1/fs)
+    # jqrs-style detectors return (qrs_pos, sign, en_thres); use the QRS locations
+    if isinstance(ann1, tuple):
+        ann1 = ann1[0]
+    if isinstance(ann2, tuple):
+        ann2 = ann2[0]
+    ann1 = np.array(ann1).flatten()
+    ann2 = np.array(ann2).flatten()
+
+    # The 'sqi' windows only depend on the last sample time, the last annotation on the sample grid
+    last = np.ceil(max(ann1[-1], ann2[-1])) / fs
+    ann1 = ann1 / fs
+    ann2 = ann2 / fs
 
     # Create windows
-    StartIdxSQIwindows = create_window_rr_intervals(time, None, HRVparams, 'sqi')
+    StartIdxSQIwindows = create_window_rr_intervals(np.array([last]), None, HRVparams, 'sqi')
 
     # Initialize SQI results
     F1 = np.full(len(StartIdxSQIwindows), np.nan)
@@ -49,7 +54,7 @@ def bsqi(ann1, ann2, HRVparams):
                 a1 = ann1[idx_ann1_in_win] - StartIdxSQIwindows[seg]
                 a2 = ann2 - StartIdxSQIwindows[seg]
 
-                F1[seg] = run_sqi(a1, a2, threshold, margin, windowlength, fs)
+                F1[seg] = run_sqi(a1, a2, threshold, margin, windowlength, fs)[0]
             except Exception:
                 continue
 
@@ -0,0 +1,54 @@
+import time
+
+from PyEMD import EEMD, EMD
+
+from time_budget import DeadlineExceeded
+
+
+class BudgetedEMD(EMD):
+    """EMD that aborts sifting once `deadline` (time.monotonic()) has passed."""
+
+    deadline = None
+
+    def find_extrema(self, T, S):
+        # called on every sifting iteration, so a single long trial is bounded too
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded("EMD sifting exceeded its time budget")
+        return super().find_extrema(T, S)
+
+
+class BudgetedEEMD(EEMD):
+    """
+    EEMD with a cancellable deadline.
+
+    While a deadline is set the trials run in-process so it can be enforced;
+    it is checked before every trial and inside every sifting iteration and
+    raises DeadlineExceeded. deadline=None means no limit, and the trials
+    then use PyEMD's process pool as usual (parallel=True by default).
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('ext_EMD', BudgetedEMD())
+        super().__init__(**kwargs)
+
+    def eemd(self, S, T=None, max_imf=-1, progress=False):
+        parallel = self.parallel
+        if self.deadline is not None:
+            self.parallel = False
+        try:
+            return super().eemd(S, T=T, max_imf=max_imf, progress=progress)
+        finally:
+            self.parallel = parallel
+
+    @property
+    def deadline(self):
+        return getattr(self.EMD, 'deadline', None)
+
+    @deadline.setter
+    def deadline(self, value):
+        self.EMD.deadline = value
+
+    def _trial_update(self, trial):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded("EEMD exceeded its time budget")
+        return super()._trial_update(trial)
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+import types
+import warnings
+
+import numpy as np
+
+BACKENDS = ('python', 'numba')
+
+# Modules that register kernels, imported by check_backend_equivalence()
+KERNEL_MODULES = ('icg_pipeline', 'run_sqrs', 'wqrsm_fast', 'jqrs')
+
+_KERNELS = {}       # name -> (reference function, helper functions, example factory)
+_COMPILED = {}      # name -> numba-compiled kernel
+_lock = threading.Lock()
+_default = os.environ.get('ICG_COMPUTE_BACKEND', 'auto')
+
+
+def kernel(name, helpers=(), example=None):
+    """
+    Register a sample-loop kernel.
+
+    The decorated function is the pure Python reference and must stick to
+    the subset Numba compiles (NumPy arrays and scalars, no dicts or
+    Python lists). Module-level helper functions it calls are listed in
+    helpers so they are compiled together with it. example(rng) returns the
+    argument tuple used by check_backend_equivalence().
+    """
+    def register(fn):
+        _KERNELS[name] = (fn, tuple(helpers), example)
+        return fn
+    return register
+
+
+def numba_available():
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def set_backend(backend):
+    """Process-wide default backend: 'auto', 'python' or 'numba'."""
+    global _default
+    if backend not in BACKENDS + ('auto',):
+        raise ValueError(f"Unknown compute backend {backend!r}, expected one of {BACKENDS + ('auto',)}")
+    _default = backend
+
+
+def backend_from_params(HRVparams):
+    """Backend configured in HRVparams['compute'] (None = process default)."""
+    return (HRVparams or {}).get('compute', {}).get('backend')
+
+
+def resolve_backend(backend=None):
+    """
+    Concrete backend for a request: None uses the process default, 'auto'
+    picks numba when it is installed. An explicit 'numba' without Numba
+    installed falls back to 'python' with a warning.
+    """
+    backend = backend or _default
+    if backend == 'auto':
+        return 'numba' if numba_available() else 'python'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown compute backend {backend!r}, expected one of {BACKENDS + ('auto',)}")
+    if backend == 'numba' and not numba_available():
+        warnings.warn("numba is not installed, using the pure Python kernels")
+        return 'python'
+    return backend
+
+
+def _compile(name):
+    import numba
+
+    fn, helpers, _ = _KERNELS[name]
+    namespace = dict(fn.__globals__)
+    # 辅助函数也编译, 并替换到内核看到的全局命名空间中
+    for helper in helpers:
+        namespace[helper.__name__] = numba.njit(cache=True, nogil=True)(helper)
+    fn = types.FunctionType(fn.__code__, namespace, fn.__name__, fn.__defaults__, fn.__closure__)
+    return numba.njit(cache=True, nogil=True)(fn)
+
+
+def get_kernel(name, backend=None):
+    """Callable of kernel `name` for the resolved backend (compiled once per process)."""
+    if name not in _KERNELS:
+        raise KeyError(f"Unknown kernel {name!r}, registered: {sorted(_KERNELS)}")
+    if resolve_backend(backend) == 'python':
+        return _KERNELS[name][0]
+    with _lock:
+        if name not in _COMPILED:
+            _COMPILED[name] = _compile(name)
+        return _COMPILED[name]
+
+
+def _as_tuple(result):
+    return result if isinstance(result, tuple) else (result,)
+
+
+def check_backend_equivalence(backend='numba', names=None, seed=0, rtol=1e-9, atol=1e-9):
+    """
+    Run every registered kernel on its example input with the reference and
+    with `backend`, and compare the outputs.
+
+    Returns:
+        dict: per kernel 'equal' (bool), 'max_abs_diff', and the run time of
+            the reference and of the backend (s, the backend after a warm-up
+            call that includes compilation); {'available': False} when the
+            backend cannot be used here
+    """
+    import importlib
+
+    for module in KERNEL_MODULES:
+        importlib.import_module(module)
+    if backend == 'numba' and not numba_available():
+        return {'available': False}
+
+    report = {}
+    for name in names or sorted(_KERNELS):
+        ref_fn, _, example = _KERNELS[name]
+        if example is None:
+            continue
+        fast_fn = get_kernel(name, backend)
+        args = example(np.random.default_rng(seed))
+        fast_fn(*[a.copy() if isinstance(a, np.ndarray) else a for a in args])  # 预热 (含编译)
+
+        t0 = time.perf_counter()
+        ref = _as_tuple(ref_fn(*[a.copy() if isinstance(a, np.ndarray) else a for a in args]))
+        t1 = time.perf_counter()
+        out = _as_tuple(fast_fn(*[a.copy() if isinstance(a, np.ndarray) else a for a in args]))
+        t2 = time.perf_counter()
+
+        equal, diff = len(ref) == len(out), 0.0
+        for r, o in zip(ref, out):
+            r, o = np.asarray(r, dtype=float), np.asarray(o, dtype=float)
+            if r.shape != o.shape:
+                equal = False
+                continue
+            if r.size:
+                diff = max(diff, float(np.max(np.abs(r - o))))
+            equal &= bool(np.allclose(r, o, rtol=rtol, atol=atol))
+        report[name] = {'equal': equal, 'max_abs_diff': diff,
+                        'reference_seconds': t1 - t0, f'{backend}_seconds': t2 - t1}
+    return report
+
+
+def example_ecg(rng, fs=250, seconds=30, gain=2000):
+    """Synthetic ECG-like test input: Gaussian QRS complexes at ~70 bpm plus noise, scaled by gain."""
+    n = int(fs * seconds)
+    t = np.arange(n) / fs
+    beats = np.cumsum(rng.uniform(0.75, 1.0, int(seconds / 0.75) + 1))
+    ecg = 0.05 * rng.standard_normal(n)
+    for b in beats[beats < seconds]:
+        ecg += np.exp(-0.5 * ((t - b) / 0.012) ** 2) - 0.2 * np.exp(-0.5 * ((t - b - 0.03) / 0.01) ** 2)
+    return ecg * gain
+
+
+if __name__ == "__main__":
+    import json
+
+    # The kernel modules register with the imported module, not with __main__
+    import compute_backend
+    print(json.dumps({'resolved_backend': compute_backend.resolve_backend('auto'),
+                      'numba': compute_backend.check_backend_equivalence('numba'),
+                      'python': compute_backend.check_backend_equivalence('python')}, indent=2))
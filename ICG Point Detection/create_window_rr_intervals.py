@@ -2,9 +2,14 @@ def create_window_rr_intervals(tNN, NN, HRVparams, option='normal'):
     """
     Create window start times for RR interval analysis.
 
+    Windows missing more than MissingDataThreshold of their length are
+    rejected (NaN). NN should be the cleaned series from
+    RRIntervalPreprocess (see RRIntervalPreprocess.preprocess_rr): removed
+    intervals then count as missing data and no limits are applied here.
+
     Parameters:
-        tNN (list or np.ndarray): Time of RR intervals (in seconds)
-        NN (list or np.ndarray): RR intervals (in seconds)
+        tNN (list or np.ndarray): Time of NN intervals (in seconds)
+        NN (list or np.ndarray): NN intervals (in seconds)
         HRVparams (dict): Configuration parameters
         option (str): One of 'normal', 'af', 'sqi', 'mse', 'dfa', 'HRT'
 
@@ -27,15 +32,15 @@ def create_window_rr_intervals(tNN, NN, HRVparams, option='normal'):
         increment = HRVparams['af']['increment']
         windowlength = HRVparams['af']['windowlength']
     elif option == 'mse':
+        if not HRVparams['MSE']['increment']:
+            return [0]  # use entire signal
         increment = HRVparams['MSE']['increment'] * 3600
         windowlength = HRVparams['MSE']['windowlength'] * 3600
-        if not increment:
-            return [0]  # use entire signal
     elif option == 'dfa':
+        if not HRVparams['DFA']['increment']:
+            return [0]  # use entire signal
         increment = HRVparams['DFA']['increment'] * 3600
         windowlength = HRVparams['DFA']['windowlength'] * 3600
-        if not increment:
-            return [0]  # use entire signal
     elif option == 'sqi':
         increment = HRVparams['sqi']['increment']
         windowlength = HRVparams['sqi']['windowlength']
@@ -46,7 +51,7 @@ def create_window_rr_intervals(tNN, NN, HRVparams, option='normal'):
             return [0]
 
     tNN = np.array(tNN)
-    NN = np.array(NN) if NN is not None else []
+    NN = np.array(NN) if NN is not None else np.array([])
 
     nx = int(np.floor(tNN[-1]))
     overlap = windowlength - increment
@@ -55,33 +60,33 @@ def create_window_rr_intervals(tNN, NN, HRVparams, option='normal'):
     window_rr_intervals = list((np.arange(Nwinds) * (windowlength - overlap)).astype(float))
 
     if option not in ['af', 'sqi']:
+        starts = []
         t_window_start = 0.0
-        i = 0
-        result_intervals = []
-
         while t_window_start <= tNN[-1] - windowlength + increment:
-            t_win = tNN[(tNN >= t_window_start) & (tNN < t_window_start + windowlength)]
-
-            if NN.size > 0:
-                nn_win = NN[(tNN >= t_window_start) & (tNN < t_window_start + windowlength)]
-            else:
-                nn_win = (windowlength / len(t_win)) * np.ones(len(t_win))
-
-            win_start = t_window_start
-
+            starts.append(t_window_start)
             t_window_start += increment
-
+        starts = np.array(starts)
+
+        # In-window sums of the (already cleaned) NN series are read from a
+        # cumulative sum (tNN is increasing)
+        i0 = np.searchsorted(tNN, starts, side='left')
+        i1 = np.searchsorted(tNN, starts + windowlength, side='left')
+
+        if NN.size > 0:
+            csum = np.concatenate(([0.0], np.cumsum(NN)))
+            truelength = csum[i1] - csum[i0]
+        else:
+            # Without intervals only the beat count is known: its mean
+            # interval must still be physiological
             upper_lim = HRVparams['preprocess']['upperphysiolim']
             lower_lim = HRVparams['preprocess']['lowerphysiolim']
-            nn_win = nn_win[(nn_win <= upper_lim) & (nn_win >= lower_lim)]
-
-            truelength = np.sum(nn_win)
-            if truelength < (windowlength * (1 - win_tol)):
-                result_intervals.append(np.nan)
-            else:
-                result_intervals.append(win_start)
-
-            i += 1
-        return result_intervals
+            count = i1 - i0
+            with np.errstate(divide='ignore'):
+                nn_val = windowlength / count
+            in_lims = (count > 0) & (nn_val <= upper_lim) & (nn_val >= lower_lim)
+            truelength = np.where(in_lims, count * nn_val, 0.0)
+
+        keep = truelength >= (windowlength * (1 - win_tol))
+        return [float(s) if k else np.nan for s, k in zip(starts, keep)]
 
     return window_rr_intervals
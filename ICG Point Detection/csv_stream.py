@@ -0,0 +1,121 @@
+import csv
+import os
+
+import numpy as np
+
+
+def _sniff(filepath, delimiter):
+    """Return (delimiter, header column names or None) from the first line of the file."""
+    with open(filepath, newline='') as f:
+        first = f.readline()
+    if delimiter is None:
+        if filepath.lower().endswith('.tsv') or '\t' in first:
+            delimiter = '\t'
+        else:
+            try:
+                delimiter = csv.Sniffer().sniff(first, delimiters=',; ').delimiter
+            except csv.Error:
+                delimiter = ','
+    fields = next(csv.reader([first.strip()], delimiter=delimiter), [])
+    try:
+        [float(v) for v in fields if v.strip()]
+        header = None
+    except ValueError:
+        header = [v.strip() for v in fields]
+    return delimiter, header
+
+
+def _resolve_columns(columns, header):
+    cols = []
+    for c in columns:
+        if isinstance(c, str):
+            if header is None or c not in header:
+                raise ValueError(f"Column {c!r} not found in header {header}")
+            cols.append(header.index(c))
+        else:
+            cols.append(int(c))
+    return cols
+
+
+def estimate_rows(filepath):
+    """Row count estimate (slightly high) from the file size and the line length of the first MiB."""
+    with open(filepath, 'rb') as f:
+        head = f.read(1 << 20)
+    bytes_per_row = max(len(head) / max(head.count(b'\n'), 1), 1)
+    return int(os.path.getsize(filepath) / bytes_per_row * 1.05)
+
+
+def iter_csv_blocks(filepath, columns=(0, 1), dtype=np.float64, block_size=65536, delimiter=None,
+                    start=0, stop=None):
+    """
+    Stream selected columns of a CSV/TSV recording in fixed-size blocks.
+
+    The file is parsed block_size rows at a time and each block is copied
+    into one preallocated (block_size, ncols) buffer, so peak memory stays at
+    a few blocks whatever the file size. A header row is detected and skipped.
+    Rows before start are skipped without being converted and parsing stops
+    at stop.
+
+    Parameters:
+        filepath (str): CSV/TSV/TXT file, one sample per row
+        columns (list): Column indices or header names to read
+        dtype (np.dtype): Output sample type
+        block_size (int): Rows per block
+        delimiter (str): Field separator; sniffed from the first line when None
+        start, stop (int): Sample (data row) range to read
+
+    Yields:
+        (start_sample, block): block is an (n, len(columns)) view of the
+            shared buffer that is overwritten by the next block; copy it to
+            keep it.
+    """
+    import pandas as pd
+
+    if stop is not None and stop <= start:
+        return
+    delimiter, header = _sniff(filepath, delimiter)
+    cols = _resolve_columns(columns, header)
+    buf = np.empty((block_size, len(cols)), dtype=dtype)
+
+    sep = r'\s+' if delimiter == ' ' else delimiter
+    reader = pd.read_csv(filepath, sep=sep, header=None, usecols=cols,
+                         skiprows=(1 if header else 0) + start, nrows=None if stop is None else stop - start,
+                         dtype=np.float64, chunksize=block_size, engine='c', skipinitialspace=True)
+    with reader:
+        for chunk in reader:
+            n = len(chunk)
+            buf[:n] = chunk[cols].to_numpy()
+            yield start, buf[:n]
+            start += n
+
+
+def read_csv_recording(filepath, columns=(0, 1), dtype=np.float64, block_size=65536, delimiter=None,
+                       start=0, stop=None):
+    """
+    Read selected columns of rows [start, stop) of a CSV/TSV recording into
+    one array per column.
+
+    The output arrays are preallocated (stop - start rows, or an estimate
+    of the row count from estimate_rows()) and filled block by block, so the
+    recording is never held as a DataFrame or as a list of chunks.
+
+    Returns:
+        list of np.ndarray: One 1-D array per requested column
+    """
+    out = None
+    nrows = 0
+    for s0, block in iter_csv_blocks(filepath, columns, dtype, block_size, delimiter, start, stop):
+        if out is None:
+            estimate = stop - start if stop is not None else max(estimate_rows(filepath) - start, 0) + len(block)
+            out = np.empty((block.shape[1], estimate), dtype=dtype)
+        s0 -= start
+        end = s0 + len(block)
+        if end > out.shape[1]:
+            grown = np.empty((out.shape[0], max(end, int(out.shape[1] * 1.5))), dtype=dtype)
+            grown[:, :nrows] = out[:, :nrows]
+            out = grown
+        out[:, s0:end] = block.T
+        nrows = end
+    if out is None:
+        return [np.empty(0, dtype=dtype) for _ in columns]
+    return [out[i, :nrows] for i in range(out.shape[0])]
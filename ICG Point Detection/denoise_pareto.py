@@ -0,0 +1,226 @@
+"""
+Cost/quality exploration of the wavelet -> EEMD -> LMS denoising cascade.
+
+    python denoise_pareto.py --mode ablation --seconds 120 --noise 0.05
+    python denoise_pareto.py --mode sweep --workers 4 --spec PEP=10 --spec LVET=15 -o pareto.json
+    python denoise_pareto.py --recording labelled.icgz --truth labelled_truth.npz --mode grid
+
+Every configuration denoises the same beats (cut at the true R peaks, so R
+detection does not enter the comparison) and is scored with
+synthetic_recording.bcx_accuracy() against the ground truth.
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# One-at-a-time variations around the defaults (mode 'sweep') and the full
+# factorial grid (mode 'grid'); keys are HRVparams['ICG'] entries
+SWEEP = {
+    'wavelet_level': [1, 2, 3, 4, 5],
+    'eemd_trials': [10, 25, 50, 100],
+    'eemd_max_imfs': [3, 5, 7, 10],
+    'lms_mu': [0.001, 0.005, 0.01, 0.05],
+    'lms_order': [2, 3, 5, 8],
+}
+
+GRID = {
+    'wavelets': [['db4'], ['db4', 'sym8']],
+    'eemd_trials': [0, 25, 100],       # 0 = EEMD off
+    'lms_order': [0, 5],               # 0 = LMS off
+}
+
+ABLATIONS = {
+    'full': {},
+    'no sym8': {'wavelets': ['db4']},
+    'no db4': {'wavelets': ['sym8']},
+    'no wavelet': {'wavelets': []},
+    'no EEMD': {'eemd': 0},
+    'no LMS': {'lms': 0},
+    'wavelet only': {'eemd': 0, 'lms': 0},
+    'EEMD only': {'wavelets': [], 'lms': 0},
+    'band-pass only': {'wavelets': [], 'eemd': 0, 'lms': 0},
+}
+
+# Error metrics of bcx_accuracy() used as quality objectives
+ERRORS = ('B', 'C', 'X', 'PEP', 'LVET')
+
+
+def configurations(mode='ablation', sweep=None, grid=None):
+    """(label, ICG overrides) of the ablation set, a one-at-a-time sweep or a factorial grid."""
+    if mode == 'ablation':
+        return list(ABLATIONS.items())
+    if mode == 'sweep':
+        configs = [('default', {})]
+        for key, values in (sweep or SWEEP).items():
+            configs += [(f'{key}={v}', {key: v}) for v in values]
+        return configs
+    if mode == 'grid':
+        grid = grid or GRID
+        configs = []
+        for values in itertools.product(*grid.values()):
+            overrides = dict(zip(grid, values))
+            # 0 trials / order 表示关闭该阶段
+            if overrides.get('eemd_trials') == 0:
+                overrides['eemd'] = 0
+                del overrides['eemd_trials']
+            if overrides.get('lms_order') == 0:
+                overrides['lms'] = 0
+                del overrides['lms_order']
+            configs.append((', '.join(f'{k}={v}' for k, v in zip(grid, values)), overrides))
+        return configs
+    raise ValueError(f"Unknown mode {mode!r}, use 'ablation', 'sweep' or 'grid'")
+
+
+def load_dataset(recording=None, truth=None, seconds=120, fs=1000, params=None, seed=0):
+    """
+    Band-passed ICG and ground truth of a labelled recording (recording +
+    truth .npz with R/B/C/X sample arrays, e.g. written by
+    SyntheticRecording.write()) or of a fresh synthetic recording.
+    """
+    if recording is not None:
+        from load_ecg_icg import load_ecg_icg
+        _, icg = load_ecg_icg(recording)
+        gt = dict(np.load(truth if truth else os.path.splitext(recording)[0] + '_truth.npz'))
+        fs = int(gt.get('fs', fs))
+    else:
+        from synthetic_recording import SyntheticRecording
+        rec = SyntheticRecording(seconds, fs=fs, params=params, seed=seed)
+        _, icg = rec.render()
+        gt = rec.ground_truth()
+    gt.setdefault('ectopic', np.zeros(len(gt['R']), dtype=bool))
+    gt.setdefault('motion', np.empty((0, 2)))
+    return {'icg': icg, 'truth': gt, 'fs': fs}
+
+
+_data = None
+
+
+def _init_worker(dataset, HRVparams, max_beats):
+    global _data
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from beat_index import BeatIndex
+    from icg_pipeline import ICGPipeline
+
+    fs, truth = dataset['fs'], dataset['truth']
+    pipeline = ICGPipeline(fs, HRVparams)
+    R = np.round(np.asarray(truth['R'])).astype(np.int64)
+    if max_beats:
+        R = R[:max_beats]
+    llim = pipeline.llim_beat
+    beat_len = int(np.ceil(np.median(np.diff(R))))
+    index = BeatIndex(R, llim, beat_len - llim, len(dataset['icg']))
+    _data = {'beats': index.matrix(pipeline.bandpass(dataset['icg'])), 'R': index.R_peaks, 'llim': llim,
+             'truth': truth, 'fs': fs, 'HRVparams': HRVparams}
+
+
+def evaluate(label, overrides, seed=0):
+    """Denoise the worker's beats with one configuration; runtime per beat and bcx_accuracy()."""
+    from icg_pipeline import ICGPipeline
+    from synthetic_recording import bcx_accuracy
+
+    HRVparams = copy.deepcopy(_data['HRVparams'])
+    HRVparams['ICG'].update(overrides)
+    pipeline = ICGPipeline(_data['fs'], HRVparams)
+    if HRVparams['ICG'].get('eemd', 1):
+        pipeline.eemd.noise_seed(seed)
+    beats = _data['beats']
+    t0 = time.perf_counter()
+    denoised, _ = pipeline.denoise(beats)
+    elapsed = time.perf_counter() - t0
+    b_rel, c_rel, x_rel = pipeline.extract_bcx(np.array(denoised))
+    acc = bcx_accuracy(_data['truth'], _data['R'], b_rel, c_rel, x_rel, _data['llim'], _data['fs'])
+    return {'label': label, 'overrides': overrides, 'beats': len(beats),
+            'seconds_per_beat': elapsed / max(len(beats), 1),
+            **{f'{name}_mae_ms': acc[name]['mae_ms'] for name in ERRORS if name in acc},
+            'accuracy': acc}
+
+
+def explore(configs, dataset, HRVparams=None, workers=None, max_beats=None, seed=0):
+    """Evaluate every (label, overrides) configuration, in parallel over processes.
+
+    EEMD runs in-process, so each configuration is timed on one core rather
+    than against the other workers' per-beat EEMD pools.
+    """
+    if HRVparams is None:
+        from InitializeHRVparams import InitializeHRVparams
+        HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+    HRVparams = copy.deepcopy(HRVparams)
+    HRVparams['Fs'] = dataset['fs']
+    HRVparams['ICG']['gating'] = 0
+    HRVparams['ICG']['eemd_parallel'] = 0
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(dataset, HRVparams, max_beats)
+        return [evaluate(label, o, seed) for label, o in configs]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(dataset, HRVparams, max_beats)) as pool:
+        futures = [pool.submit(evaluate, label, o, seed) for label, o in configs]
+        return [f.result() for f in futures]
+
+
+def error_score(result, errors=('PEP', 'LVET')):
+    """Quality objective of a result: mean MAE (ms) over the chosen metrics."""
+    return float(np.mean([result[f'{name}_mae_ms'] for name in errors]))
+
+
+def pareto_front(results, errors=('PEP', 'LVET'), cost='seconds_per_beat'):
+    """Configurations not beaten on both cost and error_score(), sorted by cost."""
+    scored = sorted(results, key=lambda r: (r[cost], error_score(r, errors)))
+    front, best = [], np.inf
+    for r in scored:
+        e = error_score(r, errors)
+        if e < best:
+            front.append(r)
+            best = e
+    return front
+
+
+def fastest_meeting(results, spec, cost='seconds_per_beat'):
+    """
+    Cheapest configuration whose MAE meets the spec, e.g.
+    {'PEP': 10, 'LVET': 15} (ms); None when no configuration does.
+    """
+    ok = [r for r in results if all(r.get(f'{name}_mae_ms', np.inf) <= limit for name, limit in spec.items())]
+    return min(ok, key=lambda r: r[cost]) if ok else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pareto frontier of denoising cost vs B/C/X accuracy.')
+    parser.add_argument('--mode', choices=['ablation', 'sweep', 'grid'], default='ablation')
+    parser.add_argument('--recording', default=None, help='labelled recording (default: synthetic)')
+    parser.add_argument('--truth', default=None, help='ground truth .npz of --recording')
+    parser.add_argument('--seconds', type=float, default=120, help='synthetic recording length')
+    parser.add_argument('--fs', type=int, default=1000)
+    parser.add_argument('--noise', type=float, default=0.05, help='synthetic white noise sd (relative)')
+    parser.add_argument('--max-beats', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--errors', nargs='+', default=['PEP', 'LVET'], choices=ERRORS,
+                        help='MAE metrics averaged into the quality objective')
+    parser.add_argument('--spec', action='append', default=[], metavar='METRIC=MS',
+                        help='accuracy spec, e.g. PEP=10 (repeatable)')
+    parser.add_argument('-o', '--output', default=None, help='write all results and the frontier as JSON')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.recording, args.truth, args.seconds, args.fs,
+                           {'noise': {'white': args.noise}}, args.seed)
+    results = explore(configurations(args.mode), dataset, workers=args.workers,
+                      max_beats=args.max_beats, seed=args.seed)
+    front = pareto_front(results, args.errors)
+
+    print(f"{'configuration':<34}{'ms/beat':>9}" + ''.join(f"{e + ' MAE':>11}" for e in ERRORS) + '  pareto')
+    for r in sorted(results, key=lambda r: r['seconds_per_beat']):
+        print(f"{r['label']:<34}{r['seconds_per_beat'] * 1e3:>9.1f}"
+              + ''.join(f"{r[f'{e}_mae_ms']:>11.1f}" for e in ERRORS) + ('  *' if r in front else ''))
+    spec = {k: float(v) for k, v in (s.split('=') for s in args.spec)}
+    if spec:
+        best = fastest_meeting(results, spec)
+        print(f"fastest meeting {spec}: {best['label'] if best else 'none'}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, 'pareto': [r['label'] for r in front], 'spec': spec}, f, indent=2)
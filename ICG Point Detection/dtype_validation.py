@@ -0,0 +1,77 @@
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+
+
+def _run(ecg, icg, fs, HRVparams, dtype, seed):
+    from icg_pipeline import ICGPipeline
+    params = copy.deepcopy(HRVparams)
+    params['ICG']['dtype'] = np.dtype(dtype).name
+    pipeline = ICGPipeline(fs, params)
+    # Same EEMD noise in both runs, so only the arithmetic precision differs
+    pipeline.eemd.noise_seed(seed)
+    t0 = time.perf_counter()
+    beats_clean, beats_denoised, beat_len, filtered_icg, denoised_icg_full, R_peaks = pipeline.process(
+        ecg.astype(dtype), icg.astype(dtype))
+    elapsed = time.perf_counter() - t0
+    bcx = [np.array(v, dtype=float) for v in pipeline.extract_bcx(beats_denoised)]
+    nbytes = beats_clean.nbytes + beats_denoised.nbytes + filtered_icg.nbytes + denoised_icg_full.nbytes
+    return {'R_peaks': np.asarray(R_peaks), 'bcx': bcx, 'denoised': denoised_icg_full,
+            'seconds': elapsed, 'nbytes': nbytes}
+
+
+def compare_dtypes(ecg, icg, fs=1000, HRVparams=None, dtype='float32', seed=0):
+    """
+    Validation report of the reduced-precision mode against float64.
+
+    The pipeline runs twice on the same recording (float64 and dtype) with
+    the same EEMD noise seed, and the B/C/X indices of the beats both runs
+    keep are compared.
+
+    Returns:
+        dict: per point ('B', 'C', 'X') the number of compared beats, the
+            fraction of identical indices, the mean and max absolute
+            difference (samples) and the number of beats off by more than one
+            sample; plus the max abs difference of the denoised signal and
+            wall time / output bytes of both runs
+    """
+    if HRVparams is None:
+        from InitializeHRVparams import InitializeHRVparams
+        HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+    ref = _run(ecg, icg, fs, HRVparams, np.float64, seed)
+    low = _run(ecg, icg, fs, HRVparams, dtype, seed)
+
+    _, i_ref, i_low = np.intersect1d(ref['R_peaks'], low['R_peaks'], return_indices=True)
+    report = {'dtype': np.dtype(dtype).name, 'beats_float64': len(ref['R_peaks']),
+              f'beats_{np.dtype(dtype).name}': len(low['R_peaks'])}
+    for name, a, b in zip('BCX', ref['bcx'], low['bcx']):
+        d = np.abs(a[i_ref] - b[i_low])
+        d = d[~np.isnan(d)]
+        report[name] = {
+            'n': int(len(d)),
+            'identical': float(np.mean(d == 0)) if len(d) else np.nan,
+            'mean_abs_diff': float(d.mean()) if len(d) else np.nan,
+            'max_abs_diff': float(d.max()) if len(d) else np.nan,
+            'over_1_sample': int((d > 1).sum()),
+        }
+    report['denoised_max_abs_diff'] = float(np.max(np.abs(ref['denoised'] - low['denoised'].astype(np.float64))))
+    report['seconds'] = {'float64': ref['seconds'], np.dtype(dtype).name: low['seconds']}
+    report['nbytes'] = {'float64': ref['nbytes'], np.dtype(dtype).name: low['nbytes']}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare B/C/X of a reduced-precision run against float64.')
+    parser.add_argument('recording')
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--fs', type=int, default=1000)
+    parser.add_argument('--stop', type=float, default=None, help='only use the first STOP seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from load_ecg_icg import load_ecg_icg
+    ecg, icg = load_ecg_icg(args.recording, 0, None if args.stop is None else int(args.stop * args.fs))
+    print(json.dumps(compare_dtypes(ecg, icg, args.fs, dtype=args.dtype, seed=args.seed), indent=2))
@@ -0,0 +1,341 @@
+import numpy as np
+
+from create_window_rr_intervals import create_window_rr_intervals
+
+BAND_NAMES = ['ulf', 'vlf', 'lf', 'hf']
+
+# Upper bound on the number of (window, sample, frequency) terms evaluated at
+# once by the batched Lomb periodogram, ~80 MB of complex128 temporaries
+LOMB_BLOCK_TERMS = 5 * 10**6
+
+
+def _window_bounds(tNN, windows, windowlength):
+    """First/last+1 index of the beats inside each window; rejected (NaN) windows are empty."""
+    starts = np.asarray(windows, dtype=float)
+    valid = ~np.isnan(starts)
+    s = np.where(valid, starts, 0.0)
+    i0 = np.searchsorted(tNN, s, side='left')
+    i1 = np.searchsorted(tNN, s + windowlength, side='left')
+    i1 = np.where(valid, i1, i0)
+    return starts, valid, i0, i1
+
+
+def _stack_windows(x, i0, i1):
+    """(W, Lmax) matrix of the samples of every window, padded with NaN."""
+    lengths = i1 - i0
+    lmax = int(lengths.max()) if len(lengths) else 0
+    cols = np.arange(lmax)
+    idx = i0[:, None] + cols
+    mask = cols < lengths[:, None]
+    stacked = np.full(idx.shape, np.nan)
+    stacked[mask] = x[idx[mask]]
+    return stacked, mask
+
+
+def _sorted_percentile(sorted_rows, n, p):
+    """Linear-interpolated percentile p (0..1) of the first n entries of each sorted row."""
+    if sorted_rows.shape[1] == 0:
+        return np.full(len(n), np.nan)
+    rows = np.arange(len(n))
+    pos = np.clip((n - 1) * p, 0, None)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, np.maximum(n - 1, 0).astype(int))
+    frac = pos - lo
+    return np.where(n > 0, sorted_rows[rows, lo] * (1 - frac) + sorted_rows[rows, hi] * frac, np.nan)
+
+
+def eval_time_domain_hrv(tNN, NN, HRVparams, windows):
+    """
+    Time-domain HRV statistics of all windows at once.
+
+    Parameters:
+        tNN (np.ndarray): Time of each NN interval (s), increasing
+        NN (np.ndarray): NN intervals (s)
+        HRVparams (dict): Uses 'windowlength' and timedomain['alpha'] (ms)
+        windows (list): Window start times (s), NaN for rejected windows
+
+    Returns:
+        dict: One array per metric, aligned with windows. Intervals are in
+            ms, pnn is a percentage; rejected windows are NaN.
+    """
+    tNN = np.asarray(tNN, dtype=float)
+    NN = np.asarray(NN, dtype=float) * 1000
+    alpha = HRVparams['timedomain']['alpha']
+    _, valid, i0, i1 = _window_bounds(tNN, windows, HRVparams['windowlength'])
+
+    nn, mask = _stack_windows(NN, i0, i1)
+    n = mask.sum(axis=1).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(nn, axis=1) / n
+        dev = nn - mean[:, None]
+        var = np.nansum(dev ** 2, axis=1) / (n - 1)
+        m2 = np.nansum(dev ** 2, axis=1) / n
+        skew = np.nansum(dev ** 3, axis=1) / n / m2 ** 1.5
+        kurt = np.nansum(dev ** 4, axis=1) / n / m2 ** 2
+        # Successive differences only between beats of the same window
+        d = np.abs(np.diff(nn, axis=1))
+        nd = np.sum(~np.isnan(d), axis=1).astype(float)
+        rmssd = np.sqrt(np.nansum(d ** 2, axis=1) / nd)
+        pnn = 100 * np.sum(d > alpha, axis=1) / nd
+
+    empty = ~valid | (n < 2)
+    nn_sorted = np.sort(nn, axis=1)  # padding NaNs sort last
+
+    out = {
+        'NNmean': mean,
+        'NNmedian': _sorted_percentile(nn_sorted, n, 0.5),
+        'NNvariance': var,
+        'NNskew': skew,
+        'NNkurt': kurt,
+        'NNiqr': _sorted_percentile(nn_sorted, n, 0.75) - _sorted_percentile(nn_sorted, n, 0.25),
+        'SDNN': np.sqrt(var),
+        'RMSSD': rmssd,
+        f'pnn{alpha:g}': pnn,
+        'numbeats': n,
+    }
+    for key in out:
+        if key != 'numbeats':
+            out[key] = np.where(empty, np.nan, out[key])
+    return out
+
+
+def _row_std(x):
+    """Sample standard deviation (ddof=1) of the non-NaN entries of every row, NaN below 2 entries."""
+    ok = ~np.isnan(x)
+    n = ok.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(ok, x, 0.0).sum(axis=1) / n
+        var = np.where(ok, (x - mean[:, None]) ** 2, 0.0).sum(axis=1) / (n - 1)
+    return np.where(n >= 2, np.sqrt(var), np.nan)
+
+
+def eval_sd_hrv(tNN, NN, HRVparams, windows, windowlength=None):
+    """
+    SDANN and SDNNI of all windows at once.
+
+    Every window is cut into segments of sd['segmentlength'] seconds; the
+    mean and SD of each segment come from cumulative sums over the whole
+    series. Segments missing more than MissingDataThreshold of their
+    length are skipped. SDANN is the SD of the segment means and SDNNI the
+    mean of the segment SDs, so a window needs at least two segments for
+    SDANN (e.g. the whole record: windows=[0], windowlength=tNN[-1]).
+
+    Parameters:
+        tNN (np.ndarray): Time of each NN interval (s), increasing
+        NN (np.ndarray): NN intervals (s)
+        HRVparams (dict): Uses sd['segmentlength'], MissingDataThreshold
+            and 'windowlength' (when windowlength is None)
+        windows (list): Window start times (s), NaN for rejected windows
+
+    Returns:
+        dict: SDANN, SDNNI per window (ms)
+    """
+    tNN = np.asarray(tNN, dtype=float)
+    NN = np.asarray(NN, dtype=float)
+    seglen = HRVparams['sd']['segmentlength']
+    if windowlength is None:
+        windowlength = HRVparams['windowlength']
+    starts = np.asarray(windows, dtype=float)
+    nseg = max(int(windowlength // seglen), 1)
+    seg_starts = (starts[:, None] + seglen * np.arange(nseg)).ravel()
+    _, valid, i0, i1 = _window_bounds(tNN, seg_starts, seglen)
+
+    x = NN * 1000
+    x0 = x.mean() if len(x) else 0.0
+    cs = np.concatenate(([0.0], np.cumsum(x - x0)))
+    cs2 = np.concatenate(([0.0], np.cumsum((x - x0) ** 2)))
+    n = (i1 - i0).astype(float)
+    s = cs[i1] - cs[i0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s / n + x0
+        sd = np.sqrt(np.clip((cs2[i1] - cs2[i0] - s * s / n) / (n - 1), 0, None))
+    covered = (s + n * x0) / 1000 >= seglen * (1 - HRVparams['MissingDataThreshold'])
+    ok = valid & (n >= 2) & covered
+    mean = np.where(ok, mean, np.nan).reshape(len(starts), nseg)
+    sd = np.where(ok, sd, np.nan).reshape(len(starts), nseg)
+
+    nsd = (~np.isnan(sd)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sdnni = np.where(nsd > 0, np.nansum(sd, axis=1) / nsd, np.nan)
+    return {'SDANN': _row_std(mean), 'SDNNI': sdnni}
+
+
+def eval_poincare_hrv(tNN, NN, HRVparams, windows):
+    """
+    Poincare descriptors of all windows at once.
+
+    SD1 and SD2 are the SDs of the successive-interval pairs (NN[i], NN[i+1])
+    of a window across and along the line of identity:
+    SD1 = std(NN[i] - NN[i+1]) / sqrt(2), SD2 = std(NN[i] + NN[i+1]) / sqrt(2),
+    with pairs taken only between beats of the same window.
+
+    Returns:
+        dict: SD1, SD2 (ms) and SD1SD2 (SD1 / SD2) per window
+    """
+    tNN = np.asarray(tNN, dtype=float)
+    NN = np.asarray(NN, dtype=float) * 1000
+    _, valid, i0, i1 = _window_bounds(tNN, windows, HRVparams['windowlength'])
+    nn, _ = _stack_windows(NN, i0, i1)
+    sd1 = _row_std(nn[:, 1:] - nn[:, :-1]) / np.sqrt(2)
+    sd2 = _row_std(nn[:, 1:] + nn[:, :-1]) / np.sqrt(2)
+    sd1 = np.where(valid, sd1, np.nan)
+    sd2 = np.where(valid, sd2, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = sd1 / sd2
+    return {'SD1': sd1, 'SD2': sd2, 'SD1SD2': ratio}
+
+
+def _lomb_psd(tNN, NN, i0, i1, df, nfreq, zero_mean):
+    """
+    Batched Lomb-Scargle PSD (s^2/Hz) of every window on the grid f = df * (1..nfreq).
+
+    exp(i*2*pi*f*t) is built for all frequencies by a cumulative product
+    along the (uniform) frequency axis instead of evaluating sin/cos per
+    term, and the periodogram is written in terms of the two sums
+    sum(y * z) and sum(z**2); windows are processed in blocks.
+    """
+    W = len(i0)
+    psd = np.full((W, nfreq), np.nan)
+    lmax = int((i1 - i0).max()) if W else 0
+    if lmax == 0:
+        return psd
+    block = max(1, LOMB_BLOCK_TERMS // (lmax * nfreq))
+
+    for b0 in range(0, W, block):
+        sl = slice(b0, min(b0 + block, W))
+        t, mask = _stack_windows(tNN, i0[sl], i1[sl])
+        y, _ = _stack_windows(NN, i0[sl], i1[sl])
+        n = mask.sum(axis=1)
+        t = np.where(mask, t - np.nanmin(np.where(mask, t, np.inf), axis=1, keepdims=True), 0.0)
+        if zero_mean:
+            y = y - np.nanmean(y, axis=1, keepdims=True)
+        y = np.where(mask, y, 0.0)
+
+        step = np.exp(2j * np.pi * df * t)
+        z = np.cumprod(np.broadcast_to(step[:, :, None], step.shape + (nfreq,)), axis=2)
+        yz = np.einsum('wl,wlf->wf', y, z)
+        z *= z
+        z2 = np.einsum('wl,wlf->wf', mask.astype(float), z)
+        # Lomb's time offset tau rotates sum(z**2) onto the real axis
+        rot = np.exp(-0.5j * np.angle(z2))
+        yz *= rot
+        r = np.abs(z2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cc = (n[:, None] + r) / 2
+            ss = (n[:, None] - r) / 2
+            P = 0.5 * (yz.real ** 2 / cc + yz.imag ** 2 / ss)
+            # Scale so that the PSD integrates to the variance of the window
+            P *= (2 * t.max(axis=1) / n)[:, None]
+        P[n < 3] = np.nan
+        psd[sl] = P
+    return psd
+
+
+def _welch_psd(tNN, NN, starts, valid, HRVparams, zero_mean):
+    """Resample the whole NN series once, then Welch every window as a strided view."""
+    from scipy.interpolate import CubicSpline
+    from scipy.signal import welch
+
+    fs_r = HRVparams['freq']['resampling_freq']
+    wl = HRVparams['windowlength']
+    t_grid = np.arange(tNN[0], tNN[-1], 1.0 / fs_r)
+    if HRVparams['freq'].get('resample_interp_method', 'cub') == 'cub':
+        x = CubicSpline(tNN, NN)(t_grid)
+    else:
+        x = np.interp(t_grid, tNN, NN)
+
+    nwin = int(round(wl * fs_r))
+    nperseg = min(nwin, int(round(fs_r * wl / 2)))
+    f = np.fft.rfftfreq(nperseg, 1.0 / fs_r)
+    psd = np.full((len(starts), len(f)), np.nan)
+    if len(x) < nwin:
+        return f, psd
+
+    idx = np.round((np.where(valid, starts, 0) - tNN[0]) * fs_r).astype(int)
+    ok = valid & (idx >= 0) & (idx + nwin <= len(x))
+    segments = np.lib.stride_tricks.sliding_window_view(x, nwin)[idx[ok]]
+    if zero_mean:
+        segments = segments - segments.mean(axis=1, keepdims=True)
+    _, psd[ok] = welch(segments, fs=fs_r, nperseg=nperseg, detrend='linear', axis=-1)
+    return f, psd
+
+
+def eval_frequency_domain_hrv(tNN, NN, HRVparams, windows):
+    """
+    Frequency-domain HRV of all windows at once.
+
+    With freq['method'] == 'lomb' a Lomb-Scargle periodogram is evaluated on
+    the unevenly sampled NN series of every window in batched array
+    operations. Any other method resamples the whole series once at
+    freq['resampling_freq'] and runs a single Welch call over all windows.
+
+    Returns:
+        dict: ulf, vlf, lf, hf, lfhf, ttlpwr per window (ms^2), plus 'f'
+            and 'psd' (W, F) in s^2/Hz
+    """
+    tNN = np.asarray(tNN, dtype=float)
+    NN = np.asarray(NN, dtype=float)
+    zero_mean = HRVparams['freq'].get('zero_mean', 1)
+    starts, valid, i0, i1 = _window_bounds(tNN, windows, HRVparams['windowlength'])
+    limits = np.asarray(HRVparams['freq']['limits'], dtype=float)
+
+    if HRVparams['freq']['method'] == 'lomb':
+        df = 1.0 / (2 * HRVparams['windowlength'])
+        nfreq = int(np.ceil(limits[-1, 1] / df))
+        f = df * np.arange(1, nfreq + 1)
+        psd = _lomb_psd(tNN, NN, i0, i1, df, nfreq, zero_mean)
+    else:
+        f, psd = _welch_psd(tNN, NN, starts, valid, HRVparams, zero_mean)
+    psd[~valid] = np.nan
+
+    df = np.gradient(f) if len(f) > 1 else np.ones_like(f)
+    out = {}
+    for name, (lo, hi) in zip(BAND_NAMES, limits):
+        band = (f >= lo) & (f < hi)
+        out[name] = (psd[:, band] * df[band]).sum(axis=1) * 1e6
+    total = (f >= limits[0, 0]) & (f < limits[-1, 1])
+    out['ttlpwr'] = (psd[:, total] * df[total]).sum(axis=1) * 1e6
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out['lfhf'] = out['lf'] / out['hf']
+    out['f'] = f
+    out['psd'] = psd
+    return out
+
+
+def compute_hrv_metrics(tNN, NN, HRVparams, windows=None):
+    """
+    Time-domain, frequency-domain, SDANN/SDNNI and Poincare HRV for every
+    analysis window of a record (each section only when its 'on' is set).
+
+    The series is used as it is; clean the RR intervals of
+    ConvertRawDataToRRIntervals once with RRIntervalPreprocess.preprocess_rr()
+    and pass its tNN, NN and windows.
+
+    Parameters:
+        tNN (np.ndarray): Time of each NN interval (s)
+        NN (np.ndarray): Cleaned NN intervals (s)
+        HRVparams (dict): HRV settings (windowlength, timedomain, freq, sd, poincare)
+        windows (list): Window start times; computed with
+            create_window_rr_intervals when omitted (no quality rejection)
+
+    Returns:
+        dict: 't_start' plus one array per metric, one entry per window
+    """
+    tNN = np.asarray(tNN, dtype=float)
+    NN = np.asarray(NN, dtype=float)
+    if windows is None:
+        windows = create_window_rr_intervals(tNN, NN, HRVparams)
+
+    results = {'t_start': np.asarray(windows, dtype=float)}
+    if HRVparams['timedomain']['on']:
+        results.update(eval_time_domain_hrv(tNN, NN, HRVparams, windows))
+    if HRVparams['freq']['on']:
+        freq = eval_frequency_domain_hrv(tNN, NN, HRVparams, windows)
+        freq.pop('f')
+        freq.pop('psd')
+        results.update(freq)
+    if HRVparams['sd']['on']:
+        results.update(eval_sd_hrv(tNN, NN, HRVparams, windows))
+    if HRVparams['poincare']['on']:
+        results.update(eval_poincare_hrv(tNN, NN, HRVparams, windows))
+    return results
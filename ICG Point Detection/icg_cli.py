@@ -0,0 +1,330 @@
+"""
+Command-line entry point of the ICG point detection pipeline.
+
+    python icg_cli.py detect-qrs RawData_Subject_1_task_BL_converted.xlsx
+    python icg_cli.py sqi recording.icgz -o sqi.csv
+    python icg_cli.py hrv recording.icgz -o hrv.csv
+    python icg_cli.py denoise recording.hea -o denoised.npz
+    python icg_cli.py bcx recording.xlsx -o beats.csv
+    python icg_cli.py plot denoised.npz -o figures/
+    python icg_cli.py --memory-budget 1.5G bcx long_session.icgz -o beats.csv
+
+Sample indices and times in the outputs count from the start of the
+recording, also when only a part of it is loaded with --start.
+
+Only argparse/numpy are imported at startup; scipy, pywt, PyEMD, pandas and
+matplotlib are imported by the subcommand that needs them (see
+startup_benchmark.py for the import cost of each command).
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+
+import numpy as np
+
+
+def _hrv_params(args):
+    from InitializeHRVparams import InitializeHRVparams
+    HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+    HRVparams['Fs'] = args.fs
+    HRVparams['ICG']['dtype'] = args.dtype
+    HRVparams['ICG']['gating'] = int(getattr(args, 'gating', False))
+    return HRVparams
+
+
+def _start(args):
+    """First loaded sample (--start); added to the sample indices / times of the outputs."""
+    return int(args.start * args.fs)
+
+
+def _load(args):
+    from load_ecg_icg import load_ecg_icg
+    stop = None if args.stop is None else int(args.stop * args.fs)
+    return load_ecg_icg(args.recording, _start(args), stop, dtype=args.dtype)
+
+
+def _cache(args):
+    if not args.cache:
+        return None
+    from stage_cache import StageCache
+    return StageCache(args.cache)
+
+
+def _write_columns(path, header, columns, fmt):
+    """Write columns as CSV to path, or to stdout when path is None."""
+    table = np.column_stack(columns) if len(columns[0]) else np.empty((0, len(columns)))
+    np.savetxt(path if path else sys.__stdout__, table, delimiter=',', header=','.join(header), comments='', fmt=fmt)
+
+
+def _pipeline(args, required=()):
+    """
+    Load the recording and build the pipeline. With --memory-budget the
+    settings come from memory_budget.plan(), made from the file header
+    before loading (.icgz, WFDB) or right after loading (CSV, Excel);
+    required names the process() outputs the command needs.
+
+    Returns:
+        ecg, icg, pipeline, estimate (None without a budget)
+    """
+    from icg_pipeline import ICGPipeline
+    HRVparams = _hrv_params(args)
+    budget = args.memory_budget or HRVparams['memory']['budget_bytes']
+    estimate = None
+    if budget:
+        from load_ecg_icg import recording_length
+        from memory_budget import plan
+        info = recording_length(args.recording)
+        if info is not None:
+            # 读取数据之前就按文件头规划, 放不下时直接报错
+            stop = None if args.stop is None else int(args.stop * args.fs)
+            n = len(range(*slice(_start(args), stop).indices(info[0])))
+            HRVparams, estimate = plan(n, args.fs, HRVparams, budget, required)
+            args.dtype = HRVparams['ICG']['dtype']
+    ecg, icg = _load(args)
+    if budget and estimate is None:
+        from memory_budget import plan
+        HRVparams, estimate = plan(len(ecg), args.fs, HRVparams, budget, required, loaded_dtype=ecg.dtype)
+    return ecg, icg, ICGPipeline(args.fs, HRVparams, cache=_cache(args)), estimate
+
+
+@contextlib.contextmanager
+def _measured(estimate):
+    """Report the estimated and the actual peak memory of the block (--memory-budget)."""
+    if estimate is None:
+        yield
+        return
+    from memory_budget import PeakMemory, describe
+    with PeakMemory() as peak:
+        yield
+    print(describe(estimate, peak))
+
+
+def _run_pipeline(args, required=(), **kwargs):
+    ecg, icg, pipeline, estimate = _pipeline(args, required)
+    with _measured(estimate):
+        result = pipeline.process(ecg, icg, subjectID=args.subject, **kwargs)
+    return icg, pipeline, result
+
+
+def cmd_detect_qrs(args):
+    from run_qrsdet_by_seg import run_qrsdet_by_seg
+    ecg, _ = _load(args)
+    R_pk = np.asarray(run_qrsdet_by_seg(ecg, _hrv_params(args)), dtype=int) + _start(args)
+    _write_columns(args.output, ['sample', 'time_s'], [R_pk, R_pk / args.fs], ['%d', '%.3f'])
+
+
+def cmd_sqi(args):
+    from annotation_writer import AnnotationWriter
+    from ConvertRawDataToRRIntervals import ConvertRawDataToRRIntervals
+    ecg, _ = _load(args)
+    with AnnotationWriter(in_memory=True) as writer:
+        _, _, _, SQIjw, StartSQIwindows = ConvertRawDataToRRIntervals(ecg, _hrv_params(args), args.subject,
+                                                                     writer=writer, cache=_cache(args))
+    _write_columns(args.output, ['window_start_s', 'SQIjw'],
+                   [np.asarray(StartSQIwindows, dtype=float) + _start(args) / args.fs, np.asarray(SQIjw, dtype=float)],
+                   ['%.3f', '%.4f'])
+
+
+def cmd_hrv(args):
+    from annotation_writer import AnnotationWriter
+    from ConvertRawDataToRRIntervals import ConvertRawDataToRRIntervals
+    from hrv_metrics import compute_hrv_metrics, eval_sd_hrv
+    from RRIntervalPreprocess import preprocess_rr
+    ecg, _ = _load(args)
+    HRVparams = _hrv_params(args)
+    with AnnotationWriter(in_memory=True) as writer:
+        t, rr, _, SQIjw, StartSQIwindows = ConvertRawDataToRRIntervals(ecg, HRVparams, args.subject, writer=writer,
+                                                                      cache=_cache(args))
+    # RR 只清洗一次, 窗口与各项指标都复用清洗结果
+    nn = preprocess_rr(rr, t, HRVparams, SQI=SQIjw, StartSQIwindows=StartSQIwindows)
+    t, rr = nn['tNN'], nn['NN']
+    print(f"{int((~nn['keep']).sum())} of {len(nn['keep'])} RR intervals removed, "
+          f"{int(np.isnan(nn['windows']).sum())} of {len(nn['windows'])} windows rejected")
+    metrics = compute_hrv_metrics(t, rr, HRVparams, nn['windows'])
+    metrics['t_start'] = metrics['t_start'] + _start(args) / args.fs
+    names = list(metrics)
+    _write_columns(args.output, names, [np.asarray(metrics[k], dtype=float) for k in names], '%.6g')
+    if HRVparams['sd']['on'] and len(t):
+        # SDANN/SDNNI 按整段记录计算 (分析窗口通常只含一个 5 min 段)
+        sd = eval_sd_hrv(t, rr, HRVparams, [0.0], t[-1])
+        print(f"record: SDANN {sd['SDANN'][0]:.2f} ms, SDNNI {sd['SDNNI'][0]:.2f} ms")
+
+
+def cmd_denoise(args):
+    icg, pipeline, result = _run_pipeline(args)
+    beats_clean, beats_denoised, beat_len, filtered_icg, denoised_icg_full, valid_R_peaks = result
+    output = args.output or f'{args.subject}_denoised.npz'
+    # 内存预算下被舍弃的输出 (None) 不写入
+    signals = dict(icg=icg, filtered_icg=filtered_icg, denoised_icg_full=denoised_icg_full, beats_clean=beats_clean)
+    np.savez_compressed(output, **{k: v for k, v in signals.items() if v is not None},
+                        beats_denoised=beats_denoised, beat_len=beat_len,
+                        valid_R_peaks=np.asarray(valid_R_peaks) + _start(args), start=_start(args), fs=args.fs,
+                        llim_beat=pipeline.llim_beat)
+    dropped = [k for k, v in signals.items() if v is None]
+    print(f"{len(valid_R_peaks)} beats, beat length {beat_len} -> {output}"
+          + (f" (dropped for the memory budget: {', '.join(dropped)})" if dropped else ''))
+
+
+def cmd_bcx(args):
+    if args.group_beats or args.group_seconds:
+        return cmd_bcx_ensemble(args)
+    if args.decimate:
+        return cmd_bcx_multirate(args)
+    from beat_store import build_beat_table
+    from datetime import datetime
+    _, pipeline, result = _run_pipeline(args, return_sqi=True)
+    beats_denoised, valid_R_peaks, sqi = result[1], result[5], result[6]
+    b_rel, c_rel, x_rel = pipeline.extract_bcx(beats_denoised)
+    start = _start(args)
+    # build_beat_table() 的样本号与时间都相对于 session_start (整个文件的第一个样本)
+    sqi = dict(sqi, StartSQIwindows=np.asarray(sqi['StartSQIwindows'], dtype=float) + start / args.fs)
+    table = build_beat_table(args.subject, np.asarray(valid_R_peaks) + start, b_rel, c_rel, x_rel, fs=args.fs,
+                             session_start=datetime.fromtimestamp(os.path.getmtime(args.recording)),
+                             llim_beat=pipeline.llim_beat, **sqi)
+    table.to_csv(args.output if args.output else sys.__stdout__, index=False)
+
+
+def cmd_bcx_ensemble(args):
+    ecg, icg, pipeline, estimate = _pipeline(args)
+    with _measured(estimate):
+        trend = pipeline.process_ensemble(ecg, icg, subjectID=args.subject, group_beats=args.group_beats,
+                                          group_seconds=args.group_seconds, step=args.step)
+    _write_columns(args.output, ['t_s', 'n_beats', 'b_rel', 'c_rel', 'x_rel', 'pep_s', 'lvet_s'],
+                   [trend['t'] + _start(args) / args.fs, trend['n_beats'], trend['b_rel'], trend['c_rel'], trend['x_rel'],
+                    trend['pep'], trend['lvet']], ['%.3f', '%d', '%.0f', '%.0f', '%.0f', '%.4f', '%.4f'])
+
+
+def cmd_bcx_multirate(args):
+    ecg, icg, pipeline, estimate = _pipeline(args)
+    with _measured(estimate):
+        res = pipeline.process_multirate(ecg, icg, subjectID=args.subject, decimate=args.decimate)
+    _write_columns(args.output, ['R_peak', 'b_rel', 'c_rel', 'x_rel', 'pep_s', 'lvet_s'],
+                   [res['R_peaks'] + _start(args), res['b_rel'], res['c_rel'], res['x_rel'], res['pep'], res['lvet']],
+                   ['%d', '%.2f', '%.2f', '%.2f', '%.4f', '%.4f'])
+
+
+def cmd_plot(args):
+    import matplotlib
+    if args.output:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from icg_pipeline import extract_bcx_points_from_beats
+
+    if args.recording.lower().endswith('.npz'):
+        data = dict(np.load(args.recording))
+    else:
+        icg, _, result = _run_pipeline(args, required=('filtered_icg', 'denoised_icg_full'))
+        data = dict(icg=icg, filtered_icg=result[3], denoised_icg_full=result[4], beats_denoised=result[1],
+                    start=_start(args))
+    beats_denoised = data['beats_denoised']
+    b_rel, c_rel, x_rel = extract_bcx_points_from_beats(beats_denoised)
+
+    figures = {}
+    figures['avg_icg_with_bcx.png'] = plt.figure(figsize=(12, 6))
+    plt.plot(np.mean(beats_denoised, axis=0), label="Avg Denoised ICG", linewidth=2)
+    plt.axvline(np.mean(b_rel), color='r', linestyle='--', label='B (mean)')
+    plt.axvline(np.mean(c_rel), color='g', linestyle='--', label='C (mean)')
+    plt.axvline(np.mean(x_rel), color='b', linestyle='--', label='X (mean)')
+    plt.title("Avg ICG Beat with BCX Feature Points")
+    plt.xlabel("Sample Index")
+    plt.ylabel("Amplitude")
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+
+    figures['full_denoised_icg.png'] = plt.figure(figsize=(16, 6))
+    n = np.arange(len(data['icg'])) + int(data.get('start', 0))
+    plt.plot(n, data['icg'], label='Raw ICG', alpha=0.4)
+    plt.plot(n, data['filtered_icg'], label='Filtered ICG (bandpass)', alpha=0.6)
+    plt.plot(n, data['denoised_icg_full'], label='Denoised ICG (full signal)', linewidth=1.5)
+    plt.title("Full ICG Signal Before and After Denoising")
+    plt.xlabel("Sample")
+    plt.ylabel("Amplitude")
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for name, fig in figures.items():
+            fig.savefig(os.path.join(args.output, name), dpi=300)
+            print(os.path.join(args.output, name))
+    else:
+        plt.show()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='icg_cli', description='ICG B/C/X point detection pipeline')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log pipeline progress to stderr')
+    parser.add_argument('--profile', default=None, help='write per-stage wall/CPU time and peak memory (JSON)')
+    parser.add_argument('--trace', default=None, help='write a Chrome trace of the stages (JSON)')
+    parser.add_argument('--memory', action='store_true',
+                        help='also record peak allocated memory per stage (tracemalloc, much slower)')
+    parser.add_argument('--memory-budget', default=None, metavar='SIZE',
+                        help='peak memory of the run, e.g. 1.5G: picks chunking, float32 and dropped '
+                             'intermediates to fit, fails before loading when it cannot (memory_budget.py)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add(name, func, help, output_help):
+        p = sub.add_parser(name, help=help)
+        p.add_argument('recording', help='.xlsx, .icgz, WFDB .hea or CSV/TSV recording')
+        p.add_argument('-o', '--output', default=None, help=output_help)
+        p.add_argument('--fs', type=int, default=1000, help='sampling frequency (Hz), default 1000')
+        p.add_argument('--start', type=float, default=0, help='start time (s)')
+        p.add_argument('--stop', type=float, default=None, help='stop time (s)')
+        p.add_argument('--subject', default='real_data', help='record name used for annotations/outputs')
+        p.add_argument('--cache', default=None, help='stage cache folder (reuses unchanged stages)')
+        p.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                       help='working sample type (float32 halves memory)')
+        p.set_defaults(func=func)
+        return p
+
+    add('detect-qrs', cmd_detect_qrs, 'list R peak locations', 'CSV file (stdout when omitted)')
+    add('sqi', cmd_sqi, 'jqrs/wqrs agreement (bSQI) per SQI window', 'CSV file (stdout when omitted)')
+    add('hrv', cmd_hrv, 'time/frequency-domain, SDANN/SDNNI and Poincare HRV per analysis window',
+        'CSV file (stdout when omitted)')
+    denoise = add('denoise', cmd_denoise, 'band-pass + wavelet/EEMD/LMS denoising', '.npz file')
+    p = add('bcx', cmd_bcx, 'per-beat B/C/X points, PEP and LVET', 'CSV file (stdout when omitted)')
+    for q in (denoise, p):
+        q.add_argument('--gating', action='store_true',
+                       help='skip denoising of beats with low bSQI / ICG quality (beat_quality.gate_beats)')
+    p.add_argument('--group-beats', type=int, default=None,
+                   help='ensemble mode: B/C/X of the robust mean of every N beats')
+    p.add_argument('--group-seconds', type=float, default=None,
+                   help='ensemble mode: B/C/X of the robust mean of every T seconds')
+    p.add_argument('--step', type=float, default=None, help='ensemble group shift (beats / s)')
+    p.add_argument('--decimate', type=int, default=None,
+                   help='multi-rate mode: denoise at fs / N, refine B/C/X at full rate')
+    add('plot', cmd_plot, 'average beat and full-signal figures (recording or denoise .npz)',
+        'folder for the PNG files (interactive window when omitted)')
+    return parser
+
+
+def main(argv=None):
+    from memory_budget import MemoryBudgetError
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    step = getattr(args, 'step', None)
+    if step is not None:
+        if getattr(args, 'group_beats', None) and (step < 1 or step != int(step)):
+            parser.error(f"--step must be a whole number of beats >= 1 with --group-beats, got {step:g}")
+        if step <= 0:
+            parser.error(f"--step must be > 0, got {step:g}")
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    profile = contextlib.nullcontext()
+    if args.profile or args.trace:
+        from instrumentation import profile_run
+        profile = profile_run(args.profile, args.trace, memory=args.memory)
+    # Progress messages of the pipeline go to stderr, so CSV results on stdout can be piped
+    try:
+        with contextlib.redirect_stdout(sys.stderr), profile:
+            args.func(args)
+    except MemoryBudgetError as e:
+        sys.exit(f"icg_cli: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,693 @@
+import copy
+import logging
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+import pywt
+from scipy.signal import butter
+
+from InitializeHRVparams import InitializeHRVparams
+from ConvertRawDataToRRIntervals import ConvertRawDataToRRIntervals
+from annotation_writer import AnnotationWriter
+from beat_index import BeatIndex
+from beat_quality import gate_beats
+from chunked_filtfilt import CHUNK_SIZE, chunked_sosfiltfilt
+from compute_backend import backend_from_params, get_kernel, kernel
+from instrumentation import instrument, span
+from stage_cache import code_version, run_stage
+from time_budget import DEADLINE_BEAT, DEADLINE_RECORDING, DeadlineExceeded, RunStats
+
+logger = logging.getLogger(__name__)
+
+# ==== 自适应软阈值小波去噪 ====
+def adaptive_soft_threshold(coeffs, sigma=None):
+    if sigma is None:
+        sigma = np.median(np.abs(coeffs[-1])) / 0.6745
+    uthresh = sigma * np.sqrt(2 * np.log(len(coeffs[-1])))
+    return [coeffs[0]] + [pywt.threshold(c, value=uthresh, mode='soft') for c in coeffs[1:]]
+
+def wavelet_denoise(signal, wavelet_name='db4', level=3):
+    coeffs = pywt.wavedec(signal, wavelet=wavelet_name, level=level)
+    coeffs_thresh = adaptive_soft_threshold(coeffs)
+    return pywt.waverec(coeffs_thresh, wavelet=wavelet_name)
+
+# ==== EEMD 去噪 ====
+def eemd_denoise(signal, max_imfs=10, eemd=None):
+    if eemd is None:
+        from PyEMD import EEMD  # PyEMD 会导入 matplotlib, 仅在需要时加载
+        eemd = EEMD()
+    imfs = eemd.eemd(signal)
+    return np.sum(imfs[1:min(max_imfs, len(imfs))], axis=0)
+
+# ==== LMS 滤波 ====
+@kernel('lms', example=lambda rng: (rng.standard_normal(5000), rng.standard_normal(5000), 0.01, 5, np.zeros(5000)))
+def lms_kernel(signal, desired, mu, order, y):
+    w = np.zeros(order)  # 权重始终以 float64 累加
+    for n in range(order, len(signal)):
+        acc = 0.0
+        for j in range(order):
+            acc += w[j] * signal[n - 1 - j]
+        y[n] = acc
+        e = desired[n] - y[n]
+        for j in range(order):
+            w[j] += 2 * mu * e * signal[n - 1 - j]
+    return y
+
+def lms_filter(signal, desired, mu=0.01, order=5, backend=None):
+    signal, desired = np.asarray(signal), np.asarray(desired)
+    y = np.zeros(len(signal), dtype=np.result_type(signal, np.float32))
+    return get_kernel('lms', backend)(signal, desired, mu, order, y)
+
+# ==== 三阶导数函数 ====
+def third_derivative(signal):
+    return np.gradient(np.gradient(np.gradient(signal)))
+
+def detect_c_point_from_r(signal, r_idx, fs=1000):
+    start = r_idx + int(0.08 * fs)
+    end = r_idx + int(0.15 * fs)
+    if end > len(signal): end = len(signal)
+    region = signal[start:end]
+    if len(region) == 0:
+        return None
+    peak_rel = np.argmax(region)
+    return start + peak_rel
+
+def detect_b_point_from_r(signal, r_idx, fs=1000):
+    start = r_idx + int(0.01 * fs)
+    end = r_idx + int(0.08 * fs)
+    if end > len(signal): end = len(signal)
+    region = third_derivative(signal[start:end])
+    if len(region) == 0:
+        return None
+    b_rel = np.argmin(region)
+    return start + b_rel
+
+def detect_x_point_from_r(signal, r_idx, fs=1000):
+    start = r_idx + int(0.20 * fs)
+    end = r_idx + int(0.35 * fs)
+    if end > len(signal): end = len(signal)
+    region = signal[start:end]
+    if len(region) == 0:
+        return None
+    x_rel = np.argmin(region)
+    return start + x_rel
+
+def extract_bcx_points_from_beats(beats_denoised, cache=None):
+    def extract():
+        return _extract_bcx(beats_denoised)
+    return run_stage(cache, 'bcx', extract, np.asarray(beats_denoised),
+                     version=lambda: code_version(_extract_bcx, third_derivative))[0]
+
+@instrument('bcx')
+def _extract_bcx(beats_denoised):
+    b_list, c_list, x_list = [], [], []
+    for beat in beats_denoised:
+        N = len(beat)
+        try:
+            c_start, c_end = int(0.6*N), int(0.8*N)
+            c_idx = np.argmax(beat[c_start:c_end]) + c_start
+
+            # 提前B点窗口起始 & 限制查找区间不得靠近C
+            b_start = int(0.05 * N)
+            b_end = c_idx - int(0.05 * N)
+            b_region = third_derivative(beat[b_start:b_end])
+            b_idx = np.argmin(b_region) + b_start
+
+            x_start = c_idx + int(0.05 * N)
+            x_end = int(0.95 * N)
+            x_idx = np.argmin(beat[x_start:x_end]) + x_start
+        except:
+            b_idx, c_idx, x_idx = None, None, None
+        b_list.append(b_idx)
+        c_list.append(c_idx)
+        x_list.append(x_idx)
+    return np.array(b_list), np.array(c_list), np.array(x_list)
+
+
+def beat_groups(t, group_beats=None, group_seconds=None, step=None):
+    """
+    Index ranges of sliding beat groups.
+
+    Parameters:
+        t (np.ndarray): Beat times (s), increasing
+        group_beats (int): Beats per group, or
+        group_seconds (float): Seconds per group
+        step (int or float): Group shift in beats (a whole number >= 1) / seconds (> 0);
+            one full group when None
+
+    Returns:
+        list of (i0, i1): Beats t[i0:i1] of each non-empty group
+    """
+    t = np.asarray(t, dtype=float)
+    n = len(t)
+    if n == 0:
+        return []
+    groups = []
+    if group_beats:
+        N = int(group_beats)
+        if step is not None and (step < 1 or step != int(step)):
+            raise ValueError(f"step must be a whole number of beats >= 1 with group_beats, got {step}")
+        S = int(step) if step else N
+        for i0 in range(0, n, S):
+            i1 = min(i0 + N, n)
+            # a short tail group is only kept when it is the only group
+            if groups and i1 - i0 < max(1, N // 2):
+                break
+            groups.append((i0, i1))
+            if i1 == n:
+                break
+    elif group_seconds:
+        if step is not None and step <= 0:
+            raise ValueError(f"step must be > 0 seconds with group_seconds, got {step}")
+        S = step if step else group_seconds
+        ws = t[0] + S * np.arange(int(np.floor((t[-1] - t[0]) / S)) + 1)
+        i0 = np.searchsorted(t, ws, side='left')
+        i1 = np.searchsorted(t, ws + group_seconds, side='left')
+        groups = [(a, b) for a, b in zip(i0.tolist(), i1.tolist()) if b > a]
+    else:
+        raise ValueError("Either group_beats or group_seconds must be given")
+    return groups
+
+def ensemble_average(beats, trim=0.1):
+    """
+    Robust mean beat of R-aligned beats: trimmed mean cutting `trim` of the
+    values at each end of every sample (plain mean for 0, median for >= 0.5).
+    Accumulates in float64 and returns the dtype of the beats.
+    """
+    beats = np.asarray(beats)
+    dtype = beats.dtype if beats.dtype.kind == 'f' else np.float64
+    if trim <= 0 or len(beats) < 3:
+        return beats.mean(axis=0, dtype=np.float64).astype(dtype, copy=False)
+    if trim >= 0.5:
+        return np.median(beats, axis=0).astype(dtype, copy=False)
+    from scipy.stats import trim_mean
+    return trim_mean(beats.astype(np.float64), trim, axis=0).astype(dtype, copy=False)
+
+
+def _parabola(y, i):
+    """Sub-sample offset of the extremum y[i] from a parabola through its neighbours."""
+    den = y[i - 1] - 2 * y[i] + y[i + 1]
+    return float(np.clip(0.5 * (y[i - 1] - y[i + 1]) / den, -0.5, 0.5)) if den != 0 else 0.0
+
+
+def cascade_delay(output, reference, max_lag=None):
+    """
+    Delay of denoised beats against their input, in samples (fractional).
+
+    The causal LMS stage lags its input by a few samples, i.e. by more
+    milliseconds the lower the rate. The delay is the lag of the
+    cross-correlation peak of the mean output beat against the mean input
+    beat, refined with a parabola.
+
+    Parameters:
+        output (np.ndarray): (n_beats, beat_len) denoised beats
+        reference (np.ndarray): (n_beats, beat_len) the beats that were denoised
+        max_lag (int): Largest lag searched, beat_len // 10 when None
+
+    Returns:
+        float: Positive when the output is late
+    """
+    if len(output) == 0:
+        return 0.0
+    a = np.mean(np.asarray(output, dtype=np.float64), axis=0)
+    r = np.mean(np.asarray(reference, dtype=np.float64), axis=0)
+    n = len(a)
+    lag = max(n // 10, 1) if max_lag is None else max_lag
+    cc = np.correlate(a - a.mean(), r - r.mean(), 'full')[n - 1 - lag:n + lag]
+    i = int(np.argmax(cc))
+    return float(i - lag + (_parabola(cc, i) if 0 < i < len(cc) - 1 else 0.0))
+
+
+def refine_points(signal, positions, kind, half_width):
+    """
+    Refine coarse point positions on the full-rate signal.
+
+    For every beat the extremum is searched within +-half_width samples of
+    the coarse position and refined to a sub-sample position with a
+    parabola through its neighbours.
+
+    Parameters:
+        signal (np.ndarray): Full-rate band-passed ICG
+        positions (np.ndarray): Coarse absolute position per beat (full-rate samples, NaN when missing)
+        kind (str): 'max' (C), 'min' (X) or 'd3min' (B, minimum of the third derivative)
+        half_width (int): Search half-width (full-rate samples)
+
+    Returns:
+        np.ndarray: Absolute position per beat in full-rate samples (NaN when missing)
+    """
+    # 三阶导数需要在搜索窗口两侧各多取 3 个样本
+    pad = 3 if kind == 'd3min' else 0
+    out = np.full(len(positions), np.nan)
+    for k, p in enumerate(positions):
+        if np.isnan(p):
+            continue
+        c = int(round(p))
+        lo, hi = max(c - half_width - pad, 0), min(c + half_width + pad + 1, len(signal))
+        y = np.asarray(signal[lo:hi], dtype=np.float64)
+        y = third_derivative(y) if kind == 'd3min' and len(y) >= 3 else y
+        if kind != 'max':
+            y = -y
+        s0, s1 = max(c - half_width - lo, 1), min(c + half_width + 1 - lo, len(y) - 1)
+        if s1 <= s0:
+            out[k] = p
+            continue
+        i = s0 + int(np.argmax(y[s0:s1]))
+        out[k] = lo + i + _parabola(y, i)
+    return out
+
+
+class ICGPipeline:
+    """
+    ICG denoising and B/C/X detection, set up once per (fs, config).
+
+    Everything that only depends on the configuration is prepared in the
+    constructor: a private copy of HRVparams (no directories or timestamps
+    are created per call), the Butterworth band-pass coefficients, the
+    pywt.Wavelet objects of the cascade. The stage code versions used in
+    cache keys are hashed on first use. EEMD instances are kept per thread.
+    Progress messages go to the module logger (INFO).
+
+    ICG['dtype'] is the working sample type of the filtered signal, the beat
+    matrices and every denoising stage ('float32' halves memory and
+    bandwidth); filter states, LMS weights and overlap-add sums stay float64.
+
+    EEMD runs under the time budget of ICG['budget'] (per beat and per
+    recording, in seconds; None = unlimited). A beat whose EEMD misses the
+    deadline is cancelled and keeps its wavelet-only output; such beats are
+    reported through RunStats (process(stats=...) and the cumulative
+    pipeline.stats).
+
+    Stage outputs are released as soon as the next stage has consumed them.
+    HRVparams['memory'] can drop the filtered signal, the clean beat matrix
+    and the overlap-added signal from the outputs of process() (see
+    memory_budget.plan(), which picks these for a memory budget).
+
+    process() does not modify this state (pipeline.stats is locked), so one
+    pipeline can be used by many threads and for any number of recordings. Annotations are kept in
+    memory unless a writer is passed.
+
+    Usage:
+        pipeline = ICGPipeline(fs=1000)
+        beats_clean, beats_denoised, beat_len, filtered_icg, denoised_icg_full, valid_R_peaks = pipeline.process(ecg, icg)
+        b_rel, c_rel, x_rel = pipeline.extract_bcx(beats_denoised)
+    """
+
+    def __init__(self, fs=1000, HRVparams=None, cache=None):
+        if HRVparams is None:
+            HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+        self.HRVparams = copy.deepcopy(HRVparams)
+        self.HRVparams['Fs'] = fs
+        self.fs = fs
+        self.params = self.HRVparams['ICG']
+        self.dtype = np.dtype(self.params.get('dtype', 'float64'))
+        self.cache = cache
+
+        lo, hi = self.params['bandpass']
+        self.sos = butter(self.params['filter_order'], [lo / (fs / 2), hi / (fs / 2)], btype='band', output='sos')
+        self.wavelets = tuple(pywt.Wavelet(name) for name in self.params['wavelets'])
+        self.llim_beat = int(self.params['beat_pre'] * fs)
+        self._local = threading.local()
+        self.stats = RunStats()
+
+
+    @property
+    def eemd(self):
+        """EEMD instance of the calling thread (PyEMD keeps per-call state on the object)."""
+        eemd = getattr(self._local, 'eemd', None)
+        if eemd is None:
+            from budgeted_eemd import BudgetedEEMD  # PyEMD 会导入 matplotlib, 仅在需要时加载
+            parallel = bool(self.params.get('eemd_parallel', 1))
+            pool = {'processes': self.params.get('eemd_processes')} if parallel else {}
+            eemd = self._local.eemd = BudgetedEEMD(trials=self.params.get('eemd_trials', 100),
+                                                   parallel=parallel, **pool)
+        return eemd
+
+    def bandpass(self, icg):
+        # 长记录分块并行滤波, 输出直接按工作精度分配
+        with span('bandpass'):
+            return chunked_sosfiltfilt(self.sos, icg, chunk_size=self.params.get('filter_chunk', CHUNK_SIZE),
+                                       workers=self.params.get('filter_workers'), dtype=self.dtype)
+
+    @instrument('wavelet')
+    def wavelet_stage(self, segments):
+        out = []
+        for icg_seg in segments:
+            seg = icg_seg
+            for wavelet in self.wavelets:
+                # 降采样后的短心搏可能不足以分解到设定层数
+                level = min(self.params['wavelet_level'], max(pywt.dwt_max_level(len(seg), wavelet.dec_len), 1))
+                seg = wavelet_denoise(seg, wavelet_name=wavelet, level=level)
+            out.append(seg[:len(icg_seg)])  # waverec 对奇数长度会多出一个样本
+        return out
+
+    @instrument('eemd')
+    def eemd_stage(self, segments, stats=None, release=False):
+        """
+        EEMD of every segment within the time budget; returns (outputs, fallback mask).
+        With release=True each entry of the segments list is set to None once consumed.
+        """
+        if not self.params.get('eemd', 1):
+            return list(segments), np.zeros(len(segments), dtype=bool)
+        budget = self.params.get('budget', {})
+        beat_budget = budget.get('beat_seconds')
+        rec_deadline = None
+        if budget.get('recording_seconds') is not None:
+            rec_deadline = time.monotonic() + budget['recording_seconds']
+
+        eemd = self.eemd
+        out = []
+        fallback = np.zeros(len(segments), dtype=bool)
+        try:
+            for k, seg in enumerate(segments):
+                t0 = time.monotonic()
+                deadlines = [d for d in (rec_deadline, None if beat_budget is None else t0 + beat_budget)
+                             if d is not None]
+                eemd.deadline = min(deadlines) if deadlines else None
+                missed = None
+                if rec_deadline is not None and t0 >= rec_deadline:
+                    missed = DEADLINE_RECORDING
+                else:
+                    try:
+                        out.append(eemd_denoise(seg, max_imfs=self.params['eemd_max_imfs'],
+                                                eemd=eemd).astype(self.dtype, copy=False))
+                    except DeadlineExceeded:
+                        late = rec_deadline is not None and time.monotonic() >= rec_deadline
+                        missed = DEADLINE_RECORDING if late else DEADLINE_BEAT
+                if missed:
+                    out.append(seg)  # 超时: 退回只用小波去噪的结果
+                    fallback[k] = True
+                if release:
+                    segments[k] = None
+                if stats is not None:
+                    stats.add_beat(time.monotonic() - t0, missed)
+        finally:
+            eemd.deadline = None
+        return out, fallback
+
+    @instrument('lms')
+    def lms_stage(self, segments, desired, release=False):
+        if not self.params.get('lms', 1):
+            return list(segments)
+        backend = backend_from_params(self.HRVparams)
+        out = []
+        for k, (e, c) in enumerate(zip(segments, desired)):
+            out.append(lms_filter(e, c, mu=self.params['lms_mu'], order=self.params['lms_order'], backend=backend))
+            if release:
+                segments[k] = None
+        return out
+
+    def segment(self, ecg, clean_icg, subjectID='real_data', writer=None):
+        """
+        Band-pass, R peak detection, beat segmentation and quality gating.
+
+        Returns:
+            dict: filtered_icg, beat_len, llim_beat, index (BeatIndex of the
+                accepted beats), R_peaks (list), beats_clean ((n_beats, beat_len)
+                matrix), rejected (see process()), sqi (see process()) and
+                seg_key (stage cache key of the accepted segments, None
+                without cache)
+        """
+        p = self.params
+        cache = self.cache
+
+        own_writer = writer is None
+        if own_writer:
+            writer = AnnotationWriter(in_memory=True)
+        logger.info("Running ConvertRawDataToRRIntervals to get R peaks")
+        try:
+            _, rr, R_pk, SQIjw, StartSQIwindows = ConvertRawDataToRRIntervals(ecg, self.HRVparams, subjectID=subjectID,
+                                                            writer=writer, cache=cache)
+        finally:
+            if own_writer:
+                writer.close()
+
+        # 每个阶段的缓存键 = 上一阶段的键 + 本阶段参数 + 代码版本
+        # 修改某一阶段的参数 (如 LMS 步长) 只会重算该阶段及其后续阶段
+        # 带通滤波放在 R 峰检测之后, 检测时的 ECG 临时数组不与滤波信号同时存在
+        filtered_icg, filt_key = run_stage(cache, 'bandpass', lambda: self.bandpass(clean_icg), clean_icg,
+                                           params={'fs': self.fs, 'bandpass': p['bandpass'],
+                                                   'filter_order': p['filter_order'], 'dtype': self.dtype.str},
+                                           version=lambda: _stage_version('bandpass'))
+
+        RR_intervals = np.diff(R_pk)
+        median_RR = int(np.ceil(np.median(RR_intervals)))
+        llim_beat = self.llim_beat
+        ulim_beat = median_RR - llim_beat
+        beat_len = llim_beat + ulim_beat
+
+        # 边界检查只做一次, 心搏矩阵从滤波信号的滑动窗口视图一次性取出
+        index = BeatIndex(R_pk, llim_beat, ulim_beat, len(clean_icg))
+        beats_clean = index.matrix(filtered_icg)
+
+        # 质量门控: 去噪前剔除 bSQI 低或 ICG 质量差的心搏
+        accept = np.ones(len(index), dtype=bool)
+        reason = np.zeros(len(index), dtype=np.int8)
+        beat_sqi = icg_quality = np.full(len(index), np.nan)
+        if p.get('gating', 0) and len(index):
+            accept, reason, beat_sqi, icg_quality = gate_beats(index.R_peaks, beats_clean, SQIjw,
+                                                               StartSQIwindows, self.HRVparams)
+            logger.info("Quality gating: %d of %d beats rejected before denoising", int((~accept).sum()), len(accept))
+        rejected = {'R_peaks': index.R_peaks[~accept], 'reason': reason[~accept],
+                    'beat_sqi': beat_sqi[~accept], 'icg_quality': icg_quality[~accept]}
+        if not accept.all():
+            index = index.select(accept)
+            # 从滤波信号重新取出, 避免新旧两份心搏矩阵同时存在
+            del beats_clean
+            beats_clean = index.matrix(filtered_icg)
+        seg_key = None if cache is None else cache.key('segments', filt_key, index.R_peaks,
+                                                       params=[llim_beat, ulim_beat])
+
+        return {'filtered_icg': filtered_icg, 'beat_len': beat_len, 'llim_beat': llim_beat,
+                'index': index, 'R_peaks': index.R_peaks.tolist(), 'beats_clean': beats_clean,
+                'rejected': rejected, 'seg_key': seg_key,
+                'sqi': {'SQI': SQIjw, 'StartSQIwindows': StartSQIwindows,
+                        'sqi_windowlength': self.HRVparams['sqi']['windowlength']}}
+
+    def denoise(self, segments, seg_key=None, stats=None):
+        """
+        Wavelet -> EEMD -> LMS cascade of a list of segments (cached per stage under seg_key).
+        The outputs of the wavelet and EEMD stages are freed beat by beat as
+        the next stage consumes them, so at most one intermediate list is
+        alive besides the input.
+
+        Returns:
+            denoised (list of np.ndarray), fallback (np.ndarray): True for the
+                segments whose EEMD missed the time budget
+        """
+        p = self.params
+        cache = self.cache if seg_key is not None else None
+        wavelet_out, wavelet_key = run_stage(cache, 'wavelet', lambda: self.wavelet_stage(segments),
+                                             seg_key, params={'wavelets': p['wavelets'], 'level': p['wavelet_level']},
+                                             version=lambda: _stage_version('wavelet'))
+        # 超时退回的结果不写入缓存, 其后的 LMS 也不缓存, 命中的结果总是完整的 EEMD
+        (eemd_out, fallback), eemd_key = run_stage(cache, 'eemd',
+                                                   lambda: self.eemd_stage(wavelet_out, stats, release=True),
+                                                   wavelet_key, params={'on': p.get('eemd', 1),
+                                                                        'max_imfs': p['eemd_max_imfs'],
+                                                                        'trials': p.get('eemd_trials', 100),
+                                                                        'budget': p.get('budget')},
+                                                   version=lambda: _stage_version('eemd'),
+                                                   store=lambda result: not result[1].any())
+        if eemd_key is None:
+            cache = None
+        denoised, _ = run_stage(cache, 'lms', lambda: self.lms_stage(eemd_out, segments, release=True),
+                                eemd_key, params={'on': p.get('lms', 1), 'mu': p['lms_mu'], 'order': p['lms_order']},
+                                version=lambda: _stage_version('lms'))
+        return denoised, fallback
+
+    def process(self, ecg, clean_icg, subjectID='real_data', writer=None, return_rejected=False, stats=None,
+                return_sqi=False):
+        """
+        Band-pass, R peak detection, quality gating, per-beat denoising and overlap-add.
+
+        With ICG['gating'] on, beats rejected by gate_beats() (low bSQI or
+        low ICG quality) skip the wavelet/EEMD/LMS stages and are left out
+        of the returned beats and R peaks.
+
+        Parameters:
+            ecg (np.ndarray): ECG signal
+            clean_icg (np.ndarray): ICG signal
+            subjectID (str): Record name used for annotations
+            writer (AnnotationWriter): Where annotations go; in memory when omitted
+            return_rejected (bool): Also return a dict describing the rejected
+                beats (R_peaks, reason, beat_sqi, icg_quality)
+            stats (RunStats): Receives the EEMD timing, deadline misses and the
+                R peaks of the beats that fell back to wavelet-only denoising
+            return_sqi (bool): Also return the SQI windows of the recording
+                (SQI = SQIjw, StartSQIwindows, sqi_windowlength), which can be
+                passed to build_beat_table(**sqi)
+
+        Returns:
+            (beats_clean, beats_denoised, beat_len, filtered_icg, denoised_icg_full, valid_R_peaks[, rejected][, sqi])
+            filtered_icg, beats_clean and denoised_icg_full are None when
+            HRVparams['memory'] keep_filtered / keep_beats_clean /
+            keep_full_signal is 0
+        """
+        keep = self.HRVparams.get('memory', {})
+        seg = self.segment(ecg, clean_icg, subjectID, writer)
+        index, beat_len = seg['index'], seg['beat_len']
+        if not keep.get('keep_filtered', 1):
+            seg['filtered_icg'] = None  # 心搏矩阵已取出, 不再需要滤波信号
+        beats_clean = seg['beats_clean']
+        if stats is None:
+            stats = RunStats()
+        beat_segments_denoised, fallback = self.denoise(beats_clean, seg['seg_key'], stats)
+        stats.add_fallback(index.R_peaks[fallback])
+        self.stats.merge(stats)
+        if not keep.get('keep_beats_clean', 1):
+            beats_clean = seg['beats_clean'] = None
+
+        beats_denoised = self._stack(beat_segments_denoised, beat_len)
+        denoised_icg_full = index.overlap_add(beats_denoised) if keep.get('keep_full_signal', 1) else None
+
+        result = (beats_clean, beats_denoised, beat_len, seg['filtered_icg'], denoised_icg_full, seg['R_peaks'])
+        if return_rejected:
+            result += (seg['rejected'],)
+        if return_sqi:
+            result += (seg['sqi'],)
+        return result
+
+    def _stack(self, segments, beat_len):
+        """(n, beat_len) matrix of a list of segments, freeing every list entry once it is copied."""
+        if not len(segments):
+            return np.empty((0, beat_len), self.dtype)
+        out = np.empty((len(segments), beat_len), dtype=np.result_type(*{s.dtype for s in segments}))
+        for k in range(len(segments)):
+            out[k] = segments[k]
+            segments[k] = None
+        return out
+
+    def process_ensemble(self, ecg, clean_icg, subjectID='real_data', writer=None,
+                         group_beats=None, group_seconds=None, step=None):
+        """
+        Ensemble-averaged fast path: denoise and detect B/C/X on beat group templates only.
+
+        The R-aligned beats that pass the quality gating are grouped in
+        sliding groups of group_beats beats or group_seconds seconds (moved
+        by step beats / seconds, default one full group), each group is
+        reduced to a template with ensemble_average(), and the wavelet/EEMD/LMS
+        cascade and B/C/X extraction run on the templates. The number of EEMD
+        runs drops by roughly the group size. Defaults come from
+        ICG['ensemble'].
+
+        Returns:
+            dict: t (group centre, s), n_beats, R_first/R_last (samples),
+                templates, templates_denoised, b_rel/c_rel/x_rel (samples in
+                the template), pep/lvet (s), beat_len, llim_beat, rejected,
+                fallback (templates denoised wavelet-only after a missed deadline)
+        """
+        e = self.params.get('ensemble', {})
+        if group_beats is None and group_seconds is None:
+            group_beats, group_seconds = e.get('group_beats'), e.get('group_seconds')
+        if step is None:
+            step = e.get('step')
+
+        seg = self.segment(ecg, clean_icg, subjectID, writer)
+        R = seg['index'].R_peaks
+        beats = seg['beats_clean']
+        groups = beat_groups(R / self.fs, group_beats, group_seconds, step)
+        templates = [ensemble_average(beats[i0:i1], e.get('trim', 0.1)) for i0, i1 in groups]
+
+        cache = self.cache
+        tpl_key = None if cache is None else cache.key('ensemble', seg['seg_key'], np.asarray(groups),
+                                                       params={'trim': e.get('trim', 0.1)})
+        stats = RunStats()
+        denoised, fallback = self.denoise(templates, tpl_key, stats)
+        self.stats.merge(stats)
+        denoised = np.array(denoised) if denoised else np.empty((0, seg['beat_len']))
+        b_rel, c_rel, x_rel = (np.array(v, dtype=float) for v in self.extract_bcx(denoised))
+
+        llim_beat = seg['llim_beat']
+        return {
+            't': np.array([np.median(R[i0:i1]) / self.fs for i0, i1 in groups]),
+            'n_beats': np.array([i1 - i0 for i0, i1 in groups]),
+            'R_first': np.array([R[i0] for i0, _ in groups], dtype=int),
+            'R_last': np.array([R[i1 - 1] for _, i1 in groups], dtype=int),
+            'templates': np.array(templates) if templates else np.empty((0, seg['beat_len'])),
+            'templates_denoised': denoised,
+            'b_rel': b_rel, 'c_rel': c_rel, 'x_rel': x_rel,
+            'pep': (b_rel - llim_beat) / self.fs,
+            'lvet': (x_rel - b_rel) / self.fs,
+            'beat_len': seg['beat_len'], 'llim_beat': llim_beat, 'rejected': seg['rejected'],
+            'fallback': fallback,
+        }
+
+    def process_multirate(self, ecg, clean_icg, subjectID='real_data', writer=None, decimate=None):
+        """
+        Multi-rate path: denoise and search B/C/X at fs / decimate, refine at full rate.
+
+        R peaks, band-pass and quality gating run at the acquisition rate as
+        in process(). The filtered ICG is then polyphase-decimated (the
+        band-pass edge stays well below the new Nyquist frequency), the
+        wavelet/EEMD/LMS cascade and the coarse B/C/X search run on the
+        decimated beats. The coarse points are shifted back by the delay of
+        the denoising cascade (cascade_delay(); the causal LMS stage lags by
+        more milliseconds the lower the rate) and refined by refine_points()
+        on the zero-phase band-passed signal at the full rate, within
+        +-half_width decimated samples. Denoising sees decimate times fewer
+        samples; B/C/X keep sub-sample resolution at the full rate.
+        Defaults come from ICG['multirate'].
+
+        Returns:
+            dict: R_peaks (full rate), b_rel/c_rel/x_rel (float, full-rate
+                samples from the beat start R - llim_beat), b/c/x (float
+                absolute samples), pep/lvet (s), beats_denoised (decimated),
+                fs_low, decimate, beat_len, llim_beat, rejected, fallback
+        """
+        from scipy.signal import resample_poly
+
+        m = self.params.get('multirate', {})
+        q = int(decimate or m.get('decimate', 4))
+        seg = self.segment(ecg, clean_icg, subjectID, writer)
+        llim_beat, beat_len = seg['llim_beat'], seg['beat_len']
+        R = seg['index'].R_peaks
+
+        filtered_low = resample_poly(seg['filtered_icg'], 1, q).astype(self.dtype, copy=False)
+        llim_low = int(round(llim_beat / q))
+        index_low = BeatIndex(np.round(R / q).astype(np.int64), llim_low,
+                              int(round(beat_len / q)) - llim_low, len(filtered_low))
+        R = R[index_low.valid]
+        beats_low = index_low.matrix(filtered_low)
+
+        cache = self.cache
+        low_key = None if cache is None else cache.key('multirate', seg['seg_key'], index_low.R_peaks, params=[q])
+        stats = RunStats()
+        denoised, fallback = self.denoise(beats_low, low_key, stats)
+        stats.add_fallback(R[fallback])
+        self.stats.merge(stats)
+        denoised = np.array(denoised) if len(R) else np.empty((0, index_low.beat_len), self.dtype)
+
+        b0, c0, x0 = (np.array(v, dtype=float) for v in self.extract_bcx(denoised))
+        half = int(m.get('half_width', 2)) * q
+        # 粗定位点减去去噪级联的延迟, 换算成全采样率的绝对位置后在带通信号上精定位
+        delay = cascade_delay(denoised, beats_low)
+        starts = index_low.starts * q
+        start = R - llim_beat
+        filtered = seg['filtered_icg']
+        b_rel = refine_points(filtered, starts + (b0 - delay) * q, 'd3min', half) - start
+        c_rel = refine_points(filtered, starts + (c0 - delay) * q, 'max', half) - start
+        x_rel = refine_points(filtered, starts + (x0 - delay) * q, 'min', half) - start
+        return {
+            'R_peaks': R, 'b_rel': b_rel, 'c_rel': c_rel, 'x_rel': x_rel,
+            'b': start + b_rel, 'c': start + c_rel, 'x': start + x_rel,
+            'pep': (b_rel - llim_beat) / self.fs, 'lvet': (x_rel - b_rel) / self.fs,
+            'beats_denoised': denoised, 'fs_low': self.fs / q, 'decimate': q,
+            'beat_len': beat_len, 'llim_beat': llim_beat, 'rejected': seg['rejected'], 'fallback': fallback,
+        }
+
+    def extract_bcx(self, beats_denoised):
+        return extract_bcx_points_from_beats(beats_denoised, cache=self.cache)
+
+
+@lru_cache(maxsize=None)
+def _stage_version(stage):
+    """Code version of a cached ICGPipeline stage; only hashed once a cache asks for it."""
+    funcs = {
+        'bandpass': (ICGPipeline.bandpass,),
+        'wavelet': (ICGPipeline.wavelet_stage, wavelet_denoise, adaptive_soft_threshold),
+        'eemd': (ICGPipeline.eemd_stage, eemd_denoise),
+        'lms': (ICGPipeline.lms_stage, lms_filter, lms_kernel),
+    }[stage]
+    return code_version(*funcs)
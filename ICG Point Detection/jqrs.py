@@ -1,40 +1,98 @@
 import numpy as np
-from scipy.signal import filtfilt, medfilt, resample, find_peaks
-import matplotlib.pyplot as plt
-
-def jqrs(ecg, HRVparams):
+from scipy.signal import medfilt, resample, find_peaks
+from functools import lru_cache
+
+from chunked_filtfilt import chunked_filtfilt
+from compute_backend import backend_from_params, get_kernel, kernel
+
+# Band-pass FIR template designed at 250 Hz
+JQRS_FIR_250 = np.array([
+    -7.757327341237223e-05, -2.357742589814283e-04, -6.689305101192819e-04, -0.001770119249103,
+    -0.004364327211358, -0.010013251577232, -0.021344241245400, -0.042182820580118, -0.077080889653194,
+    -0.129740392318591, -0.200064921294891, -0.280328573340852, -0.352139052257134, -0.386867664739069,
+    -0.351974030208595, -0.223363323458050, 0, 0.286427448595213, 0.574058766243311,
+    0.788100265785590, 0.867325070584078, 0.788100265785590, 0.574058766243311, 0.286427448595213, 0,
+    -0.223363323458050, -0.351974030208595, -0.386867664739069, -0.352139052257134,
+    -0.280328573340852, -0.200064921294891, -0.129740392318591, -0.077080889653194, -0.042182820580118,
+    -0.021344241245400, -0.010013251577232, -0.004364327211358, -0.001770119249103, -6.689305101192819e-04,
+    -2.357742589814283e-04, -7.757327341237223e-05
+])
+
+
+@lru_cache(maxsize=16)
+def jqrs_fir_template(fs):
+    """FIR template resampled to fs; computed once per sampling rate and shared (read-only)."""
+    b1 = resample(JQRS_FIR_250, int(len(JQRS_FIR_250) * fs / 250))
+    b1.setflags(write=False)
+    return b1
+
+
+def _example_merge(rng):
+    ecg = rng.standard_normal(5000)
+    left = np.sort(rng.choice(4990, 200, replace=False))
+    return ecg, left, left + rng.integers(1, 10, len(left)), True, 60.0
+
+
+@kernel('jqrs_merge', example=_example_merge)
+def jqrs_merge_kernel(ecg, left, right, sign_positive, ref_samples):
+    """
+    Peak of every above-threshold region [left, right); of two peaks closer
+    than ref_samples the one with the larger magnitude is kept.
+    Returns (maxloc, maxval).
+    """
+    maxloc = np.empty(len(left), dtype=np.int64)
+    maxval = np.empty(len(left))
+    n = 0
+    for k in range(len(left)):
+        l, r = left[k], right[k]
+        if r <= l:
+            raise ValueError("attempt to get argmax of an empty sequence")
+        idx = l
+        for i in range(l + 1, r):
+            if (ecg[i] > ecg[idx]) if sign_positive else (ecg[i] < ecg[idx]):
+                idx = i
+        if n > 0 and (idx - maxloc[n - 1]) < ref_samples:
+            if abs(ecg[idx]) < abs(maxval[n - 1]):
+                continue
+            n -= 1
+        maxloc[n] = idx
+        maxval[n] = ecg[idx]
+        n += 1
+    return maxloc[:n], maxval[:n]
+
+
+def jqrs(ecg, HRVparams, thres=None, sign_force=None):
+    """
+    QRS detection on the band-passed, differentiated and integrated ECG.
+
+    The FIR band-pass runs through chunked_filtfilt(). thres and sign_force
+    override PeakDetect['THRES'] / ['SIGN_FORCE'] (run_qrsdet_by_seg() lowers
+    the threshold per segment and carries the QRS sign between segments);
+    an empty or zero sign force means the sign is estimated from the signal.
+
+    Returns:
+        qrs_pos (np.ndarray), sign, en_thres
+    """
     fs = HRVparams['Fs']
     REF_PERIOD = HRVparams['PeakDetect']['REF_PERIOD']
-    THRES = HRVparams['PeakDetect']['THRES']
+    THRES = HRVparams['PeakDetect']['THRES'] if thres is None else thres
     fid_vec = HRVparams['PeakDetect'].get('fid_vec', None)
-    SIGN_FORCE = HRVparams['PeakDetect'].get('SIGN_FORCE', None)
+    SIGN_FORCE = HRVparams['PeakDetect'].get('SIGN_FORCE', None) if sign_force is None else sign_force
     debug = HRVparams['PeakDetect'].get('debug', False)
 
     ecg = np.asarray(ecg).flatten()
     NB_SAMP = len(ecg)
     tm = np.arange(1, NB_SAMP + 1) / fs
 
-    MED_SMOOTH_NB_COEFF = round(fs / 100)
+    MED_SMOOTH_NB_COEFF = round(fs / 100) // 2 * 2 + 1  # medfilt 需要奇数长度
     INT_NB_COEFF = round(7 * fs / 256)
     SEARCH_BACK = True
     MAX_FORCE = None
     MIN_AMP = 0.1
 
     try:
-        b1 = np.array([
-            -7.757327341237223e-05, -2.357742589814283e-04, -6.689305101192819e-04, -0.001770119249103,
-            -0.004364327211358, -0.010013251577232, -0.021344241245400, -0.042182820580118, -0.077080889653194,
-            -0.129740392318591, -0.200064921294891, -0.280328573340852, -0.352139052257134, -0.386867664739069,
-            -0.351974030208595, -0.223363323458050, 0, 0.286427448595213, 0.574058766243311,
-            0.788100265785590, 0.867325070584078, 0.788100265785590, 0.574058766243311, 0.286427448595213, 0,
-            -0.223363323458050, -0.351974030208595, -0.386867664739069, -0.352139052257134,
-            -0.280328573340852, -0.200064921294891, -0.129740392318591, -0.077080889653194, -0.042182820580118,
-            -0.021344241245400, -0.010013251577232, -0.004364327211358, -0.001770119249103, -6.689305101192819e-04,
-            -2.357742589814283e-04, -7.757327341237223e-05
-        ])
-
-        b1 = resample(b1, int(len(b1) * fs / 250))
-        bpfecg = filtfilt(b1, [1], ecg)
+        b1 = jqrs_fir_template(fs)
+        bpfecg = chunked_filtfilt(b1, [1], ecg)
 
         if np.mean(np.abs(bpfecg) > MIN_AMP) > 0.20:
             dffecg = np.diff(bpfecg)
@@ -79,32 +137,18 @@ def jqrs(ecg, HRVparams):
             left = np.where(np.diff(np.concatenate(([0], poss_reg.astype(int)))) == 1)[0]
             right = np.where(np.diff(np.concatenate((poss_reg.astype(int), [0]))) == -1)[0]
 
-            if SIGN_FORCE is not None:
+            if SIGN_FORCE is not None and np.size(SIGN_FORCE) and np.all(SIGN_FORCE):
                 sign = SIGN_FORCE
             else:
                 loc = [np.argmax(np.abs(bpfecg[l:r])) + l for l, r in zip(left, right)]
                 sign = np.mean(ecg[loc])
 
-            maxloc, maxval = [], []
-            for l, r in zip(left, right):
-                segment = ecg[l:r]
-                if sign > 0:
-                    idx = np.argmax(segment)
-                else:
-                    idx = np.argmin(segment)
-                loc = l + idx
-                if maxloc and (loc - maxloc[-1]) < fs * REF_PERIOD:
-                    if abs(segment[idx]) < abs(maxval[-1]):
-                        continue
-                    else:
-                        maxloc.pop()
-                        maxval.pop()
-                maxloc.append(loc)
-                maxval.append(segment[idx])
-
-            qrs_pos = np.array(maxloc)
+            maxloc, maxval = get_kernel('jqrs_merge', backend_from_params(HRVparams))(
+                np.asarray(ecg, dtype=np.float64), left, right, bool(sign > 0), float(fs * REF_PERIOD))
+
+            qrs_pos = maxloc
             R_t = tm[qrs_pos]
-            R_amp = np.array(maxval)
+            R_amp = maxval
             hrv = 60 / np.diff(R_t)
         else:
             qrs_pos, sign, en_thres = [], [], []
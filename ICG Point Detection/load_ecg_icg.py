@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+
+from csv_stream import estimate_rows, iter_csv_blocks
+from instrumentation import instrument
+from signal_archive import ARCHIVE_EXT, SignalArchive
+
+CSV_EXTS = ('.csv', '.tsv', '.txt')
+
+
+def load_ecg_icg_from_excel(filepath, dtype=float):
+    import pandas as pd
+    df = pd.read_excel(filepath, header=None)
+    ecg = df.iloc[:, 0].values.astype(dtype)
+    icg = df.iloc[:, 1].values.astype(dtype)
+    return ecg, icg
+
+
+def _ecg_icg_channels(sig_names):
+    """Index of the ECG and ICG channels, by name when available, else the first two."""
+    names = [str(n).upper() for n in sig_names]
+    ecg = names.index('ECG') if 'ECG' in names else 0
+    icg = names.index('ICG') if 'ICG' in names else 1
+    return ecg, icg
+
+
+def _open_source(filepath):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ARCHIVE_EXT:
+        return SignalArchive(filepath)
+    if ext in ('.hea', '.dat'):
+        from wfdb_signal import WFDBRecord
+        return WFDBRecord(os.path.splitext(filepath)[0])
+    return None
+
+
+def _iter_source(source, start, stop, chunk_seconds):
+    ecg_ch, icg_ch = _ecg_icg_channels(source.sig_names)
+    if isinstance(source, SignalArchive):
+        with source:
+            for s0, block in source.iter_chunks(start, stop):
+                yield s0, block[:, ecg_ch], block[:, icg_ch]
+        return
+    step = max(int(chunk_seconds * source.fs), 1)
+    first, last, _ = slice(start, stop).indices(len(source))
+    for s0 in range(first, last, step):
+        block = source[s0:min(s0 + step, last)]
+        yield s0, block[:, ecg_ch], block[:, icg_ch]
+
+
+def iter_ecg_icg(filepath, chunk_seconds=60, start=0, stop=None, fs=1000):
+    """
+    Stream an ECG/ICG recording in blocks.
+
+    Parameters:
+        filepath (str): .icgz archive, WFDB record (.hea/.dat), CSV/TSV export
+            or Excel sheet
+        chunk_seconds (float): Block length for WFDB/CSV/Excel sources;
+            archives are streamed in their stored chunks
+        start, stop (int): Sample range to stream
+        fs (float): Sampling frequency assumed for CSV and Excel files
+
+    Yields:
+        (start_sample, ecg_block, icg_block)
+    """
+    source = _open_source(filepath)
+    if source is not None:
+        yield from _iter_source(source, start, stop, chunk_seconds)
+        return
+
+    step = max(int(chunk_seconds * fs), 1)
+    if os.path.splitext(filepath)[1].lower() in CSV_EXTS:
+        # 只解析 [start, stop) 范围内的行, 到 stop 即停止读取
+        for s0, block in iter_csv_blocks(filepath, block_size=step, start=start, stop=stop):
+            yield s0, block[:, 0].copy(), block[:, 1].copy()
+        return
+
+    ecg, icg = load_ecg_icg_from_excel(filepath)
+    first, last, _ = slice(start, stop).indices(len(ecg))
+    for s0 in range(first, last, step):
+        yield s0, ecg[s0:min(s0 + step, last)], icg[s0:min(s0 + step, last)]
+
+
+def recording_length(filepath):
+    """
+    (samples, fs) from the header of an .icgz archive or WFDB record,
+    without reading any samples; None for CSV and Excel files, whose
+    length is only known after parsing them.
+    """
+    source = _open_source(filepath)
+    if source is None:
+        return None
+    n, fs = len(source), source.fs
+    if isinstance(source, SignalArchive):
+        source.close()
+    return n, fs
+
+
+@instrument('load')
+def load_ecg_icg(filepath, start=0, stop=None, dtype=np.float64):
+    """
+    Load the ECG and ICG channels of a recording.
+
+    .icgz archives, WFDB records and CSV/TSV exports are streamed with
+    iter_ecg_icg() straight into the output arrays: archives decode only the
+    chunks that overlap [start, stop), CSV parsing skips the rows before
+    start and stops at stop. The arrays are preallocated from the header
+    (or, for CSV without stop, from csv_stream.estimate_rows()). Anything
+    else is read as an Excel sheet. CSV and Excel files hold ECG/ICG in the
+    first two columns. dtype is the sample type of the returned arrays (e.g.
+    np.float32 for the float32 processing mode).
+
+    Returns:
+        ecg (np.ndarray), icg (np.ndarray)
+    """
+    info = recording_length(filepath)
+    if info is not None:
+        start, stop, _ = slice(start, stop).indices(info[0])
+        n = max(stop - start, 0)
+    elif os.path.splitext(filepath)[1].lower() in CSV_EXTS:
+        n = stop - start if stop is not None else max(estimate_rows(filepath) - start, 0)
+    else:
+        ecg, icg = load_ecg_icg_from_excel(filepath, dtype)
+        return ecg[start:stop], icg[start:stop]
+
+    ecg = np.empty(n, dtype=dtype)
+    icg = np.empty(n, dtype=dtype)
+    end = 0
+    for s0, ecg_block, icg_block in iter_ecg_icg(filepath, start=start, stop=stop):
+        lo = s0 - start
+        end = lo + len(ecg_block)
+        if end > len(ecg):
+            # 行数估计偏小时扩容
+            grown = max(end, int(len(ecg) * 1.5))
+            ecg, icg = (np.concatenate([a[:lo], np.empty(grown - lo, dtype=dtype)]) for a in (ecg, icg))
+        ecg[lo:end] = ecg_block
+        icg[lo:end] = icg_block
+    return ecg[:end], icg[:end]
@@ -0,0 +1,429 @@
+"""
+Memory-budgeted execution of the ICG pipeline.
+
+    python memory_budget.py --hours 24 --fs 1000 --budget 2G
+    python memory_budget.py --seconds 300 --budget 600M --run --eemd-budget 60
+    python icg_cli.py --memory-budget 1.5G bcx long_session.icgz -o beats.csv
+    python batch_runner.py recordings/ out/ --memory-budget 8G
+
+estimate() models the signal data alive in each phase of
+ICGPipeline.process() from the recording length, fs and HRVparams. plan()
+fits a run into a budget by applying PLAN_STEPS one after the other and
+raises MemoryBudgetError with the estimate, before anything is loaded or
+computed, when even the leanest settings do not fit. PeakMemory measures
+the actual peak (RSS high-water mark) to report next to the estimate.
+"""
+import argparse
+import copy
+import math
+import os
+import sys
+
+import numpy as np
+
+MiB = 2 ** 20
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+# Beat matrices hold about one recording of samples (beat length = median RR);
+# the margin covers RR variability and the per-beat array objects of the stage lists
+BEAT_COVERAGE = 1.2
+# Beat length assumed for the EEMD working set of one beat (s, 50 bpm)
+BEAT_SECONDS = 1.2
+# float64 buffers of sosfiltfilt per band-pass chunk (float64 copy, padded extension, two passes)
+FILTFILT_COPIES = 4
+# RSS of a process that has imported the pipeline (numpy, scipy, pywt, PyEMD / matplotlib)
+PROCESS_OVERHEAD = 160 * MiB
+# RSS added by the PyEMD / matplotlib import of the first EEMD call
+EEMD_IMPORT = 32 * MiB
+
+# Outputs of process() that plan() may drop -> HRVparams['memory'] flag
+OUTPUTS = {'denoised_icg_full': 'keep_full_signal', 'beats_clean': 'keep_beats_clean',
+           'filtered_icg': 'keep_filtered'}
+
+# Steps of plan(), cheapest first: (label, HRVparams section, key, value)
+PLAN_STEPS = (
+    ('filter_workers=1', 'ICG', 'filter_workers', 1),
+    ('filter_chunk=65536', 'ICG', 'filter_chunk', 65536),
+    ('drop denoised_icg_full', 'memory', 'keep_full_signal', 0),
+    ('drop beats_clean', 'memory', 'keep_beats_clean', 0),
+    ('drop filtered_icg', 'memory', 'keep_filtered', 0),
+    ('float32', 'ICG', 'dtype', 'float32'),
+)
+
+
+class MemoryBudgetError(MemoryError):
+    """A run does not fit the memory budget; .estimate holds estimate() of the leanest settings tried."""
+
+    def __init__(self, message, estimate=None):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+def parse_size(size):
+    """Bytes of a size such as 2000000, '512M', '1.5G' or '2GiB' (binary units)."""
+    if size is None or isinstance(size, (int, float)):
+        return None if size is None else int(size)
+    text = str(size).strip().upper().replace('IB', '').replace('B', '')
+    unit = text[-1] if text and text[-1] in SIZE_UNITS else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid memory size {size!r}, e.g. 2000000, 512M or 1.5G") from None
+
+
+def format_size(nbytes):
+    if nbytes is None:
+        return 'n/a'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(nbytes) < 1024 or unit == 'GiB':
+            return f"{nbytes:.0f} {unit}" if unit == 'B' else f"{nbytes:.2f} {unit}"
+        nbytes /= 1024
+
+
+def _proc_status(field):
+    """Field of /proc/self/status in bytes (Linux), None elsewhere."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss():
+    return _proc_status('VmRSS')
+
+
+def peak_rss():
+    """RSS high-water mark of the process (bytes)."""
+    peak = _proc_status('VmHWM')
+    if peak is None:
+        try:
+            import resource
+        except ImportError:
+            return None
+        # ru_maxrss 在 Linux 上以 KiB 为单位, 在 macOS 上以字节为单位
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return peak
+
+
+def process_overhead(loaded_bytes=0):
+    """
+    Process memory besides the signal data: current RSS minus already
+    loaded signals, plus EEMD_IMPORT while PyEMD is not imported yet; at
+    least PROCESS_OVERHEAD.
+    """
+    rss = current_rss()
+    if rss is None:
+        return PROCESS_OVERHEAD
+    pending = EEMD_IMPORT if 'PyEMD' not in sys.modules else 0
+    return max(rss - loaded_bytes + pending, PROCESS_OVERHEAD)
+
+
+def _bandpass_halo(fs, p):
+    from scipy.signal import butter
+
+    from chunked_filtfilt import sos_halo
+    lo, hi = p['bandpass']
+    return sos_halo(butter(p['filter_order'], [lo / (fs / 2), hi / (fs / 2)], btype='band', output='sos'))
+
+
+def estimate(n_samples, fs, HRVparams, loaded_dtype=None, overhead_bytes=0):
+    """
+    Peak memory of ICGPipeline.process() on a recording of n_samples.
+
+    Not modelled: the QRS annotations and the bSQI / SQI window arrays of
+    ConvertRawDataToRRIntervals (a few bytes per beat and window, small
+    next to the signal buffers but not zero), and anything shared between
+    batch workers; plan_workers() only divides a budget into equal
+    per-process shares.
+
+    Parameters:
+        n_samples (int): Samples per channel
+        fs (float): Sampling frequency (Hz)
+        HRVparams (dict): Settings; uses ICG and memory
+        loaded_dtype: dtype of ECG/ICG arrays that are already loaded; None
+            when they will be loaded in the working dtype (icg_cli --dtype)
+        overhead_bytes (int): Process memory besides the signal data
+
+    Returns:
+        dict: 'phases' (bytes of signal data alive in each phase),
+            'peak_phase', 'data_bytes' (largest phase), 'overhead_bytes',
+            'peak_bytes' (data + overhead), plus n_samples, fs and dtype
+    """
+    from beat_quality import QUALITY_BLOCK
+    from chunked_filtfilt import CHUNK_SIZE
+
+    p = HRVparams['ICG']
+    keep = HRVparams.get('memory', {})
+    n = int(n_samples)
+    w = np.dtype(p.get('dtype', 'float64')).itemsize
+    i = np.dtype(loaded_dtype or p.get('dtype', 'float64')).itemsize
+    beats = int(math.ceil(n * BEAT_COVERAGE)) * w   # one beat matrix
+    beat_len = int(math.ceil(BEAT_SECONDS * fs))
+
+    inputs = 2 * n * i
+    filtered = n * w
+    kept_filtered = filtered if keep.get('keep_filtered', 1) else 0
+    kept_beats = beats if keep.get('keep_beats_clean', 1) else 0
+
+    # 带通滤波: 每个线程一份 chunk + 2 * halo 的 float64 缓冲
+    chunk = int(p.get('filter_chunk') or CHUNK_SIZE)
+    halo = _bandpass_halo(fs, p)
+    if n <= chunk + 2 * halo:
+        filter_tmp = FILTFILT_COPIES * 8 * n
+    else:
+        threads = min(p.get('filter_workers') or os.cpu_count() or 1, math.ceil(n / chunk))
+        filter_tmp = threads * FILTFILT_COPIES * 8 * (chunk + 2 * halo)
+    # QRS detection: gain-scaled ECG, float64 copy for the kernels
+    qrs_tmp = n * i + (8 * n if i != 8 else 0)
+    # gating: float64 blocks of icg_beat_quality() (block, centred block, squares)
+    gating_tmp = 3 * 8 * min(QUALITY_BLOCK, beats // w) if p.get('gating', 0) else 0
+    # EEMD: IMFs of every trial of one beat, plus the ensemble
+    eemd_tmp = 0
+    if p.get('eemd', 1):
+        eemd_tmp = 2 * 8 * p.get('eemd_trials', 100) * (p['eemd_max_imfs'] + 1) * beat_len
+    # overlap-add: float64 sums, int32 counts, result in the working dtype
+    full_tmp = 12 * n + (n * w if w != 8 else 0) if keep.get('keep_full_signal', 1) else 0
+
+    phases = {
+        'bandpass': inputs + filtered + filter_tmp,
+        'qrs': inputs + qrs_tmp,
+        'gating': inputs + filtered + beats + gating_tmp,
+        # clean beats + one intermediate list (stages free their input beat by beat)
+        'denoise': inputs + kept_filtered + 2 * beats + eemd_tmp,
+        'assemble': inputs + kept_filtered + kept_beats + beats + full_tmp,
+    }
+    peak_phase = max(phases, key=phases.get)
+    return {'n_samples': n, 'fs': fs, 'dtype': np.dtype(p.get('dtype', 'float64')).name,
+            'phases': phases, 'peak_phase': peak_phase, 'data_bytes': phases[peak_phase],
+            'overhead_bytes': int(overhead_bytes), 'peak_bytes': phases[peak_phase] + int(overhead_bytes)}
+
+
+def _over_budget(est, budget_bytes):
+    hours = est['n_samples'] / est['fs'] / 3600
+    return MemoryBudgetError(
+        f"Recording of {est['n_samples']} samples ({hours:.2f} h at {est['fs']} Hz) needs about "
+        f"{format_size(est['peak_bytes'])} ({est['peak_phase']} phase, {format_size(est['overhead_bytes'])} "
+        f"process overhead, {est['dtype']}), memory budget is {format_size(budget_bytes)}", est)
+
+
+def check(n_samples, fs, HRVparams, budget_bytes, loaded_dtype=None, overhead_bytes=None):
+    """estimate() of the settings as they are; raises MemoryBudgetError when it is over budget_bytes."""
+    budget_bytes = parse_size(budget_bytes)
+    if overhead_bytes is None:
+        overhead_bytes = process_overhead(_loaded_bytes(n_samples, loaded_dtype))
+    est = estimate(n_samples, fs, HRVparams, loaded_dtype, overhead_bytes)
+    est['budget_bytes'] = budget_bytes
+    if est['peak_bytes'] > budget_bytes:
+        raise _over_budget(est, budget_bytes)
+    return est
+
+
+def _loaded_bytes(n_samples, loaded_dtype):
+    return 0 if loaded_dtype is None else 2 * int(n_samples) * np.dtype(loaded_dtype).itemsize
+
+
+def _applies(params, section, key, value, required):
+    current = params[section].get(key)
+    if section == 'memory':
+        return current != value and next(o for o, k in OUTPUTS.items() if k == key) not in required
+    if key == 'dtype':
+        return current != value and params['memory'].get('allow_float32', 1)
+    if key == 'filter_workers':
+        return (current or os.cpu_count() or 1) > value
+    return (current or float('inf')) > value
+
+
+def plan(n_samples, fs, HRVparams, budget_bytes, required=(), loaded_dtype=None, overhead_bytes=None):
+    """
+    Settings that fit ICGPipeline.process() on n_samples into budget_bytes.
+
+    PLAN_STEPS are applied one after the other until the estimate fits;
+    the steps before the last one are then undone again, latest first,
+    wherever the run still fits without them. Outputs named in required
+    (see OUTPUTS) are never dropped; float32 needs
+    HRVparams['memory']['allow_float32'].
+
+    Parameters:
+        budget_bytes (int or str): Peak process memory allowed, e.g. '1.5G'
+        loaded_dtype: dtype of already loaded ECG/ICG arrays, see estimate()
+        overhead_bytes (int): Process memory besides the signal data;
+            process_overhead() when None
+
+    Returns:
+        (dict, dict): HRVparams with the chosen settings (a copy) and its
+            estimate(), with 'budget_bytes' and 'steps' (labels of the
+            applied PLAN_STEPS)
+
+    Raises:
+        MemoryBudgetError: Even the leanest settings do not fit
+    """
+    budget_bytes = parse_size(budget_bytes)
+    if overhead_bytes is None:
+        overhead_bytes = process_overhead(_loaded_bytes(n_samples, loaded_dtype))
+    params = copy.deepcopy(HRVparams)
+    params.setdefault('memory', {})
+
+    def fits():
+        return estimate(n_samples, fs, params, loaded_dtype, overhead_bytes)['peak_bytes'] <= budget_bytes
+
+    applied = []
+    for label, section, key, value in PLAN_STEPS:
+        if fits():
+            break
+        if _applies(params, section, key, value, required):
+            applied.append((label, section, key, params[section].get(key)))
+            params[section][key] = value
+    if not fits():
+        raise _over_budget(estimate(n_samples, fs, params, loaded_dtype, overhead_bytes), budget_bytes)
+
+    # 最后一步是必需的; 之前的步骤从后往前尝试撤销, 放得下就保留原设置
+    for entry in reversed(applied[:-1]):
+        _, section, key, original = entry
+        value, params[section][key] = params[section][key], original
+        if fits():
+            applied.remove(entry)
+        else:
+            params[section][key] = value
+
+    est = estimate(n_samples, fs, params, loaded_dtype, overhead_bytes)
+    est.update(budget_bytes=budget_bytes, steps=[a[0] for a in applied])
+    return params, est
+
+
+def plan_workers(n_samples, fs, HRVparams, budget_bytes, workers=None, required=()):
+    """
+    Worker processes and settings for a batch within budget_bytes in total.
+
+    Every worker gets an equal share of the budget, counting
+    PROCESS_OVERHEAD per process, and the longest recording (n_samples)
+    has to fit its share. The most workers (up to `workers`) that fit
+    without float32 are chosen; float32 is only used when not even one
+    worker fits otherwise.
+
+    Returns:
+        (int, dict, int, dict): workers, HRVparams (plan() of the longest
+            recording), budget per worker and its estimate
+    """
+    budget_bytes = parse_size(budget_bytes)
+    workers = workers or os.cpu_count() or 1
+    allow_float32 = HRVparams.get('memory', {}).get('allow_float32', 1)
+    error = None
+    for allow in ((0, 1) if allow_float32 else (0,)):
+        params = copy.deepcopy(HRVparams)
+        params.setdefault('memory', {})['allow_float32'] = allow
+        for w in range(workers, 0, -1):
+            try:
+                params_w, est = plan(n_samples, fs, params, budget_bytes // w, required,
+                                     overhead_bytes=PROCESS_OVERHEAD)
+            except MemoryBudgetError as e:
+                error = e
+                continue
+            params_w['memory']['allow_float32'] = allow_float32
+            return w, params_w, budget_bytes // w, est
+    raise error
+
+
+def _reset_peak_rss():
+    """Reset the RSS high-water mark (Linux >= 4.0); False when that is not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class PeakMemory:
+    """
+    Peak resident memory of the process inside a with block.
+
+    The high-water mark is reset on entry through /proc/self/clear_refs;
+    where that is not possible (reset is False) peak_bytes is the maximum
+    over the life of the process.
+
+    Usage:
+        with PeakMemory() as peak:
+            pipeline.process(ecg, icg)
+        print(peak.peak_bytes)
+    """
+
+    def __enter__(self):
+        self.reset = _reset_peak_rss()
+        self.start_bytes = current_rss()
+        self.peak_bytes = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.peak_bytes = peak_rss()
+        return False
+
+
+def usage_report(est, peak=None):
+    """Estimated vs actual peak of a run (JSON-friendly)."""
+    report = {'estimated_bytes': est['peak_bytes'], 'peak_phase': est['peak_phase'], 'dtype': est['dtype'],
+              'budget_bytes': est.get('budget_bytes'), 'steps': est.get('steps', []),
+              'actual_bytes': None, 'actual_is_lifetime_peak': None}
+    if peak is not None:
+        report.update(actual_bytes=peak.peak_bytes, actual_is_lifetime_peak=not peak.reset)
+    return report
+
+
+def describe(est, peak=None):
+    """One-line summary of a plan, with the measured peak when given."""
+    text = (f"memory: estimated peak {format_size(est['peak_bytes'])} ({est['peak_phase']} phase, {est['dtype']})"
+            f", budget {format_size(est.get('budget_bytes'))}")
+    if est.get('steps'):
+        text += f", plan: {', '.join(est['steps'])}"
+    if peak is not None:
+        text += f"; actual peak {format_size(peak.peak_bytes)}" + ('' if peak.reset else ' (process lifetime)')
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate and plan the peak memory of the ICG pipeline.')
+    length = parser.add_mutually_exclusive_group(required=True)
+    length.add_argument('--seconds', type=float)
+    length.add_argument('--hours', type=float)
+    parser.add_argument('--fs', type=int, default=1000)
+    parser.add_argument('--budget', default=None, help='memory budget, e.g. 512M or 2G (estimate only when omitted)')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'])
+    parser.add_argument('--keep', nargs='*', default=[], choices=sorted(OUTPUTS), help='outputs that must be kept')
+    parser.add_argument('--run', action='store_true',
+                        help='run the planned pipeline on a synthetic recording and measure the peak')
+    parser.add_argument('--eemd-budget', type=float, default=None, help='EEMD seconds for --run')
+    args = parser.parse_args()
+
+    from InitializeHRVparams import InitializeHRVparams
+
+    seconds = args.seconds if args.seconds is not None else args.hours * 3600
+    n = int(seconds * args.fs)
+    HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+    HRVparams['Fs'] = args.fs
+    HRVparams['ICG']['dtype'] = args.dtype
+    HRVparams['ICG']['budget']['recording_seconds'] = args.eemd_budget
+
+    if args.budget is None:
+        est = estimate(n, args.fs, HRVparams, overhead_bytes=process_overhead())
+    else:
+        try:
+            HRVparams, est = plan(n, args.fs, HRVparams, args.budget, args.keep)
+        except MemoryBudgetError as e:
+            sys.exit(str(e))
+    for phase, nbytes in est['phases'].items():
+        print(f"{phase:<10}{format_size(nbytes):>14}")
+    print(describe(est))
+
+    if args.run:
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        from icg_pipeline import ICGPipeline
+        from synthetic_recording import SyntheticRecording
+
+        ecg, icg = SyntheticRecording(seconds, fs=args.fs).render(dtype=HRVparams['ICG']['dtype'])
+        pipeline = ICGPipeline(args.fs, HRVparams)
+        with PeakMemory() as peak:
+            pipeline.process(ecg, icg, subjectID='memory_check')
+        print(describe(est, peak))
@@ -0,0 +1,220 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from create_window_rr_intervals import create_window_rr_intervals
+
+
+def _count_matches(templates, r):
+    """Number of unordered template pairs with Chebyshev distance <= r (self-matches excluded)."""
+    if len(templates) < 2:
+        return 0
+    tree = cKDTree(templates)
+    return (tree.count_neighbors(tree, r, p=np.inf) - len(templates)) // 2
+
+
+def sample_entropy(x, m=2, r=0.15, sd=None):
+    """
+    Sample entropy of a series.
+
+    Template pairs are counted with a KD-tree (Chebyshev metric) instead of
+    the O(N^2) pairwise comparison, so long series stay tractable.
+
+    Parameters:
+        x (np.ndarray): Input series
+        m (int): Pattern length
+        r (float): Tolerance as a fraction of sd
+        sd (float): Scale of the tolerance; std(x) when None
+
+    Returns:
+        float: -log(A/B), NaN when no (m+1)-matches exist
+    """
+    x = np.asarray(x, dtype=float)
+    x = x[~np.isnan(x)]
+    N = len(x)
+    if N <= m + 1:
+        return np.nan
+    if sd is None:
+        sd = np.std(x)
+    tol = r * sd
+
+    # Both template sets use the same N - m starting points
+    emb = np.lib.stride_tricks.sliding_window_view(x, m + 1)[:N - m]
+    B = _count_matches(emb[:, :m], tol)
+    A = _count_matches(emb, tol)
+    if A == 0 or B == 0:
+        return np.nan
+    return -np.log(A / B)
+
+
+def coarse_grain(x, scales, method='mean'):
+    """
+    Coarse-grained series for every scale from one shared cumulative sum.
+
+    Parameters:
+        x (np.ndarray): Input series
+        scales (iterable of int): Coarse-graining factors
+        method (str): 'mean' (non-overlapping averages) or 'variance'
+
+    Returns:
+        list of np.ndarray: One coarse-grained series per scale
+    """
+    x = np.asarray(x, dtype=float)
+    cs = np.concatenate(([0.0], np.cumsum(x)))
+    cs2 = np.concatenate(([0.0], np.cumsum(x * x))) if method == 'variance' else None
+    out = []
+    for s in scales:
+        nb = len(x) // s
+        edges = np.arange(nb + 1) * s
+        mean = np.diff(cs[edges]) / s
+        if method == 'variance':
+            out.append(np.diff(cs2[edges]) / s - mean ** 2)
+        else:
+            out.append(mean)
+    return out
+
+
+def multiscale_entropy(x, HRVparams):
+    """
+    Multiscale entropy of one series using HRVparams['MSE'].
+
+    Uses maxCoarseGrainings, patternLength, RadiusOfSimilarity, moment and
+    constant_r (keep the tolerance of scale 1 for all scales). method 'fir'
+    low-pass filters before decimating; any other method averages
+    non-overlapping blocks.
+
+    Returns:
+        np.ndarray: Sample entropy for scales 1..maxCoarseGrainings
+    """
+    p = HRVparams['MSE']
+    x = np.asarray(x, dtype=float)
+    x = x[~np.isnan(x)]
+    scales = range(1, p['maxCoarseGrainings'] + 1)
+    sd = np.std(x) if p.get('constant_r', 1) else None
+
+    if p.get('method') == 'fir' and p.get('moment', 'mean') == 'mean':
+        from scipy.signal import firwin, filtfilt
+        series = []
+        for s in scales:
+            if s == 1:
+                series.append(x)
+                continue
+            taps = firwin(4 * s + 1, 1.0 / s)
+            y = filtfilt(taps, [1.0], x) if len(x) > 3 * len(taps) else x
+            series.append(y[::s])
+    else:
+        series = coarse_grain(x, scales, p.get('moment', 'mean'))
+
+    return np.array([sample_entropy(y, p['patternLength'], p['RadiusOfSimilarity'], sd)
+                     for y in series])
+
+
+def dfa(x, min_box=4, max_box=None, mid_box=16, n_sizes=30):
+    """
+    Detrended fluctuation analysis.
+
+    The profile is reshaped into boxes for every box size and the linear
+    detrending of all boxes of a size is done in closed form at once.
+
+    Parameters:
+        x (np.ndarray): Input series
+        min_box, max_box, mid_box (int): Box sizes (beats); alpha1 is fit on
+            [min_box, mid_box] and alpha2 on [mid_box, max_box]
+        n_sizes (int): Number of log-spaced box sizes
+
+    Returns:
+        alpha1 (float), alpha2 (float), n (np.ndarray), F (np.ndarray)
+    """
+    x = np.asarray(x, dtype=float)
+    x = x[~np.isnan(x)]
+    N = len(x)
+    if max_box is None:
+        max_box = N // 4
+    if N < 2 * min_box or max_box < min_box:
+        return np.nan, np.nan, np.array([]), np.array([])
+
+    y = np.cumsum(x - x.mean())
+    n = np.unique(np.round(np.logspace(np.log10(min_box), np.log10(max_box), n_sizes)).astype(int))
+    F = np.empty(len(n))
+    for k, size in enumerate(n):
+        nb = N // size
+        boxes = y[:nb * size].reshape(nb, size)
+        t = np.arange(size) - (size - 1) / 2
+        # Least-squares line per box: residual = centred y minus slope * centred t
+        yc = boxes - boxes.mean(axis=1, keepdims=True)
+        slope = yc @ t / (t @ t)
+        resid = yc - slope[:, None] * t
+        F[k] = np.sqrt(np.mean(resid ** 2))
+
+    def fit(lo, hi):
+        sel = (n >= lo) & (n <= hi) & (F > 0)
+        if sel.sum() < 2:
+            return np.nan
+        return np.polyfit(np.log10(n[sel]), np.log10(F[sel]), 1)[0]
+
+    return fit(min_box, mid_box), fit(mid_box, max_box), n, F
+
+
+def _window_slices(tNN, windows, windowlength):
+    starts = np.asarray(windows, dtype=float)
+    for s in starts:
+        if np.isnan(s):
+            yield s, None
+        else:
+            yield s, slice(np.searchsorted(tNN, s), np.searchsorted(tNN, s + windowlength))
+
+
+def compute_nonlinear_metrics(tNN, NN, HRVparams, windows=None):
+    """
+    Sample entropy, multiscale entropy and DFA of a record.
+
+    SampEn uses the normal analysis windows (HRVparams['windowlength']);
+    MSE and DFA use their own windows, MSE/DFA['windowlength'] and
+    ['increment'] in hours, or the whole record when those are None.
+
+    Like hrv_metrics.compute_hrv_metrics(), this takes the cleaned series
+    and windows of RRIntervalPreprocess.preprocess_rr().
+
+    Parameters:
+        tNN (np.ndarray): Time of each NN interval (s)
+        NN (np.ndarray): Cleaned NN intervals (s)
+        HRVparams (dict): HRV settings (Entropy, MSE, DFA sections)
+        windows (list): Normal window start times; created when omitted
+
+    Returns:
+        dict: t_start/SampEn per normal window, t_mse/mse (windows x scales),
+            t_dfa/alpha1/alpha2 per DFA window
+    """
+    tNN = np.asarray(tNN, dtype=float)
+    NN = np.asarray(NN, dtype=float)
+    out = {}
+
+    if HRVparams['Entropy']['on']:
+        if windows is None:
+            windows = create_window_rr_intervals(tNN, NN, HRVparams)
+        p = HRVparams['Entropy']
+        out['t_start'] = np.asarray(windows, dtype=float)
+        out['SampEn'] = np.array([np.nan if sl is None else
+                                  sample_entropy(NN[sl], p['patternLength'], p['RadiusOfSimilarity'])
+                                  for _, sl in _window_slices(tNN, windows, HRVparams['windowlength'])])
+
+    if HRVparams['MSE']['on']:
+        wl = HRVparams['MSE']['windowlength']
+        mse_windows = create_window_rr_intervals(tNN, NN, HRVparams, 'mse')
+        wl = tNN[-1] + 1 if not wl else wl * 3600
+        nscales = HRVparams['MSE']['maxCoarseGrainings']
+        out['t_mse'] = np.asarray(mse_windows, dtype=float)
+        out['mse'] = np.array([np.full(nscales, np.nan) if sl is None else multiscale_entropy(NN[sl], HRVparams)
+                               for _, sl in _window_slices(tNN, mse_windows, wl)]).reshape(-1, nscales)
+
+    if HRVparams['DFA']['on']:
+        p = HRVparams['DFA']
+        dfa_windows = create_window_rr_intervals(tNN, NN, HRVparams, 'dfa')
+        wl = tNN[-1] + 1 if not p['windowlength'] else p['windowlength'] * 3600
+        alphas = [(np.nan, np.nan) if sl is None else
+                  dfa(NN[sl], p['minBoxSize'], p['maxBoxSize'], p['midBoxSize'])[:2]
+                  for _, sl in _window_slices(tNN, dfa_windows, wl)]
+        out['t_dfa'] = np.asarray(dfa_windows, dtype=float)
+        out['alpha1'] = np.array([a[0] for a in alphas])
+        out['alpha2'] = np.array([a[1] for a in alphas])
+
+    return out
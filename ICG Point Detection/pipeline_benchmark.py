@@ -0,0 +1,259 @@
+"""
+End-to-end benchmark of the ICG pipeline (R peaks + SQI + gating + denoising + B/C/X).
+
+    python pipeline_benchmark.py run --suite quick
+    python pipeline_benchmark.py run --suite scale --workers 1 4 --eemd-budget 600
+    python pipeline_benchmark.py compare 4f86259 HEAD --threshold 0.1
+
+Every case runs in a fresh interpreter on a synthetic recording
+(synthetic_recording.py), so peak RSS and import state do not leak between
+cases. --workers caps the filter threads, BLAS threads and the EEMD process
+pool (1 runs EEMD in-process); cpu_s includes the EEMD pool workers. Results
+are stored as <output>/<git revision>.json.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, 'benchmark_results')
+
+# Suites of (seconds, fs) cases
+SUITES = {
+    'quick': [(60, 250), (60, 1000), (60, 2000)],
+    'length': [(60, 1000), (600, 1000), (3600, 1000)],
+    'rate': [(300, 250), (300, 500), (300, 1000), (300, 2000)],
+    'scale': [(60, 1000), (600, 1000), (3600, 1000), (6 * 3600, 1000), (24 * 3600, 1000)],
+}
+
+# Metrics compared by compare(): name -> True when higher is better
+METRICS = {'wall_s': False, 'cpu_s': False, 'peak_rss_bytes': False, 'child_peak_rss_bytes': False,
+           'beats_per_s': True, 'samples_per_s': True}
+
+
+def case_label(seconds, fs, workers):
+    span = f"{seconds // 3600}h" if seconds % 3600 == 0 else f"{seconds // 60}min" if seconds % 60 == 0 else f"{seconds}s"
+    return f"{span}@{fs}Hz/{workers}w"
+
+
+def git_revision():
+    """(short revision, True when the work tree has uncommitted changes); ('unknown', False) outside git."""
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE,
+                               capture_output=True, text=True, check=True).stdout.strip() != ''
+        return rev, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+
+def _run_case(case):
+    """Child side: generate the recording, run the pipeline once, return the measurements."""
+    import resource
+
+    import numpy as np
+
+    from InitializeHRVparams import InitializeHRVparams
+    from annotation_writer import AnnotationWriter
+    from icg_pipeline import ICGPipeline
+    from instrumentation import profile_run
+    from synthetic_recording import SyntheticRecording
+
+    fs = case['fs']
+    HRVparams = InitializeHRVparams('Excel_ECG_ICG', makedirs=False)
+    HRVparams['Fs'] = fs
+    HRVparams['ICG']['filter_workers'] = case['workers']
+    # EEMD 试验也限制在 workers 个核: 1 个时在进程内运行, 否则进程池大小 = workers
+    HRVparams['ICG']['eemd_parallel'] = int(case['workers'] > 1)
+    HRVparams['ICG']['eemd_processes'] = case['workers']
+    HRVparams['ICG']['dtype'] = case.get('dtype', 'float64')
+    if case.get('eemd_budget') is not None:
+        HRVparams['ICG']['budget']['recording_seconds'] = case['eemd_budget']
+
+    rec = SyntheticRecording(case['seconds'], fs=fs, seed=case.get('seed', 0))
+    ecg, icg = rec.render(dtype=HRVparams['ICG']['dtype'])
+    rss_input = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def child_cpu():
+        # RUSAGE_CHILDREN 只统计已回收的子进程; PyEMD 只 close() 进程池, 这里等待其工作进程退出并回收
+        deadline = time.monotonic() + 10
+        while multiprocessing.active_children() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    pipeline = ICGPipeline(fs, HRVparams)
+    t0, c0, cc0 = time.perf_counter(), time.process_time(), child_cpu()
+    with profile_run() as recorder, AnnotationWriter(in_memory=True) as writer:
+        beats_clean, beats_denoised, _, _, _, R_peaks = pipeline.process(ecg, icg, subjectID='benchmark', writer=writer)
+        pipeline.extract_bcx(beats_denoised)
+    wall = time.perf_counter() - t0
+    cpu, child_cpu_s = time.process_time() - c0, child_cpu() - cc0
+
+    stages = {name: {'wall_s': s['wall_s'], 'cpu_s': s['cpu_s'], 'calls': s['calls']}
+              for name, s in recorder.report()['stages'].items()}
+    return {
+        'seconds': case['seconds'], 'fs': fs, 'workers': case['workers'], 'samples': int(len(ecg)),
+        'true_beats': int(len(rec.R)), 'beats': int(len(R_peaks)), 'denoised_beats': int(len(beats_denoised)),
+        # cpu_s includes the EEMD pool workers (child_cpu_s of it)
+        'wall_s': wall, 'cpu_s': cpu + child_cpu_s, 'child_cpu_s': child_cpu_s,
+        'beats_per_s': len(R_peaks) / wall if wall else np.nan,
+        'samples_per_s': len(ecg) / wall if wall else np.nan,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        # largest single EEMD pool worker (shares pages with this process, so not added up)
+        'child_peak_rss_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        'input_rss_bytes': rss_input,
+        'eemd': pipeline.stats.as_dict(),
+        'stages': stages,
+    }
+
+
+def run_case(seconds, fs, workers=1, eemd_budget=None, dtype='float64', seed=0, timeout=None):
+    """Run one case in a fresh interpreter limited to `workers` threads and EEMD processes."""
+    case = {'seconds': seconds, 'fs': fs, 'workers': workers, 'eemd_budget': eemd_budget, 'dtype': dtype, 'seed': seed}
+    env = dict(os.environ, MPLBACKEND='Agg')
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        env[var] = str(workers)
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '_child', json.dumps(case)], cwd=HERE,
+                         env=env, capture_output=True, text=True, timeout=timeout)
+    if out.returncode != 0:
+        return {**case, 'error': out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'failed'}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run_suite(cases, workers=(1,), eemd_budget=None, dtype='float64', output_dir=RESULTS_DIR, timeout=None):
+    """
+    Run every (seconds, fs) case for every worker count and save the
+    results as <output_dir>/<revision>.json (cases of an existing file for
+    the same revision are updated).
+
+    Returns:
+        (str, dict): Result path and results
+    """
+    rev, dirty = git_revision()
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{rev}{'-dirty' if dirty else ''}.json")
+    results = {'revision': rev, 'dirty': dirty, 'cases': {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            results = json.load(f)
+
+    import numpy as np
+    results.update({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()})
+    for seconds, fs in cases:
+        for w in workers:
+            label = case_label(seconds, fs, w)
+            r = results['cases'][label] = run_case(seconds, fs, w, eemd_budget, dtype, timeout=timeout)
+            if 'error' in r:
+                print(f"{label:<20} failed: {r['error']}")
+            else:
+                print(f"{label:<20}{r['wall_s']:>9.1f} s{r['beats_per_s']:>9.2f} beats/s"
+                      f"{r['samples_per_s'] / 1e3:>10.1f} ksamples/s{r['peak_rss_bytes'] / 2**20:>9.0f} MiB")
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+    return path, results
+
+
+def _resolve(ref, output_dir=RESULTS_DIR):
+    """Result file of a path or a git revision (HEAD etc. are resolved)."""
+    if os.path.exists(ref):
+        return ref
+    if ref.upper() == 'HEAD' or not os.path.exists(os.path.join(output_dir, f'{ref}.json')):
+        try:
+            ref = subprocess.run(['git', 'rev-parse', '--short', ref], cwd=HERE, capture_output=True,
+                                 text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    return os.path.join(output_dir, f'{ref}.json')
+
+
+def compare(base, new, threshold=0.10, stage_min_s=0.05, output_dir=RESULTS_DIR):
+    """
+    Compare two result files (paths or git revisions).
+
+    A metric regresses when it is worse by more than threshold (relative);
+    stages are compared on wall time, skipping stages under stage_min_s in
+    both runs.
+
+    Returns:
+        dict: 'regressions' and 'improvements' lists of
+            (case, metric, base value, new value, relative change)
+    """
+    with open(_resolve(base, output_dir)) as f:
+        a = json.load(f)
+    with open(_resolve(new, output_dir)) as f:
+        b = json.load(f)
+
+    regressions, improvements = [], []
+
+    def check(label, metric, va, vb, higher_better):
+        if not va or vb is None:
+            return
+        change = (vb - va) / va
+        worse = -change if higher_better else change
+        if worse > threshold:
+            regressions.append((label, metric, va, vb, change))
+        elif worse < -threshold:
+            improvements.append((label, metric, va, vb, change))
+
+    for label in sorted(set(a['cases']) & set(b['cases'])):
+        ca, cb = a['cases'][label], b['cases'][label]
+        if 'error' in ca or 'error' in cb:
+            continue
+        for metric, higher_better in METRICS.items():
+            check(label, metric, ca.get(metric), cb.get(metric), higher_better)
+        for stage in sorted(set(ca['stages']) & set(cb['stages'])):
+            sa, sb = ca['stages'][stage]['wall_s'], cb['stages'][stage]['wall_s']
+            if max(sa, sb) >= stage_min_s:
+                check(label, f'stage:{stage}', sa, sb, False)
+    return {'base': a.get('revision'), 'new': b.get('revision'), 'threshold': threshold,
+            'regressions': regressions, 'improvements': improvements}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == '_child':
+        # ConvertRawDataToRRIntervals prints its progress; keep stdout for the result line
+        with contextlib.redirect_stdout(sys.stderr):
+            result = _run_case(json.loads(sys.argv[2]))
+        sys.__stdout__.write(json.dumps(result) + '\n')
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmark with regression tracking.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='run a suite and store the results under the git revision')
+    p.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    p.add_argument('--case', nargs=2, type=int, action='append', metavar=('SECONDS', 'FS'),
+                   help='extra case (repeatable); replaces the suite when given')
+    p.add_argument('--workers', nargs='+', type=int, default=[1], help='thread counts to run every case with')
+    p.add_argument('--eemd-budget', type=float, default=None,
+                   help='EEMD seconds per recording (long cases fall back to wavelet-only beyond it)')
+    p.add_argument('--dtype', default='float64', choices=['float64', 'float32'])
+    p.add_argument('--timeout', type=float, default=None, help='seconds per case')
+    p.add_argument('-o', '--output', default=RESULTS_DIR)
+    p = sub.add_parser('compare', help='flag regressions between two result files or revisions')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.10, help='relative change flagged (default 0.10)')
+    p.add_argument('-o', '--output', default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        cases = [tuple(c) for c in args.case] if args.case else SUITES[args.suite]
+        path, _ = run_suite(cases, args.workers, args.eemd_budget, args.dtype, args.output, args.timeout)
+        print(path)
+    else:
+        report = compare(args.base, args.new, args.threshold, output_dir=args.output)
+        for kind in ('regressions', 'improvements'):
+            print(f"{kind} ({report['base']} -> {report['new']}, threshold {report['threshold']:.0%}):")
+            for label, metric, va, vb, change in report[kind]:
+                print(f"  {label:<20}{metric:<22}{va:>12.4g} -> {vb:<12.4g}{change:+.1%}")
+        sys.exit(1 if report['regressions'] else 0)
@@ -16,6 +16,7 @@ def run_qrsdet_by_seg(ecg, HRVparams):
     """
 
     import numpy as np
+    from jqrs import jqrs
 
     fs = HRVparams['Fs']
     window = HRVparams['PeakDetect']['windows']
@@ -29,15 +30,6 @@ def run_qrsdet_by_seg(ecg, HRVparams):
     stop = segsize_samp
     sign_force = 0
 
-    def jqrs(segment, HRVparams, sign_force=0):
-        """
-        Placeholder jqrs function.
-        Should return (qrs_peaks, sign_force) for the segment
-        """
-        from scipy.signal import find_peaks
-        peaks, _ = find_peaks(segment, distance=int(0.25 * HRVparams['Fs']))
-        return peaks.tolist(), sign_force
-
     try:
         for ch in range(nb_seg):
             qrstemp = []
@@ -59,10 +51,10 @@ def run_qrsdet_by_seg(ecg, HRVparams):
             if ecgType == 'FECG':
                 thres_trans = thres
                 while len(qrstemp) < 20 and thres_trans > 0.1:
-                    qrstemp, sign_force = jqrs(segment, HRVparams, sign_force)
+                    qrstemp, sign_force, _ = jqrs(segment, HRVparams, thres_trans, sign_force)
                     thres_trans -= 0.1
             else:
-                qrstemp, sign_force = jqrs(segment, HRVparams, sign_force)
+                qrstemp, sign_force, _ = jqrs(segment, HRVparams, thres, sign_force)
 
             new_qrs = [start - dTminus + q for q in qrstemp]
             new_qrs = [q for q in new_qrs if start <= q < stop]
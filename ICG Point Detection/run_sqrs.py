@@ -1,34 +1,27 @@
 import numpy as np
 from scipy.signal import resample
 
+from compute_backend import backend_from_params, example_ecg, get_kernel, kernel
 
-def run_sqrs(ecg, HRVparams, rs=1):
-    """
-    Python implementation of SQRS QRS detector
-    """
-    if ecg is None or HRVparams is None:
-        raise ValueError("Must provide ECG signal and HRVparams")
-
-    debug = 0
-    fs = HRVparams['Fs']
-    out = []
+# Slope filter of the SQRS detector
+SQRS_FILTER = np.array([1, 4, 6, 4, 1, -1, -4, -6, -4, -1], dtype=np.float64)
 
-    if rs == 0:
-        freq = fs
-        ecg_data = ecg
-    else:
-        freq = 256
-        ecg_data = resample(ecg, int(len(ecg) * freq / fs))
 
+@kernel('sqrs', example=lambda rng: (example_ecg(rng, 256), 256))
+def sqrs_kernel(ecg_data, freq):
+    """Slope state machine of SQRS; returns the QRS locations (samples)."""
     ms160 = int(np.ceil(0.16 * freq))
     ms200 = int(np.ceil(0.2 * freq))
     s2 = int(np.ceil(2 * freq))
-    scmin = 500
+    scmin = 500.0
     scmax = 10 * scmin
     slopecrit = 10 * scmin
-    maxslope = 0
+    maxslope = 0.0
     nslope = 0
 
+    # 一次检测至少要倒计时 ms160 + 1 个样本, 输出长度以此为上限
+    out = np.empty(len(ecg_data) // (ms160 + 1) + 1, dtype=np.int64)
+    n_out = 0
     time = 0
     now = 10
     maxtime = 0
@@ -36,7 +29,9 @@ def run_sqrs(ecg, HRVparams, rs=1):
     qtime = 0
 
     while now < len(ecg_data):
-        filt = np.dot([1, 4, 6, 4, 1, -1, -4, -6, -4, -1], ecg_data[now - 9:now + 1])
+        filt = 0.0
+        for j in range(10):
+            filt += SQRS_FILTER[j] * ecg_data[now - 9 + j]
 
         if time % s2 == 0:
             if nslope == 0:
@@ -62,17 +57,40 @@ def run_sqrs(ecg, HRVparams, rs=1):
                 if 2 <= nslope <= 4:
                     slopecrit += ((maxslope / 4) - slopecrit) / 8
                     slopecrit = max(min(slopecrit, scmax), scmin)
-                    out.append(now - (time - qtime) - 4)
+                    out[n_out] = now - (time - qtime) - 4
+                    n_out += 1
                     time = 0
                 elif nslope >= 5:
-                    out.append(now - (time - qtime) - 4)
+                    out[n_out] = now - (time - qtime) - 4
+                    n_out += 1
                 nslope = 0
             maxtime -= 1
 
         time += 1
         now += 1
 
-    out = [x - 1 for x in out]  # Adjust for 1-sample offset
+    return out[:n_out] - 1  # Adjust for 1-sample offset
+
+
+
+def run_sqrs(ecg, HRVparams, rs=1):
+    """
+    Python implementation of SQRS QRS detector
+    """
+    if ecg is None or HRVparams is None:
+        raise ValueError("Must provide ECG signal and HRVparams")
+
+    debug = 0
+    fs = HRVparams['Fs']
+
+    if rs == 0:
+        freq = fs
+        ecg_data = ecg
+    else:
+        freq = 256
+        ecg_data = resample(ecg, int(len(ecg) * freq / fs))
+
+    out = get_kernel('sqrs', backend_from_params(HRVparams))(np.asarray(ecg_data, dtype=np.float64), int(freq))
 
     if debug > 0:
         import matplotlib.pyplot as plt
@@ -81,5 +99,5 @@ def run_sqrs(ecg, HRVparams, rs=1):
         plt.title("QRS Detections (SQRS)")
         plt.show()
 
-    return np.array(out)
+    return out
 
@@ -0,0 +1,245 @@
+import json
+import lzma
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+ARCHIVE_MAGIC = b'ICGZ\x01'
+ARCHIVE_EXT = '.icgz'
+
+_CODECS = {
+    'zlib': (lambda raw, level: zlib.compress(raw, level), zlib.decompress),
+    'lzma': (lambda raw, level: lzma.compress(raw, preset=level), lzma.decompress),
+    'none': (lambda raw, level: raw, lambda raw: raw),
+}
+
+
+def _delta_encode(digital):
+    """Per-channel successive differences (first one is 0), in the smallest int type that fits."""
+    delta = np.diff(digital, axis=0, prepend=digital[:1])
+    amp = np.abs(delta).max() if delta.size else 0
+    for dtype in (np.int8, np.int16, np.int32):
+        if amp <= np.iinfo(dtype).max:
+            break
+    else:
+        dtype = np.int64
+    # Channel-major layout compresses better than interleaved frames
+    return np.ascontiguousarray(delta.T, dtype=dtype), np.dtype(dtype).str
+
+
+class ArchiveWriter:
+    """
+    Write ECG/ICG recordings into a chunked, compressed archive (.icgz).
+
+    Samples are quantized to 1/gain physical units, split into chunks of
+    chunk_seconds, delta encoded per channel and compressed with a stdlib
+    codec (zlib, lzma or none). A JSON chunk index is stored at the end of
+    the file, so blocks can be appended as they arrive and any time range
+    can later be read by decompressing only the chunks it overlaps.
+
+    Usage:
+        with ArchiveWriter('Subject_1_BL.icgz', fs=1000) as w:
+            for block in blocks:          # (n, 2) ECG/ICG
+                w.write(block)
+    """
+
+    def __init__(self, path, fs, sig_names=('ECG', 'ICG'), units='mV', gain=32768,
+                 chunk_seconds=60, codec='zlib', level=6):
+        if codec not in _CODECS:
+            raise ValueError(f"Unknown codec {codec}, use one of {list(_CODECS)}")
+        self.path = path
+        self.fs = fs
+        self.sig_names = list(sig_names)
+        self.nsig = len(self.sig_names)
+        self.units = [units] * self.nsig if isinstance(units, str) else list(units)
+        self.gain = [float(gain)] * self.nsig if np.isscalar(gain) else [float(g) for g in gain]
+        self.chunk_samples = max(int(round(chunk_seconds * fs)), 1)
+        self.codec = codec
+        self.level = level
+
+        self._compress = _CODECS[codec][0]
+        self._pending = []
+        self._npending = 0
+        self._chunks = []
+        self._nsamp = 0
+        self._file = open(path, 'wb')
+        self._file.write(ARCHIVE_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, samples):
+        """Append physical samples, shape (n,) for one signal or (n, nsig)."""
+        samples = np.asarray(samples, dtype=float)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        if samples.shape[1] != self.nsig:
+            raise ValueError(f"Expected {self.nsig} signals, got {samples.shape[1]}")
+        self._pending.append(samples)
+        self._npending += len(samples)
+        while self._npending >= self.chunk_samples:
+            block = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+            self._write_chunk(block[:self.chunk_samples])
+            rest = block[self.chunk_samples:]
+            self._pending = [rest] if len(rest) else []
+            self._npending = len(rest)
+
+    def _write_chunk(self, block):
+        digital = np.round(block * np.array(self.gain)).astype(np.int64)
+        delta, dtype = _delta_encode(digital)
+        payload = self._compress(delta.tobytes(), self.level)
+        offset = self._file.tell()
+        self._file.write(payload)
+        self._chunks.append([offset, len(payload), self._nsamp, len(block), dtype, digital[0].tolist()])
+        self._nsamp += len(block)
+
+    def close(self):
+        """Write the remaining samples and the chunk index."""
+        if self._file.closed:
+            return
+        if self._npending:
+            self._write_chunk(np.concatenate(self._pending))
+            self._pending, self._npending = [], 0
+        index = {
+            'fs': self.fs,
+            'nsig': self.nsig,
+            'sig_names': self.sig_names,
+            'units': self.units,
+            'gain': self.gain,
+            'codec': self.codec,
+            'chunk_samples': self.chunk_samples,
+            'nsamp': self._nsamp,
+            'chunks': self._chunks,
+        }
+        index_offset = self._file.tell()
+        self._file.write(json.dumps(index).encode('utf-8'))
+        self._file.write(struct.pack('<Q', index_offset))
+        self._file.write(ARCHIVE_MAGIC)
+        self._file.close()
+
+
+def write_archive(path, signals, fs, **kwargs):
+    """
+    Write a whole recording to an .icgz archive in one call.
+
+    Parameters:
+        path (str): Output file
+        signals (np.ndarray): Physical samples, shape (N,) or (N, nsig)
+        fs (float): Sampling frequency (Hz)
+        **kwargs: sig_names, units, gain, chunk_seconds, codec, level (see ArchiveWriter)
+    """
+    signals = np.asarray(signals)
+    if signals.ndim == 1:
+        kwargs.setdefault('sig_names', ('ECG',))
+    with ArchiveWriter(path, fs, **kwargs) as writer:
+        step = writer.chunk_samples
+        for start in range(0, len(signals), step):
+            writer.write(signals[start:start + step])
+
+
+class SignalArchive:
+    """
+    Random-access reader for .icgz archives.
+
+    Usage:
+        arc = SignalArchive('Subject_1_BL.icgz')
+        block = arc.read(3600, 3660)              # one minute, (n, nsig)
+        for start, block in arc.iter_chunks():    # stream the whole record
+            ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a signal archive")
+            f.seek(-(8 + len(ARCHIVE_MAGIC)), os.SEEK_END)
+            index_offset = struct.unpack('<Q', f.read(8))[0]
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is truncated (no chunk index)")
+            f.seek(index_offset)
+            self.index = json.loads(f.read()[:-(8 + len(ARCHIVE_MAGIC))])
+
+        self.fs = self.index['fs']
+        self.nsig = self.index['nsig']
+        self.sig_names = self.index['sig_names']
+        self.units = self.index['units']
+        self.gain = np.array(self.index['gain'])
+        self.nsamp = self.index['nsamp']
+        self.chunks = self.index['chunks']
+        self._chunk_starts = np.array([c[2] for c in self.chunks], dtype=np.int64)
+        self._decompress = _CODECS[self.index['codec']][1]
+        self._file = open(path, 'rb')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.nsamp
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _read_chunk(self, i):
+        offset, nbytes, _, n, dtype, first = self.chunks[i]
+        with self._lock:
+            self._file.seek(offset)
+            payload = self._file.read(nbytes)
+        delta = np.frombuffer(self._decompress(payload), dtype=np.dtype(dtype)).reshape(self.nsig, n)
+        digital = np.cumsum(delta, axis=1, dtype=np.int64) + np.array(first, dtype=np.int64)[:, None]
+        return (digital / self.gain[:, None]).T
+
+    def read_samples(self, start=0, stop=None, out=None):
+        """
+        Physical samples of rows [start, stop), decompressing only the overlapping chunks.
+
+        Parameters:
+            start, stop (int): Sample range (stop=None reads to the end)
+            out (np.ndarray): Optional preallocated (stop - start, nsig) array
+
+        Returns:
+            np.ndarray: Samples of shape (stop - start, nsig)
+        """
+        start, stop, _ = slice(start, stop).indices(self.nsamp)
+        stop = max(stop, start)
+        if out is None:
+            out = np.empty((stop - start, self.nsig))
+        if stop == start:
+            return out
+        first = np.searchsorted(self._chunk_starts, start, side='right') - 1
+        last = np.searchsorted(self._chunk_starts, stop, side='left')
+        for i in range(first, last):
+            c0 = self.chunks[i][2]
+            block = self._read_chunk(i)
+            lo, hi = max(start, c0), min(stop, c0 + len(block))
+            out[lo - start:hi - start] = block[lo - c0:hi - c0]
+        return out
+
+    def read(self, t_start=0, t_stop=None):
+        """Physical samples between t_start and t_stop (seconds)."""
+        stop = None if t_stop is None else int(round(t_stop * self.fs))
+        return self.read_samples(int(round(t_start * self.fs)), stop)
+
+    def iter_chunks(self, start=0, stop=None):
+        """Yield (start_sample, block) for the stored chunks overlapping [start, stop)."""
+        start, stop, _ = slice(start, stop).indices(self.nsamp)
+        if stop <= start:
+            return
+        first = np.searchsorted(self._chunk_starts, start, side='right') - 1
+        for i in range(first, len(self.chunks)):
+            c0 = self.chunks[i][2]
+            if c0 >= stop:
+                break
+            block = self._read_chunk(i)
+            lo, hi = max(start, c0), min(stop, c0 + len(block))
+            yield lo, block[lo - c0:hi - c0]
@@ -0,0 +1,177 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+
+
+def code_version(*funcs):
+    """Hash of the source code of the given functions, so cached results expire when the code changes."""
+    h = hashlib.blake2b(digest_size=8)
+    for func in funcs:
+        try:
+            h.update(inspect.getsource(func).encode('utf-8'))
+        except (OSError, TypeError):
+            h.update(getattr(func, '__qualname__', repr(func)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _update(h, obj):
+    if isinstance(obj, np.ndarray):
+        h.update(f"nd{obj.dtype.str}{obj.shape}".encode('utf-8'))
+        h.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, (list, tuple)) and any(isinstance(o, np.ndarray) for o in obj):
+        h.update(f"seq{len(obj)}".encode('utf-8'))
+        for o in obj:
+            _update(h, o)
+    else:
+        h.update(json.dumps(obj, sort_keys=True, default=str).encode('utf-8'))
+
+
+class StageCache:
+    """
+    Content-addressed on-disk cache for the results of pipeline stages.
+
+    A key is a hash of the stage name, a code version, the stage inputs
+    (arrays are hashed by content, earlier keys can be passed to chain
+    stages without re-hashing their outputs) and the relevant parameter
+    subset. Entries are pickled under root/<2 hex>/<key>.pkl; every hit
+    refreshes the file time and the least recently used entries are
+    evicted once the cache grows beyond max_bytes.
+
+    Usage:
+        cache = StageCache('OutputData/cache', max_bytes=2 * 1024**3)
+        filtered, k = cache.run('bandpass', lambda: filtfilt(b, a, icg), icg, params={'band': [0.5, 40]})
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024**3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, stage, *inputs, params=None, version=''):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{stage}\0{version}\0".encode('utf-8'))
+        for obj in inputs:
+            _update(h, obj)
+        _update(h, params)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.pkl")
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def run(self, stage, compute, *inputs, params=None, version='', store=None):
+        """
+        Return (result, key) of a stage, computing and storing it on a miss.
+
+        Parameters:
+            stage (str): Stage name
+            compute (callable): Called without arguments on a cache miss
+            *inputs: Arrays, values or keys of earlier stages the result depends on
+            params (dict): Parameter subset the result depends on
+            version (str or callable): Code version, e.g. code_version(stage_function),
+                or a callable returning it
+            store (callable): Optional predicate on a computed result; results it
+                rejects are not written and their key is returned as None, so that
+                later stages do not cache anything derived from them either
+        """
+        if callable(version):
+            version = version()
+        key = self.key(stage, *inputs, params=params, version=version)
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            with self._lock:
+                self.hits += 1
+            return value, key
+        with self._lock:
+            self.misses += 1
+        value = compute()
+        if store is not None and not store(value):
+            return value, None
+        self.put(key, value)
+        return value, key
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for folder, _, files in os.walk(self.root):
+                for name in files:
+                    if name.endswith('.pkl'):
+                        path = os.path.join(folder, name)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, path))
+            total = sum(e[1] for e in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+
+def run_stage(cache, stage, compute, *inputs, params=None, version='', store=None):
+    """
+    StageCache.run() when a cache is given, otherwise just compute (key is None).
+
+    Pass version as a callable (e.g. lambda: code_version(f, g)) so that the
+    source of the stage functions is only hashed when a cache is in use.
+    """
+    if cache is None:
+        return compute(), None
+    return cache.run(stage, compute, *inputs, params=params, version=version, store=store)
+
+
+def stage_cache_from_params(HRVparams):
+    """StageCache configured by HRVparams['cache'], or None when caching is off."""
+    p = HRVparams.get('cache', {})
+    if not p.get('on'):
+        return None
+    return StageCache(p['folder'], p.get('max_bytes', 2 * 1024**3))
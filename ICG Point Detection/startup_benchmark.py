@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Entry points whose startup cost is measured: (label, python code run in a fresh interpreter)
+TARGETS = [
+    ('numpy', 'import numpy'),
+    ('icg_cli --help', 'import icg_cli; icg_cli.build_parser().format_help()'),
+    ('detect-qrs imports', 'import icg_cli, run_qrsdet_by_seg, InitializeHRVparams, load_ecg_icg'),
+    ('sqi imports', 'import icg_cli, ConvertRawDataToRRIntervals'),
+    ('hrv imports', 'import icg_cli, ConvertRawDataToRRIntervals, hrv_metrics'),
+    ('denoise/bcx imports', 'import icg_cli, icg_pipeline, beat_store'),
+    ('batch worker', 'import batch_runner, icg_pipeline; batch_runner._init_worker(1000, None)'),
+    ('EEMD stage', 'import icg_pipeline; icg_pipeline.ICGPipeline(1000).eemd'),
+    ('plot imports', 'import icg_cli, matplotlib.pyplot'),
+]
+
+HEAVY = ('scipy', 'pywt', 'PyEMD', 'pandas', 'matplotlib', 'pyarrow', 'tables')
+
+
+def measure(code, repeats=5):
+    """
+    Startup cost of running code in a fresh interpreter.
+
+    Returns:
+        dict: median wall time (s) over repeats, the cumulative import time
+            of each heavy package (s, from -X importtime) and which heavy
+            packages were loaded
+    """
+    probe = code + "; import sys; print('LOADED=' + ','.join(m for m in %r if m in sys.modules))" % (HEAVY,)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    walls = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', probe], cwd=HERE, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        walls.append(time.perf_counter() - t0)
+
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=HERE, env=env,
+                         capture_output=True, text=True, check=True)
+    # importtime lists children before their parent; walk it parent-first and
+    # charge each heavy package the cumulative time of its outermost imports
+    packages = {}
+    stack = []
+    for line in reversed(out.stderr.splitlines()):
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+        if not m:
+            continue
+        depth, root = len(m.group(2)), m.group(3).split('.')[0]
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if root in HEAVY and all(r != root for _, r in stack):
+            packages[root] = packages.get(root, 0) + int(m.group(1)) / 1e6
+        stack.append((depth, root))
+    loaded = re.search(r'LOADED=(.*)', out.stdout).group(1)
+    return {'wall_s': sorted(walls)[len(walls) // 2], 'import_s': packages,
+            'loaded': [m for m in loaded.split(',') if m]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the startup/import cost of the pipeline entry points.')
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    parser.add_argument('-o', '--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'target':<22}{'wall (s)':>10}  heavy packages loaded")
+    for label, code in TARGETS:
+        r = results[label] = measure(code, args.repeats)
+        detail = ', '.join(f"{m} {r['import_s'].get(m, 0):.2f}" for m in r['loaded']) or '-'
+        print(f"{label:<22}{r['wall_s']:>10.2f}  {detail}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,360 @@
+"""
+Synthetic ECG/ICG recordings with ground-truth R/B/C/X for load and accuracy tests.
+
+    python synthetic_recording.py synth_24h.icgz --hours 24 --ectopy 0.01 --motion 1
+    python synthetic_recording.py --check --seconds 120 --noise 0.02
+"""
+import argparse
+import copy
+import os
+
+import numpy as np
+
+DEFAULTS = {
+    'hr': 70.0,             # mean heart rate (bpm)
+    'lf': 0.03,             # relative RR modulation at 0.1 Hz (Mayer waves)
+    'hf': 0.02,             # relative RR modulation at the respiration rate
+    'resp_hz': 0.25,        # respiration rate (Hz), also modulates the ICG baseline
+    'rr_sd': 0.02,          # s, AR(1) beat-to-beat RR noise
+    'ectopy': 0.0,          # probability of a premature ventricular beat
+    'ecg_amp': 1.0,         # R amplitude (mV)
+    'icg_amp': 2.0,         # C amplitude of dZ/dt
+    'x_depth': 0.8,         # X depth relative to icg_amp * 0.4
+    'pep': 0.09,            # s, R -> B
+    'pep_sd': 0.005,        # s, slow PEP variation
+    'bc': 0.06,             # s, B -> C
+    'noise': {
+        'white': 0.01,      # sd relative to the channel amplitude
+        'baseline': 0.1,    # baseline wander amplitude (relative)
+        'powerline': 0.02,  # mains amplitude (relative)
+        'mains_hz': 50,
+        'motion': 0.0,      # motion artifacts per minute
+        'motion_amp': 0.5,  # motion artifact amplitude (relative)
+    },
+}
+
+_BLOCK = 4096       # white noise is drawn per block of samples, so any chunking gives the same signal
+_ECG_SUPPORT = (-0.4, 0.8)
+
+
+def _gauss(t, mu, amp, sd):
+    return amp * np.exp(-0.5 * ((t - mu) / sd) ** 2)
+
+
+def ecg_beat(t, rr, ectopic=False):
+    """ECG of one beat at times t (s) relative to its R peak; Gaussian P-QRS-T waves, QT scaled by sqrt(RR)."""
+    q = np.sqrt(rr)
+    if ectopic:
+        return (_gauss(t, 0.0, 1.3, 0.035) + _gauss(t, 0.09, -0.4, 0.03)
+                + _gauss(t, 0.32 * q, -0.4, 0.06 * q))
+    return (_gauss(t, -0.2, 0.12, 0.025) + _gauss(t, -0.03, -0.12, 0.01) + _gauss(t, 0.0, 1.0, 0.011)
+            + _gauss(t, 0.03, -0.25, 0.011) + _gauss(t, 0.28 * q, 0.3, 0.05 * q))
+
+
+def icg_beat(t, b, c, x, amp=1.0, depth=0.4):
+    """
+    dZ/dt of one beat at times t (s) relative to R: flat until B, raised-cosine
+    upstroke to the C peak, descent to the X minimum (-depth), recovery and a
+    small O wave.
+    """
+    y = np.zeros_like(t, dtype=float)
+    up = (t >= b) & (t <= c)
+    y[up] = 0.5 * (1 - np.cos(np.pi * (t[up] - b) / (c - b)))
+    down = (t > c) & (t <= x)
+    y[down] = 1 - (1 + depth) * 0.5 * (1 - np.cos(np.pi * (t[down] - c) / (x - c)))
+    rec = 0.1
+    back = (t > x) & (t <= x + rec)
+    y[back] = -depth * 0.5 * (1 + np.cos(np.pi * (t[back] - x) / rec))
+    y += _gauss(t, x + rec + 0.05, 0.12, 0.03)
+    return amp * y
+
+
+class SyntheticRecording:
+    """
+    Synthetic ECG/ICG recording of any length and sampling rate.
+
+    The beat table (R times with LF/HF modulated RR, optional premature
+    ventricular beats with compensatory pause, B/C/X of every beat) is drawn
+    up front; samples are rendered on demand for any range, so multi-day
+    records are streamed with iter_chunks()/write() without holding the
+    signal in memory. Noise (white, baseline wander, mains, motion bursts)
+    is a deterministic function of the absolute sample index: rendering in
+    different chunk sizes gives the same samples.
+
+    Usage:
+        rec = SyntheticRecording(hours=24, fs=1000, params={'ectopy': 0.01})
+        for s0, ecg, icg in rec.iter_chunks(60):
+            ...
+        truth = rec.ground_truth()
+    """
+
+    def __init__(self, seconds=None, hours=None, fs=1000, params=None, seed=0):
+        self.fs = fs
+        self.seed = seed
+        self.duration = float(seconds if seconds is not None else (hours or 0) * 3600)
+        self.n_samples = int(self.duration * fs)
+        p = copy.deepcopy(DEFAULTS)
+        for key, value in (params or {}).items():
+            if key == 'noise':
+                p['noise'].update(value)
+            else:
+                p[key] = value
+        self.params = p
+        rng = np.random.default_rng([seed, 0])
+        self._beats(rng)
+        self._noise_setup(rng)
+
+    def _beats(self, rng):
+        p = self.params
+        mean_rr = 60.0 / p['hr']
+        n_max = int(self.duration / (mean_rr * 0.5)) + 2
+        phi_lf, phi_hf = rng.uniform(0, 2 * np.pi, 2)
+        R = np.empty(n_max)
+        rr = np.empty(n_max)
+        ectopic = np.zeros(n_max, dtype=bool)
+        pep = np.empty(n_max)
+        t, ar, pep_ar, pause = 0.5, 0.0, 0.0, 0.0
+        for k in range(n_max):
+            ar = 0.9 * ar + rng.normal(0, p['rr_sd'] * np.sqrt(1 - 0.81))
+            pep_ar = 0.99 * pep_ar + rng.normal(0, p['pep_sd'] * np.sqrt(1 - 0.99 ** 2))
+            base = mean_rr * (1 + p['lf'] * np.sin(2 * np.pi * 0.1 * t + phi_lf)
+                              + p['hf'] * np.sin(2 * np.pi * p['resp_hz'] * t + phi_hf)) + ar
+            if k == 0:
+                step = base
+            elif pause:
+                step, pause = pause, 0.0   # 代偿间歇: 早搏后下一拍补足两个 RR
+            elif rng.random() < p['ectopy']:
+                step, pause = 0.65 * base, 1.35 * base
+                ectopic[k] = True
+            else:
+                step = base
+            if k:
+                t += step
+            R[k], rr[k], pep[k] = t, step, p['pep'] + pep_ar
+            if t >= self.duration:
+                break
+        k += 1
+        keep = R[:k] < self.duration
+        self.R = R[:k][keep]
+        self.rr = rr[:k][keep]
+        self.ectopic = ectopic[:k][keep]
+
+        hr = 60.0 / self.rr
+        # Weissler: LVET (s) = 0.413 - 0.0017 * HR; ectopic beats eject late, short and weak
+        lvet = 0.413 - 0.0017 * hr
+        self.B = pep[:k][keep] + np.where(self.ectopic, 0.03, 0.0)
+        self.C = self.B + p['bc']
+        self.X = self.B + np.where(self.ectopic, 0.7, 1.0) * lvet
+        self.icg_amp = p['icg_amp'] * np.where(self.ectopic, 0.5, 1.0)
+
+    def _noise_setup(self, rng):
+        n = self.params['noise']
+        self._wander = [(f, rng.uniform(0, 2 * np.pi), a) for f, a in ((0.05, 1.0), (0.15, 0.5), (0.3, 0.3))]
+        self._mains_phase = rng.uniform(0, 2 * np.pi)
+        count = rng.poisson(n['motion'] * self.duration / 60.0)
+        t0 = np.sort(rng.uniform(0, self.duration, count))
+        self.motion = np.column_stack([t0, t0 + rng.uniform(0.5, 3.0, count)])
+        self._motion_shape = np.column_stack([rng.uniform(1, 8, count), rng.uniform(0, 2 * np.pi, count),
+                                              rng.uniform(0.5, 1.0, count)])
+
+    def _white(self, start, stop):
+        out = np.empty((stop - start, 2))
+        for blk in range(start // _BLOCK, (stop - 1) // _BLOCK + 1):
+            b0 = blk * _BLOCK
+            z = np.random.default_rng([self.seed, 1, blk]).standard_normal((_BLOCK, 2))
+            lo, hi = max(start, b0), min(stop, b0 + _BLOCK)
+            out[lo - start:hi - start] = z[lo - b0:hi - b0]
+        return out
+
+    def render(self, start=0, stop=None, dtype=np.float64):
+        """ECG and ICG samples [start, stop)."""
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        fs, p, noise = self.fs, self.params, self.params['noise']
+        t = (start + np.arange(stop - start)) / fs
+        ecg = np.zeros(len(t))
+        icg = np.zeros(len(t))
+        if len(t) == 0:
+            return ecg.astype(dtype), icg.astype(dtype)
+
+        t_start, t_stop = start / fs, stop / fs
+        i0 = np.searchsorted(self.R, t_start - 1.0)
+        i1 = np.searchsorted(self.R, t_stop - _ECG_SUPPORT[0])
+        for k in range(i0, i1):
+            r = self.R[k]
+            lo = max(int(np.ceil((r + _ECG_SUPPORT[0]) * fs)) - start, 0)
+            hi = min(int(np.ceil((r + max(_ECG_SUPPORT[1], self.X[k] + 0.3)) * fs)) - start, len(t))
+            if hi <= lo:
+                continue
+            tr = t[lo:hi] - r
+            ecg[lo:hi] += p['ecg_amp'] * ecg_beat(tr, self.rr[k], self.ectopic[k])
+            icg[lo:hi] += icg_beat(tr, self.B[k], self.C[k], self.X[k], self.icg_amp[k], 0.4 * p['x_depth'])
+
+        amps = np.array([p['ecg_amp'], p['icg_amp']])
+        both = np.column_stack([ecg, icg])
+        wander = sum(a * np.sin(2 * np.pi * f * t + ph) for f, ph, a in self._wander)
+        both += noise['baseline'] * amps * wander[:, None]
+        # 阻抗随呼吸变化, ICG 基线额外叠加呼吸成分
+        both[:, 1] += noise['baseline'] * amps[1] * np.sin(2 * np.pi * p['resp_hz'] * t)
+        both += noise['powerline'] * amps * np.sin(2 * np.pi * noise['mains_hz'] * t + self._mains_phase)[:, None]
+        both += noise['white'] * amps * self._white(start, stop)
+
+        j0, j1 = np.searchsorted(self.motion[:, 1], t_start), np.searchsorted(self.motion[:, 0], t_stop)
+        for (m0, m1), (f, ph, a) in zip(self.motion[j0:j1], self._motion_shape[j0:j1]):
+            sel = (t >= m0) & (t < m1)
+            env = np.sin(np.pi * (t[sel] - m0) / (m1 - m0)) ** 2
+            burst = noise['motion_amp'] * a * env * np.sin(2 * np.pi * f * (t[sel] - m0) + ph)
+            both[sel] += burst[:, None] * amps * [1.0, 2.0]
+        return both[:, 0].astype(dtype, copy=False), both[:, 1].astype(dtype, copy=False)
+
+    def iter_chunks(self, chunk_seconds=60, start=0, stop=None, dtype=np.float64):
+        """Yields (start_sample, ecg_block, icg_block), like load_ecg_icg.iter_ecg_icg()."""
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        step = max(int(chunk_seconds * self.fs), 1)
+        for s0 in range(start, stop, step):
+            ecg, icg = self.render(s0, min(s0 + step, stop), dtype)
+            yield s0, ecg, icg
+
+    def ground_truth(self, start=0, stop=None):
+        """
+        Beats with R in [start, stop) samples.
+
+        Returns:
+            dict: R, B, C, X (float, absolute samples), rr (s), ectopic (bool)
+                and motion ((n, 2) artifact intervals in samples)
+        """
+        stop = self.n_samples if stop is None else stop
+        sel = (self.R * self.fs >= start) & (self.R * self.fs < stop)
+        R = self.R[sel]
+        return {'R': R * self.fs, 'B': (R + self.B[sel]) * self.fs, 'C': (R + self.C[sel]) * self.fs,
+                'X': (R + self.X[sel]) * self.fs, 'rr': self.rr[sel], 'ectopic': self.ectopic[sel],
+                'motion': self.motion * self.fs, 'fs': self.fs}
+
+    def write(self, path, chunk_seconds=60):
+        """
+        Stream the recording to an .icgz archive or a CSV file (ECG, ICG
+        columns) and save the ground truth next to it as <name>_truth.npz.
+
+        Returns:
+            str: Path of the ground-truth file
+        """
+        from signal_archive import ARCHIVE_EXT, ArchiveWriter
+
+        if path.lower().endswith(ARCHIVE_EXT):
+            with ArchiveWriter(path, self.fs, chunk_seconds=chunk_seconds) as w:
+                for _, ecg, icg in self.iter_chunks(chunk_seconds):
+                    w.write(np.column_stack([ecg, icg]))
+        else:
+            with open(path, 'w') as f:
+                for _, ecg, icg in self.iter_chunks(chunk_seconds):
+                    np.savetxt(f, np.column_stack([ecg, icg]), fmt='%.6f', delimiter=',')
+        truth = os.path.splitext(path)[0] + '_truth.npz'
+        np.savez_compressed(truth, **self.ground_truth())
+        return truth
+
+
+def bcx_accuracy(truth, R_peaks, b_rel, c_rel, x_rel, llim_beat, fs=1000, match_seconds=0.05,
+                 exclude_ectopic=True, exclude_motion=True):
+    """
+    Compare detected B/C/X with the ground truth.
+
+    Detected beats are matched to the nearest true R within match_seconds;
+    b_rel/c_rel/x_rel are relative to the beat start R - llim_beat, as
+    returned by extract_bcx_points_from_beats().
+
+    Returns:
+        dict: matched/missed/extra beat counts, and per point ('B', 'C', 'X')
+            and interval ('PEP', 'LVET') n, bias_ms, sd_ms, mae_ms and the
+            fraction within 5 / 10 ms
+    """
+    R_true = np.asarray(truth['R'], dtype=float)
+    R_det = np.asarray(R_peaks, dtype=float)
+    if len(R_true) == 0 or len(R_det) == 0:
+        return {'matched': 0, 'missed': int(len(R_true)), 'extra': int(len(R_det))}
+    j = np.minimum(np.searchsorted(R_true, R_det), len(R_true) - 1)
+    left = np.maximum(j - 1, 0)
+    j = np.where(np.abs(R_true[left] - R_det) <= np.abs(R_true[j] - R_det), left, j)
+    ok = np.abs(R_true[j] - R_det) <= match_seconds * fs
+    # 每个真实心搏最多匹配一次
+    _, first = np.unique(j[ok], return_index=True)
+    det = np.flatnonzero(ok)[first]
+    j = j[det]
+
+    keep = np.ones(len(det), dtype=bool)
+    if exclude_ectopic:
+        keep &= ~np.asarray(truth['ectopic'])[j]
+    if exclude_motion and len(truth['motion']):
+        motion = np.asarray(truth['motion'])
+        # 运动伪迹期间及其后 1 s 内的心搏不参与评估
+        k = np.searchsorted(motion[:, 0], R_true[j], side='right') - 1
+        keep &= ~((k >= 0) & (R_true[j] < motion[np.maximum(k, 0), 1] + fs))
+
+    report = {'matched': int(len(det)), 'missed': int(len(R_true) - len(det)),
+              'extra': int(len(R_det) - len(det)), 'evaluated': int(keep.sum())}
+    start = R_det[det] - llim_beat
+    det_pts = {name: start + np.asarray(rel, dtype=float)[det] for name, rel in zip('BCX', (b_rel, c_rel, x_rel))}
+    true_pts = {name: np.asarray(truth[name])[j] for name in 'BCX'}
+    errors = {name: det_pts[name] - true_pts[name] for name in 'BCX'}
+    # PEP = R -> B (检测到的 R), LVET = B -> X
+    errors['PEP'] = (det_pts['B'] - R_det[det]) - (true_pts['B'] - R_true[j])
+    errors['LVET'] = (det_pts['X'] - det_pts['B']) - (true_pts['X'] - true_pts['B'])
+    for name, err in errors.items():
+        err = err[keep] / fs * 1000
+        err = err[~np.isnan(err)]
+        a = np.abs(err)
+        report[name] = {'n': int(len(err)),
+                        'bias_ms': float(err.mean()) if len(err) else np.nan,
+                        'sd_ms': float(err.std()) if len(err) else np.nan,
+                        'mae_ms': float(a.mean()) if len(err) else np.nan,
+                        'within_5ms': float(np.mean(a <= 5)) if len(err) else np.nan,
+                        'within_10ms': float(np.mean(a <= 10)) if len(err) else np.nan}
+    return report
+
+
+def check_extract_bcx(seconds=120, fs=1000, params=None, seed=0, HRVparams=None):
+    """
+    Accuracy of extract_bcx_points_from_beats() on a synthetic recording.
+
+    R detection and denoising are bypassed: the band-passed ICG is cut at
+    the true R peaks with the pipeline's beat window (beat_pre before R,
+    median RR long), so the report isolates the B/C/X search.
+    """
+    from icg_pipeline import ICGPipeline, extract_bcx_points_from_beats
+    from beat_index import BeatIndex
+
+    rec = SyntheticRecording(seconds, fs=fs, params=params, seed=seed)
+    _, icg = rec.render()
+    pipeline = ICGPipeline(fs, HRVparams)
+    truth = rec.ground_truth()
+    R = np.round(truth['R']).astype(np.int64)
+    llim = pipeline.llim_beat
+    beat_len = int(np.ceil(np.median(np.diff(R))))
+    index = BeatIndex(R, llim, beat_len - llim, len(icg))
+    b_rel, c_rel, x_rel = extract_bcx_points_from_beats(index.matrix(pipeline.bandpass(icg)))
+    return bcx_accuracy(truth, index.R_peaks, b_rel, c_rel, x_rel, llim, fs)
+
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description='Synthetic ECG/ICG recordings with ground-truth B/C/X.')
+    parser.add_argument('output', nargs='?', help='.icgz or .csv file to write')
+    parser.add_argument('--seconds', type=float, default=None)
+    parser.add_argument('--hours', type=float, default=None)
+    parser.add_argument('--fs', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hr', type=float, default=DEFAULTS['hr'])
+    parser.add_argument('--ectopy', type=float, default=DEFAULTS['ectopy'], help='PVC probability per beat')
+    parser.add_argument('--noise', type=float, default=DEFAULTS['noise']['white'], help='white noise sd (relative)')
+    parser.add_argument('--motion', type=float, default=DEFAULTS['noise']['motion'], help='motion artifacts per minute')
+    parser.add_argument('--mains', type=int, default=50)
+    parser.add_argument('--check', action='store_true', help='report extract_bcx_points_from_beats accuracy')
+    args = parser.parse_args()
+
+    params = {'hr': args.hr, 'ectopy': args.ectopy,
+              'noise': {'white': args.noise, 'motion': args.motion, 'mains_hz': args.mains}}
+    seconds = args.seconds if args.seconds is not None or args.hours is not None else 120
+    if args.output:
+        rec = SyntheticRecording(seconds, args.hours, args.fs, params, args.seed)
+        print(rec.write(args.output))
+    if args.check:
+        print(json.dumps(check_extract_bcx(seconds or args.hours * 3600, args.fs, params, args.seed), indent=2))
@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+
+# Why a beat fell back to the cheap denoiser
+DEADLINE_BEAT = 'beat'
+DEADLINE_RECORDING = 'recording'
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised inside EEMD when the time budget of the current beat/recording is used up."""
+
+
+class RunStats:
+    """
+    Timing and deadline statistics of the EEMD stage.
+
+    One instance can collect one recording (ICGPipeline.process(stats=...))
+    or be merged into a long-lived total (ICGPipeline.stats); all updates
+    are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.beat_seconds = []
+        self.beat_deadline_misses = 0
+        self.recording_deadline_misses = 0
+        self.fallback_R_peaks = []
+
+    def add_beat(self, seconds, missed=None):
+        with self._lock:
+            self.beat_seconds.append(seconds)
+            if missed == DEADLINE_BEAT:
+                self.beat_deadline_misses += 1
+            elif missed == DEADLINE_RECORDING:
+                self.recording_deadline_misses += 1
+
+    def add_fallback(self, R_peaks):
+        with self._lock:
+            self.fallback_R_peaks.extend(int(r) for r in R_peaks)
+
+    def merge(self, other):
+        with self._lock:
+            self.beat_seconds.extend(other.beat_seconds)
+            self.beat_deadline_misses += other.beat_deadline_misses
+            self.recording_deadline_misses += other.recording_deadline_misses
+            self.fallback_R_peaks.extend(other.fallback_R_peaks)
+
+    def as_dict(self):
+        """Summary for manifests/logs: counts, total/max/p95 EEMD time per beat (s)."""
+        with self._lock:
+            t = np.asarray(self.beat_seconds, dtype=float)
+            return {
+                'beats': len(t),
+                'fallback_beats': self.beat_deadline_misses + self.recording_deadline_misses,
+                'beat_deadline_misses': self.beat_deadline_misses,
+                'recording_deadline_misses': self.recording_deadline_misses,
+                'eemd_seconds': float(t.sum()),
+                'max_beat_seconds': float(t.max()) if len(t) else 0.0,
+                'p95_beat_seconds': float(np.percentile(t, 95)) if len(t) else 0.0,
+            }
@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+
+# Digital sample reserved by WFDB to mark invalid samples for each format
+WFDB_INVALID = {16: -32768, 212: -2048}
+WFDB_ADCRES = {16: 16, 212: 12}
+
+
+def _auto_gain(x, fmt):
+    """Largest integer gain (adu/unit) that keeps the channel inside the format range."""
+    amp = np.nanmax(np.abs(x)) if len(x) else 0
+    if not np.isfinite(amp) or amp == 0:
+        return 200.0
+    return float(max(np.floor((-WFDB_INVALID[fmt] - 1) / amp), 1))
+
+
+def _pack_212(digital):
+    """Pack a flat int array into format 212 bytes (two 12-bit samples in three bytes)."""
+    d = digital.astype(np.int32) & 0xFFF
+    if len(d) % 2:
+        d = np.append(d, 0)
+    s0 = d[0::2]
+    s1 = d[1::2]
+    out = np.empty((len(s0), 3), dtype=np.uint8)
+    out[:, 0] = s0 & 0xFF
+    out[:, 1] = ((s0 >> 8) & 0x0F) | ((s1 >> 4) & 0xF0)
+    out[:, 2] = s1 & 0xFF
+    return out.ravel()
+
+
+def _unpack_212(raw):
+    """Inverse of _pack_212 for a whole number of byte triplets."""
+    raw = np.asarray(raw, dtype=np.int32).reshape(-1, 3)
+    out = np.empty(2 * len(raw), dtype=np.int32)
+    out[0::2] = raw[:, 0] | ((raw[:, 1] & 0x0F) << 8)
+    out[1::2] = raw[:, 2] | ((raw[:, 1] & 0xF0) << 4)
+    out[out > 2047] -= 4096
+    return out
+
+
+def write_dat(record_name, signals, fs, sig_names=('ECG', 'ICG'), units='mV', gain=None,
+              baseline=0, fmt=16):
+    """
+    Write a multi-channel WFDB signal file (.dat) and its .hea header.
+
+    Parameters:
+        record_name (str): Record path without extension
+        signals (np.ndarray): Physical samples, shape (N,) or (N, nsig)
+        fs (float): Sampling frequency (Hz)
+        sig_names (list of str): Signal descriptions, e.g. ('ECG', 'ICG')
+        units (str or list of str): Physical units per channel
+        gain (float or list): ADC gain (adu/unit); None picks the largest gain
+            that fits each channel in the format range
+        baseline (int or list): Digital value of 0 physical units
+        fmt (int): WFDB storage format, 16 or 212
+
+    Returns:
+        dict: Header fields as returned by read_hea()
+    """
+    if fmt not in WFDB_INVALID:
+        raise ValueError(f"Unsupported WFDB format {fmt}, use 16 or 212")
+
+    signals = np.asarray(signals, dtype=float)
+    if signals.ndim == 1:
+        signals = signals[:, None]
+    nsamp, nsig = signals.shape
+
+    sig_names = list(sig_names)[:nsig] + [f'sig{i}' for i in range(len(sig_names), nsig)]
+    units = [units] * nsig if isinstance(units, str) else list(units)
+    if gain is None:
+        gain = [_auto_gain(signals[:, i], fmt) for i in range(nsig)]
+    elif np.isscalar(gain):
+        gain = [float(gain)] * nsig
+    baseline = [int(baseline)] * nsig if np.isscalar(baseline) else [int(b) for b in baseline]
+
+    invalid = WFDB_INVALID[fmt]
+    digital = np.empty((nsamp, nsig), dtype=np.int32)
+    for i in range(nsig):
+        d = np.round(signals[:, i] * gain[i]) + baseline[i]
+        d = np.clip(d, invalid + 1, -invalid - 1)
+        d[np.isnan(signals[:, i])] = invalid
+        digital[:, i] = d
+
+    dat_file = f"{record_name}.dat"
+    if fmt == 16:
+        digital.astype('<i2').tofile(dat_file)
+    else:
+        _pack_212(digital.ravel()).tofile(dat_file)
+
+    header = {
+        'record_name': os.path.basename(record_name),
+        'nsig': nsig,
+        'fs': fs,
+        'nsamp': nsamp,
+        'signals': [],
+    }
+    for i in range(nsig):
+        header['signals'].append({
+            'file': os.path.basename(dat_file),
+            'fmt': fmt,
+            'gain': gain[i],
+            'baseline': baseline[i],
+            'units': units[i],
+            'adcres': WFDB_ADCRES[fmt],
+            'adczero': 0,
+            'initval': int(digital[0, i]) if nsamp else 0,
+            # WFDB checksum: 16-bit signed sum of all samples of the signal
+            'checksum': int(((digital[:, i].sum() + 32768) % 65536) - 32768),
+            'description': sig_names[i],
+        })
+
+    with open(f"{record_name}.hea", 'w') as f:
+        f.write(f"{header['record_name']} {nsig} {fs} {nsamp}\n")
+        for s in header['signals']:
+            f.write(f"{s['file']} {s['fmt']} {s['gain']:g}({s['baseline']})/{s['units']} "
+                    f"{s['adcres']} {s['adczero']} {s['initval']} {s['checksum']} 0 "
+                    f"{s['description']}\n")
+        f.write("#Creator: HRV_toolbox wfdb_signal.py\n")
+
+    return header
+
+
+def read_hea(record_name):
+    """
+    Parse the .hea header of a record written by write_dat() (or any single-file WFDB record).
+
+    Returns:
+        dict: record_name, nsig, fs, nsamp and one dict per signal with
+            file, fmt, gain, baseline, units and description
+    """
+    with open(f"{record_name}.hea") as f:
+        lines = [ln.strip() for ln in f if ln.strip() and not ln.startswith('#')]
+
+    rec = lines[0].split()
+    header = {
+        'record_name': rec[0],
+        'nsig': int(rec[1]),
+        'fs': float(rec[2].split('/')[0]) if len(rec) > 2 else 250.0,
+        'nsamp': int(rec[3]) if len(rec) > 3 else None,
+        'signals': [],
+    }
+    for line in lines[1:header['nsig'] + 1]:
+        fields = line.split()
+        fmt = int(fields[1].split('x')[0].split(':')[0].split('+')[0])
+        gain, baseline, units = 200.0, 0, 'mV'
+        if len(fields) > 2:
+            spec = fields[2]
+            if '/' in spec:
+                spec, units = spec.split('/', 1)
+            if '(' in spec:
+                spec, b = spec.split('(')
+                baseline = int(b.rstrip(')'))
+            gain = float(spec) or 200.0
+        header['signals'].append({
+            'file': fields[0],
+            'fmt': fmt,
+            'gain': gain,
+            'baseline': baseline,
+            'units': units,
+            'description': ' '.join(fields[8:]) if len(fields) > 8 else f"sig{len(header['signals'])}",
+        })
+    return header
+
+
+class WFDBRecord:
+    """
+    Random-access view of a WFDB record (format 16 or 212, one .dat file).
+
+    The .dat file is opened as an np.memmap; gain and baseline are applied
+    only to the rows that are sliced, so a multi-hour recording can be read
+    piecewise without loading it.
+
+    Usage:
+        rec = WFDBRecord('Subject_1_BL')
+        ecg = rec.signal('ECG', 0, 60 * rec.fs)   # first minute, mV
+        block = rec[1000:2000]                   # (1000, nsig) physical
+    """
+
+    def __init__(self, record_name):
+        self.header = read_hea(record_name)
+        self.fs = self.header['fs']
+        self.nsig = self.header['nsig']
+        self.sig_names = [s['description'] for s in self.header['signals']]
+        self.gain = np.array([s['gain'] for s in self.header['signals']])
+        self.baseline = np.array([s['baseline'] for s in self.header['signals']])
+        self.fmt = self.header['signals'][0]['fmt']
+        if any(s['fmt'] != self.fmt or s['file'] != self.header['signals'][0]['file']
+               for s in self.header['signals']):
+            raise ValueError("Only records stored in a single .dat file with one format are supported")
+
+        dat_file = os.path.join(os.path.dirname(record_name), self.header['signals'][0]['file'])
+        if self.fmt == 16:
+            self.digital = np.memmap(dat_file, dtype='<i2', mode='r')
+            self.digital = self.digital[:len(self.digital) // self.nsig * self.nsig].reshape(-1, self.nsig)
+            nsamp = len(self.digital)
+        elif self.fmt == 212:
+            self.digital = np.memmap(dat_file, dtype=np.uint8, mode='r')
+            nsamp = (len(self.digital) // 3 * 2) // self.nsig
+        else:
+            raise ValueError(f"Unsupported WFDB format {self.fmt}")
+        self.nsamp = min(self.header['nsamp'], nsamp) if self.header['nsamp'] else nsamp
+
+    def __len__(self):
+        return self.nsamp
+
+    def read_digital(self, start=0, stop=None):
+        """Digital samples of rows [start, stop) as an int array of shape (n, nsig)."""
+        start, stop, _ = slice(start, stop).indices(self.nsamp)
+        stop = max(stop, start)
+        if self.fmt == 16:
+            return np.asarray(self.digital[start:stop], dtype=np.int32)
+        k0, k1 = start * self.nsig, stop * self.nsig
+        p0, p1 = k0 // 2, (k1 + 1) // 2
+        flat = _unpack_212(self.digital[3 * p0:3 * p1])
+        return flat[k0 - 2 * p0:k1 - 2 * p0].reshape(-1, self.nsig)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("WFDBRecord only supports contiguous slices")
+        digital = self.read_digital(key.start, key.stop)
+        physical = (digital - self.baseline) / self.gain
+        physical[digital == WFDB_INVALID[self.fmt]] = np.nan
+        return physical
+
+    def signal(self, name, start=0, stop=None):
+        """Physical samples of one channel, selected by description or index."""
+        idx = self.sig_names.index(name) if isinstance(name, str) else int(name)
+        return self[int(start):None if stop is None else int(stop)][:, idx]
@@ -1,27 +1,44 @@
 import numpy as np
 
-def wqrsm_fast(data, Fs=125, PWfreq=60, TmDEF=100, jflag=0):
-    BUFLN = 16384
-    EYE_CLS = 0.25
-    MaxQRSw = 0.13
-    NDP = 2.5
-    WFDB_DEFGAIN = 200.0
-
-    # === Gain scaling ===
-    datatest = data[:(len(data) // Fs) * Fs]
-    if len(datatest) > Fs:
-        datatest = datatest.reshape((-1, Fs))
-    # 兼容 1D 和 2D 数据
-    if datatest.ndim == 1:
-        test_ap = np.max(datatest) - np.min(datatest)
-    else:
-        test_ap = np.median(np.max(datatest, axis=1) - np.min(datatest, axis=1))
-
-    if test_ap < 10:
-        data = data * WFDB_DEFGAIN
-
-    # === 初始化 swqrsm 状态 ===
-    lfsc = int(1.25 * WFDB_DEFGAIN**2 / Fs)
+from compute_backend import example_ecg, get_kernel, kernel
+
+BUFLN = 16384
+EYE_CLS = 0.25
+MaxQRSw = 0.13
+NDP = 2.5
+WFDB_DEFGAIN = 200.0
+
+
+def _ltsamp(t, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow):
+    """
+    Length-transform sample at time t, advancing the filter state up to t.
+    fstate = [Yn, Yn1, Yn2], istate = [lt_tt, aet].
+    """
+    n = len(data)
+    while t > istate[0]:
+        fstate[2] = fstate[1]
+        fstate[1] = fstate[0]
+        tt = istate[0]
+        v0 = data[tt] if 0 < tt < n else data[0]
+        v1 = data[tt - LPn] if 0 < tt - LPn < n else data[0]
+        v2 = data[tt - LP2n] if 0 < tt - LP2n < n else data[0]
+
+        fstate[0] = 2 * fstate[1] - fstate[2] + v0 - 2 * v1 + v2
+        dy = int((fstate[0] - fstate[1]) / LP2n)
+        istate[0] += 1
+        et = int(np.sqrt(lfsc + dy * dy))
+        id = istate[0] % BUFLN
+        ebuf[id] = et
+        id2 = (istate[0] - LTwindow) % BUFLN
+        istate[1] += et - ebuf[id2]
+        lbuf[id] = istate[1]
+    return lbuf[t % BUFLN]
+
+
+@kernel('wqrsm', helpers=(_ltsamp,), example=lambda rng: (example_ecg(rng, 125, gain=200.0), 125, 60, 100, 1))
+def wqrsm_kernel(data, Fs, PWfreq, TmDEF, jflag):
+    """Detection loop of wqrsm on gain-scaled data; returns (qrs, jpoints) sample arrays."""
+    lfsc = int(1.25 * WFDB_DEFGAIN ** 2 / Fs)
     LPn = min(int(Fs / PWfreq), 8)
     LP2n = 2 * LPn
     EyeClosing = int(Fs * EYE_CLS)
@@ -29,56 +46,26 @@ def wqrsm_fast(data, Fs=125, PWfreq=60, TmDEF=100, jflag=0):
     LTwindow = int(Fs * MaxQRSw)
     Tm = int(TmDEF / 5.0)
 
-    swqrsm = {
-        'data': data,
-        'lfsc': lfsc,
-        'LPn': LPn,
-        'LP2n': LP2n,
-        'LTwindow': LTwindow,
-        'BUFLN': BUFLN,
-        'lbuf': np.zeros(BUFLN),
-        'ebuf': np.full(BUFLN, np.sqrt(lfsc), dtype=int),
-        'lt_tt': 0,
-        'aet': 0,
-        'Yn': 0,
-        'Yn1': 0,
-        'Yn2': 0
-    }
-
-    def ltsamp(t, swqrsm):
-        while t > swqrsm['lt_tt']:
-            swqrsm['Yn2'] = swqrsm['Yn1']
-            swqrsm['Yn1'] = swqrsm['Yn']
-            tt = swqrsm['lt_tt']
-            v0 = swqrsm['data'][tt] if 0 < tt < len(swqrsm['data']) else swqrsm['data'][0]
-            v1 = swqrsm['data'][tt - swqrsm['LPn']] if 0 < tt - swqrsm['LPn'] < len(swqrsm['data']) else swqrsm['data'][0]
-            v2 = swqrsm['data'][tt - swqrsm['LP2n']] if 0 < tt - swqrsm['LP2n'] < len(swqrsm['data']) else swqrsm['data'][0]
-
-            swqrsm['Yn'] = 2 * swqrsm['Yn1'] - swqrsm['Yn2'] + v0 - 2 * v1 + v2
-            dy = int((swqrsm['Yn'] - swqrsm['Yn1']) / swqrsm['LP2n'])
-            swqrsm['lt_tt'] += 1
-            et = int(np.sqrt(swqrsm['lfsc'] + dy * dy))
-            id = swqrsm['lt_tt'] % swqrsm['BUFLN']
-            swqrsm['ebuf'][id] = et
-            id2 = (swqrsm['lt_tt'] - swqrsm['LTwindow']) % swqrsm['BUFLN']
-            swqrsm['aet'] += et - swqrsm['ebuf'][id2]
-            swqrsm['lbuf'][id] = swqrsm['aet']
-
-        id3 = t % swqrsm['BUFLN']
-        swqrsm['lt_data'] = swqrsm['lbuf'][id3]
-        return swqrsm
+    fstate = np.zeros(3)
+    istate = np.zeros(2, dtype=np.int64)
+    lbuf = np.zeros(BUFLN)
+    ebuf = np.full(BUFLN, int(np.sqrt(lfsc)), dtype=np.int64)
 
     # === 初始化滤波器 ===
     t1 = min(Fs * 8, int(BUFLN * 0.5))
-    T0 = 0
+    T0 = 0.0
     for t in range(1, t1 + 1):
-        swqrsm = ltsamp(t, swqrsm)
-        T0 += swqrsm['lt_data']
+        T0 += _ltsamp(t, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow)
     T0 /= t1
     Ta = 3 * T0
 
-    qrs = []
-    jpoints = []
+    # 每次检测后跳过 EyeClosing 个样本, 检测数不会超过 len(data) / (EyeClosing + 1) + 1
+    max_beats = len(data) // (EyeClosing + 1) + 1
+    qrs = np.empty(max_beats, dtype=np.int64)
+    jpoints = np.empty(max_beats, dtype=np.int64)
+    n_qrs = 0
+    n_j = 0
+    d = np.empty(5)
     learning = True
     t = 1
     T1 = 2 * T0
@@ -92,41 +79,38 @@ def wqrsm_fast(data, Fs=125, PWfreq=60, TmDEF=100, jflag=0):
             t = 1
             continue
 
-        swqrsm = ltsamp(t, swqrsm)
-        if swqrsm['lt_data'] > T1:
+        lt_data = _ltsamp(t, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow)
+        if lt_data > T1:
             timer_d = 0
-            maxd = swqrsm['lt_data']
+            maxd = lt_data
             mind = maxd
             for tt in range(t + 1, t + EyeClosing // 2):
-                swqrsm = ltsamp(tt, swqrsm)
-                maxd = max(maxd, swqrsm['lt_data'])
+                maxd = max(maxd, _ltsamp(tt, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow))
             for tt in range(t - 1, t - EyeClosing // 2, -1):
-                swqrsm = ltsamp(tt, swqrsm)
-                mind = min(mind, swqrsm['lt_data'])
+                mind = min(mind, _ltsamp(tt, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow))
 
             if maxd > mind + 10:
                 onset = int(maxd / 100) + 2
                 tpq = t - 5
                 for tt in range(t, t - EyeClosing // 2, -1):
-                    d = []
                     for i in range(5):
-                        swqrsm = ltsamp(tt - i, swqrsm)
-                        d.append(swqrsm['lt_data'])
-                    if all(d[i] - d[i + 1] < onset for i in range(4)):
-                        tpq = tt - swqrsm['LP2n']
+                        d[i] = _ltsamp(tt - i, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow)
+                    if d[0] - d[1] < onset and d[1] - d[2] < onset and d[2] - d[3] < onset and d[3] - d[4] < onset:
+                        tpq = tt - LP2n
                         break
 
                 if not learning and tpq < len(data):
-                    qrs.append(tpq)
+                    qrs[n_qrs] = tpq
+                    n_qrs += 1
                     if jflag:
                         tj = t + 5
                         for tt in range(t, t + EyeClosing // 2):
-                            swqrsm = ltsamp(tt, swqrsm)
-                            if swqrsm['lt_data'] > maxd - int(maxd / 10):
+                            if _ltsamp(tt, data, fstate, istate, lbuf, ebuf, lfsc, LPn, LP2n, LTwindow) > maxd - int(maxd / 10):
                                 tj = tt
                                 break
                         if tj < len(data):
-                            jpoints.append(tj)
+                            jpoints[n_j] = tj
+                            n_j += 1
 
                 Ta += (maxd - Ta) / 10
                 T1 = Ta / 3
@@ -138,4 +122,23 @@ def wqrsm_fast(data, Fs=125, PWfreq=60, TmDEF=100, jflag=0):
                 T1 = Ta / 3
         t += 1
 
-    return qrs, jpoints if jflag else []
+    return qrs[:n_qrs], jpoints[:n_j]
+
+
+def wqrsm_fast(data, Fs=125, PWfreq=60, TmDEF=100, jflag=0, backend=None):
+
+    # === Gain scaling ===
+    datatest = data[:(len(data) // Fs) * Fs]
+    if len(datatest) > Fs:
+        datatest = datatest.reshape((-1, Fs))
+    # 兼容 1D 和 2D 数据
+    if datatest.ndim == 1:
+        test_ap = np.max(datatest) - np.min(datatest)
+    else:
+        test_ap = np.median(np.max(datatest, axis=1) - np.min(datatest, axis=1))
+
+    if test_ap < 10:
+        data = data * WFDB_DEFGAIN
+
+    qrs, jpoints = get_kernel('wqrsm', backend)(np.asarray(data, dtype=np.float64), Fs, PWfreq, TmDEF, jflag)
+    return qrs.tolist(), jpoints.tolist() if jflag else []
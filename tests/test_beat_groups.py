@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from icg_cli import main
+from icg_pipeline import beat_groups
+
+
+def test_beat_groups_with_step():
+    t = np.arange(10.0)
+    assert beat_groups(t, group_beats=4, step=2) == [(0, 4), (2, 6), (4, 8), (6, 10)]
+    assert beat_groups(t, group_beats=4, step=2.0) == beat_groups(t, group_beats=4, step=2)
+
+
+@pytest.mark.parametrize('step', [0, 0.5, 1.5, -1])
+def test_beat_groups_rejects_fractional_beat_step(step):
+    with pytest.raises(ValueError, match='whole number of beats'):
+        beat_groups(np.arange(10.0), group_beats=4, step=step)
+
+
+def test_cli_rejects_fractional_beat_step(capsys):
+    with pytest.raises(SystemExit) as exc:
+        main(['bcx', 'missing.xlsx', '--group-beats', '30', '--step', '0.5'])
+    assert exc.value.code == 2
+    assert '--step must be a whole number of beats' in capsys.readouterr().err
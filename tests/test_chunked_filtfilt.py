@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from scipy.signal import butter, filtfilt, sosfiltfilt
+
+from chunked_filtfilt import chunked_filtfilt, chunked_sosfiltfilt, sos_halo
+from jqrs import jqrs_fir_template
+
+FS = 1000
+SOS = butter(4, [0.5 / (FS / 2), 40 / (FS / 2)], btype='band', output='sos')
+FIR = np.asarray(jqrs_fir_template(250))
+CHUNK = 4096
+
+
+def _signal(n, dtype=np.float64, seed=0):
+    rng = np.random.default_rng(seed)
+    return (np.cumsum(rng.standard_normal(n)) * 0.01 + rng.standard_normal(n)).astype(dtype)
+
+
+def _rel_err(y, ref):
+    return np.max(np.abs(y - ref)) / np.max(np.abs(ref))
+
+
+def _lengths(halo):
+    # 单块 / 刚好单块 / 多一个样本 / 整数块 / 末块只有一个样本 / 末块短于 halo
+    return [1000, CHUNK + 2 * halo, CHUNK + 2 * halo + 1, 4 * CHUNK, 4 * CHUNK + 1, 3 * CHUNK + halo // 2]
+
+
+@pytest.mark.parametrize('chunk_size', [512, CHUNK, 1 << 18])
+@pytest.mark.parametrize('workers', [1, 3])
+def test_sos_matches_sosfiltfilt(chunk_size, workers):
+    x = _signal(5 * CHUNK + 17)
+    ref = sosfiltfilt(SOS, x)
+    y = chunked_sosfiltfilt(SOS, x, chunk_size=chunk_size, workers=workers)
+    assert y.dtype == np.float64
+    assert _rel_err(y, ref) < 1e-8
+
+
+@pytest.mark.parametrize('n', _lengths(sos_halo(SOS)))
+def test_sos_edge_lengths(n):
+    x = _signal(n, seed=n)
+    # halo (~16k samples) 远大于块长时, 截断的脉冲响应尾部累积到 ~1e-8
+    assert _rel_err(chunked_sosfiltfilt(SOS, x, chunk_size=CHUNK), sosfiltfilt(SOS, x)) < 1e-7
+
+
+@pytest.mark.parametrize('n', _lengths(len(FIR)))
+@pytest.mark.parametrize('chunk_size', [256, CHUNK])
+def test_fir_matches_filtfilt(n, chunk_size):
+    x = _signal(n, seed=n)
+    ref = filtfilt(FIR, [1], x)
+    assert _rel_err(chunked_filtfilt(FIR, [1], x, chunk_size=chunk_size), ref) < 1e-10
+
+
+def test_iir_ba_matches_sosfiltfilt():
+    b, a = butter(2, [5 / (FS / 2), 30 / (FS / 2)], btype='band')
+    x = _signal(6 * CHUNK)
+    ref = sosfiltfilt(butter(2, [5 / (FS / 2), 30 / (FS / 2)], btype='band', output='sos'), x)
+    assert _rel_err(chunked_filtfilt(b, a, x, chunk_size=CHUNK), ref) < 1e-8
+
+
+@pytest.mark.parametrize('in_dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('out_dtype', [np.float32, np.float64])
+def test_dtypes(in_dtype, out_dtype):
+    x = _signal(5 * CHUNK + 3, in_dtype)
+    ref = sosfiltfilt(SOS, x.astype(np.float64))
+    y = chunked_sosfiltfilt(SOS, x, chunk_size=CHUNK, dtype=out_dtype)
+    assert y.dtype == out_dtype
+    # float32 的精度限制: 输入或输出为 float32 时按单精度比较
+    tol = 1e-8 if in_dtype == out_dtype == np.float64 else 1e-5
+    assert _rel_err(y.astype(np.float64), ref) < tol
+
+    y = chunked_filtfilt(FIR, [1], x, chunk_size=CHUNK, dtype=out_dtype)
+    assert y.dtype == out_dtype
+    assert _rel_err(y.astype(np.float64), filtfilt(FIR, [1], x.astype(np.float64))) < tol
+
+
+def test_preallocated_output():
+    x = _signal(3 * CHUNK)
+    out = np.full(len(x), np.nan)
+    y = chunked_sosfiltfilt(SOS, x, chunk_size=CHUNK, out=out)
+    assert y is out
+    assert _rel_err(out, sosfiltfilt(SOS, x)) < 1e-8
+
+
+def test_too_short_signal_raises_like_sosfiltfilt():
+    x = _signal(10)
+    with pytest.raises(ValueError):
+        sosfiltfilt(SOS, x)
+    with pytest.raises(ValueError):
+        chunked_sosfiltfilt(SOS, x)
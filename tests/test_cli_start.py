@@ -0,0 +1,26 @@
+import numpy as np
+
+from icg_cli import main
+from synthetic_recording import SyntheticRecording
+
+
+def _csv(tmp_path, fs):
+    ecg, icg = SyntheticRecording(90, fs=fs, seed=1).render()
+    path = tmp_path / 'recording.csv'
+    np.savetxt(path, np.column_stack([ecg, icg]), delimiter=',')
+    return str(path)
+
+
+def test_detect_qrs_reports_peaks_from_the_start_of_the_recording(tmp_path):
+    fs = 250
+    recording = _csv(tmp_path, fs)
+    main(['detect-qrs', recording, '--fs', str(fs), '-o', str(tmp_path / 'all.csv')])
+    main(['detect-qrs', recording, '--fs', str(fs), '--start', '30', '-o', str(tmp_path / 'part.csv')])
+    full = np.loadtxt(tmp_path / 'all.csv', delimiter=',', skiprows=1)
+    part = np.loadtxt(tmp_path / 'part.csv', delimiter=',', skiprows=1)
+    assert part[0, 0] >= 30 * fs
+    np.testing.assert_allclose(part[:, 1], part[:, 0] / fs, atol=1e-3)
+    # 与整段检测的峰位一致 (切片开头附近的 QRS 除外)
+    inner = part[part[:, 0] > 31 * fs, 0]
+    dist = np.abs(inner[:, None] - full[None, :, 0]).min(axis=1)
+    assert len(inner) and np.all(dist <= 1)
@@ -0,0 +1,33 @@
+import threading
+
+import numpy as np
+
+import instrumentation
+
+
+def test_memory_peak_survives_spans_opened_in_other_threads():
+    recorder = instrumentation.Recorder(memory=True).start()
+    allocated = threading.Event()
+    other_done = threading.Event()
+
+    def other():
+        allocated.wait()
+        # 另一个线程在 'main' 仍在运行时打开阶段, 会重置进程级的 tracemalloc 峰值
+        with recorder.span('other'):
+            np.ones(10)
+        other_done.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    try:
+        with recorder.span('main'):
+            block = np.ones(50 * 2 ** 20, dtype=np.uint8)
+            del block
+            allocated.set()
+            other_done.wait()
+    finally:
+        thread.join()
+        recorder.stop()
+    stages = recorder.report()['stages']
+    assert stages['main']['peak_alloc_bytes'] >= 50 * 2 ** 20
+    assert stages['other']['peak_alloc_bytes'] < 2 ** 20
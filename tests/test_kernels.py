@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import reference_kernels as ref
+from InitializeHRVparams import InitializeHRVparams
+from compute_backend import example_ecg, get_kernel, numba_available
+from icg_pipeline import lms_filter
+from jqrs import jqrs_merge_kernel
+from run_sqrs import run_sqrs
+from wqrsm_fast import wqrsm_fast
+
+BACKENDS = ['python', pytest.param('numba', marks=pytest.mark.skipif(not numba_available(),
+                                                                      reason='numba is not installed'))]
+
+
+def _params(fs, backend):
+    HRVparams = InitializeHRVparams('test', makedirs=False)
+    HRVparams['Fs'] = fs
+    HRVparams['compute'] = {'backend': backend}
+    return HRVparams
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('fs,rs', [(250, 0), (250, 1), (1000, 1)])
+def test_sqrs_matches_reference(backend, fs, rs):
+    ecg = example_ecg(np.random.default_rng(0), fs, seconds=60)
+    HRVparams = _params(fs, backend)
+    np.testing.assert_array_equal(run_sqrs(ecg, HRVparams, rs), ref.run_sqrs(ecg, HRVparams, rs))
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('jflag', [0, 1])
+def test_wqrsm_matches_reference(backend, jflag):
+    ecg = example_ecg(np.random.default_rng(1), 125, seconds=60, gain=200.0)
+    qrs, jpoints = wqrsm_fast(ecg, 125, jflag=jflag, backend=backend)
+    ref_qrs, ref_jpoints = ref.wqrsm_fast(ecg, 125, jflag=jflag)
+    assert qrs == list(ref_qrs)
+    assert jpoints == list(ref_jpoints)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('sign', [1.0, -1.0])
+def test_jqrs_merge_matches_reference(backend, sign):
+    rng = np.random.default_rng(2)
+    ecg = rng.standard_normal(20000)
+    # 区间间隔有大有小, 覆盖不应期内的替换与跳过
+    left = np.sort(rng.choice(19950, 600, replace=False))
+    right = left + rng.integers(1, 30, len(left))
+    maxloc, maxval = get_kernel('jqrs_merge', backend)(ecg, left, right, bool(sign > 0), 250 * 0.25)
+    ref_loc, ref_val = ref.jqrs_merge(ecg, left, right, sign, 250, 0.25)
+    np.testing.assert_array_equal(maxloc, ref_loc)
+    np.testing.assert_array_equal(maxval, ref_val)
+    assert get_kernel('jqrs_merge', 'python') is jqrs_merge_kernel
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_lms_matches_reference(backend, dtype):
+    rng = np.random.default_rng(3)
+    desired = rng.standard_normal(4000).astype(dtype)
+    signal = (desired + 0.1 * rng.standard_normal(4000)).astype(dtype)
+    out = lms_filter(signal, desired, mu=0.01, order=5, backend=backend)
+    expected = ref.lms_filter(signal, desired, mu=0.01, order=5)
+    assert out.dtype == expected.dtype
+    # 逐项累加与 np.dot 的舍入顺序不同
+    np.testing.assert_allclose(out, expected, rtol=1e-9 if dtype == np.float64 else 1e-4, atol=1e-12)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+from InitializeHRVparams import InitializeHRVparams
+from annotation_writer import AnnotationWriter
+from beat_index import BeatIndex
+from icg_pipeline import ICGPipeline, cascade_delay, refine_points
+from synthetic_recording import SyntheticRecording
+
+
+@pytest.mark.parametrize('q', [2, 4, 8])
+def test_multirate_refinement_matches_synthetic_c_and_x(q):
+    fs = 1000
+    rec = SyntheticRecording(60, fs=fs, seed=2)
+    _, icg = rec.render()
+    truth = rec.ground_truth()
+    HRVparams = InitializeHRVparams('test', makedirs=False)
+    HRVparams['ICG']['eemd'] = 0
+    pipeline = ICGPipeline(fs, HRVparams)
+    filtered = pipeline.bandpass(icg)
+
+    # 与 process_multirate() 相同: 降采样后去噪, 粗定位, 减去级联延迟后在全采样率上精定位
+    R = np.round(truth['R'][1:-1]).astype(np.int64)
+    low = resample_poly(filtered, 1, q)
+    llim = int(round(pipeline.llim_beat / q))
+    index = BeatIndex(np.round(R / q).astype(np.int64), llim, int(round(0.8 * fs / q)) - llim, len(low))
+    beats = index.matrix(low)
+    denoised = np.array(pipeline.denoise(beats)[0])
+    delay = cascade_delay(denoised, beats)
+    starts = index.starts * q
+
+    for name, kind, pick in (('C', 'max', np.argmax), ('X', 'min', np.argmin)):
+        true_pos = truth[name][1:-1][index.valid]
+        # 粗定位: 去噪后低采样率心搏在真实位置 +-60 ms 内的极值 (含去噪级联的延迟)
+        centre = np.round((true_pos - starts) / q).astype(int)
+        w = int(0.06 * fs / q)
+        coarse = np.array([c - w + pick(beat[c - w:c + w + 1]) for beat, c in zip(denoised, centre)], dtype=float)
+        refined = refine_points(filtered, starts + (coarse - delay) * q, kind, 2 * q)
+        err_ms = (refined - true_pos) / fs * 1000
+        assert abs(np.median(err_ms)) < 4, (name, np.median(err_ms))
+
+
+@pytest.mark.parametrize('q', [2, 4])
+def test_process_multirate_matches_the_path_by_hand(q):
+    fs = 1000
+    ecg, icg = SyntheticRecording(60, fs=fs, seed=2).render()
+    HRVparams = InitializeHRVparams('test', makedirs=False)
+    HRVparams['Fs'] = fs
+    HRVparams['ICG']['eemd'] = 0
+    pipeline = ICGPipeline(fs, HRVparams)
+    with AnnotationWriter(in_memory=True) as writer:
+        res = pipeline.process_multirate(ecg, icg, writer=writer, decimate=q)
+    with AnnotationWriter(in_memory=True) as writer:
+        _, _, beat_len, filtered, _, R = pipeline.process(ecg, icg, writer=writer)
+
+    # 由 process() 的 R 峰与带通信号逐步复现: 降采样去噪, extract_bcx 粗定位, 减去级联延迟, 全采样率精定位
+    R = np.asarray(R)
+    low = resample_poly(filtered, 1, q)
+    llim = int(round(pipeline.llim_beat / q))
+    index = BeatIndex(np.round(R / q).astype(np.int64), llim, int(round(beat_len / q)) - llim, len(low))
+    R = R[index.valid]
+    beats = index.matrix(low)
+    denoised = np.array(pipeline.denoise(beats)[0])
+    delay = cascade_delay(denoised, beats)
+    starts = index.starts * q
+    b0, c0, x0 = (np.array(v, dtype=float) for v in pipeline.extract_bcx(denoised))
+
+    np.testing.assert_array_equal(res['R_peaks'], R)
+    assert len(R) > 50
+    for key, coarse, kind in (('b', b0, 'd3min'), ('c', c0, 'max'), ('x', x0, 'min')):
+        expected = refine_points(filtered, starts + (coarse - delay) * q, kind, 2 * q)
+        np.testing.assert_allclose(res[key], expected)
+    np.testing.assert_allclose(res['pep'], (res['b'] - R) / fs)
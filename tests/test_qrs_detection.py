@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from InitializeHRVparams import InitializeHRVparams
+from run_qrsdet_by_seg import run_qrsdet_by_seg
+from synthetic_recording import SyntheticRecording
+
+
+@pytest.mark.parametrize('fs', [250, 1000])
+def test_run_qrsdet_by_seg_finds_synthetic_r_peaks(fs):
+    rec = SyntheticRecording(90, fs=fs, seed=1)
+    ecg, _ = rec.render()
+    HRVparams = InitializeHRVparams('test', makedirs=False)
+    HRVparams['Fs'] = fs
+    R = np.asarray(run_qrsdet_by_seg(ecg, HRVparams))
+    truth = rec.ground_truth()['R']
+    dist = np.abs(truth[:, None] - R[None, :]).min(axis=1)
+    # 每个真实 R 峰 10 ms 内都有检测 (记录末尾被截断的 QRS 除外), 且没有多余检测
+    inside = truth < len(ecg) - 0.1 * fs
+    assert np.all(dist[inside] <= 0.01 * fs)
+    assert len(R) == len(truth)